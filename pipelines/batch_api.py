@@ -0,0 +1,84 @@
+import json, time, hashlib
+from pathlib import Path
+from pipelines.llm_client import client, usage, log_cost, MODEL, TEMPERATURE, MAX_TOKENS
+
+MAX_REQUESTS_PER_FILE = 50000  # Batch API limit per input file
+TERMINAL = {"completed", "failed", "expired", "cancelled"}
+api = client.with_options(max_retries=3)  # uploads/polls are cheap to retry, unlike generations
+
+def chat_request(custom_id, prompt, system_prompt=None, model=None, max_tokens=None, temperature=None, top_p=None):
+    """One Batch API input line with the same parameters generate() would send."""
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    messages.append({"role": "user", "content": prompt})
+    body = {"model": model or MODEL, "messages": messages,
+            "temperature": TEMPERATURE if temperature is None else temperature,
+            "max_tokens": max_tokens or MAX_TOKENS}
+    if top_p is not None: body["top_p"] = top_p
+    return {"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body}
+
+def _wait(batch_id, poll_interval):
+    while True:
+        batch = api.batches.retrieve(batch_id)
+        rc = batch.request_counts
+        print(f"    {batch_id}: {batch.status}" + (f" ({rc.completed}/{rc.total} done, {rc.failed} failed)" if rc else ""))
+        if batch.status in TERMINAL: return batch
+        time.sleep(poll_interval)
+
+def _collect(batch, purpose, log):
+    results = {}
+    for file_id in [batch.output_file_id, batch.error_file_id]:
+        if not file_id: continue
+        for line in api.files.content(file_id).text.splitlines():
+            if not line.strip(): continue
+            obj = json.loads(line)
+            resp = obj.get("response") or {}
+            if resp.get("status_code") == 200:
+                body = resp["body"]
+                u = body.get("usage", {})
+                cost = log_cost(body.get("model", MODEL), u.get("prompt_tokens", 0), u.get("completion_tokens", 0),
+                                purpose, batch=True) if log else 0.0
+                results[obj["custom_id"]] = {"text": body["choices"][0]["message"]["content"],
+                    "input_tokens": u.get("prompt_tokens", 0), "output_tokens": u.get("completion_tokens", 0),
+                    "cost_usd": cost}
+            else:
+                results[obj["custom_id"]] = {"error": obj.get("error") or resp.get("body", {}).get("error")}
+    return results
+
+def run_batch(requests, path, purpose, poll_interval=30):
+    """Submit chat requests through the Batch API, wait for them and return
+    {custom_id: {"text", "input_tokens", "output_tokens", "cost_usd"} | {"error"}}.
+
+    Inputs are written to `path` (split at the per-file request limit). Submitted batch ids
+    are recorded in `<path>.state.json` by content hash, so an interrupted run resumes
+    polling the same batches instead of paying for them twice; cost is logged once per
+    batch at batch pricing. Requests missing from the result expired or were cancelled."""
+    path = Path(path); path.parent.mkdir(parents=True, exist_ok=True)
+    state_fp = path.with_suffix(".state.json")
+    state = json.load(open(state_fp)) if state_fp.exists() else {"batches": {}, "logged": []}
+    batch_ids = []
+    for part, start in enumerate(range(0, len(requests), MAX_REQUESTS_PER_FILE)):
+        data = "".join(json.dumps(r) + "\n" for r in requests[start:start+MAX_REQUESTS_PER_FILE])
+        digest = hashlib.sha256(data.encode()).hexdigest()
+        if digest not in state["batches"]:
+            usage.check_budget()
+            part_fp = path if start == 0 and len(requests) <= MAX_REQUESTS_PER_FILE else path.with_name(f"{path.stem}.part{part}.jsonl")
+            part_fp.write_text(data)
+            with open(part_fp, "rb") as f:
+                upload = api.files.create(file=f, purpose="batch")
+            batch = api.batches.create(input_file_id=upload.id, endpoint="/v1/chat/completions",
+                                       completion_window="24h", metadata={"purpose": purpose})
+            state["batches"][digest] = batch.id
+            json.dump(state, open(state_fp, "w"), indent=2)
+            print(f"  Submitted {batch.id}: {data.count(chr(10))} {purpose} requests")
+        batch_ids.append(state["batches"][digest])
+    results = {}
+    for batch_id in batch_ids:
+        batch = _wait(batch_id, poll_interval)
+        results.update(_collect(batch, purpose, log=batch_id not in state["logged"]))
+        if batch_id not in state["logged"]:
+            state["logged"].append(batch_id)
+            json.dump(state, open(state_fp, "w"), indent=2)
+    usage.flush()
+    return results
@@ -1,12 +1,12 @@
-import json
+import numpy as np
 from rank_bm25 import BM25Okapi
-from pathlib import Path
+from pipelines import storage
  
 class BM25Pipeline:
     def __init__(self, corpus_dir="data/processed"):
         self.corpus, self.metadata = [], []
-        for fp in Path(corpus_dir).glob("entities_*.json"):
-            for e in json.load(open(fp)):
+        for fp in storage.glob(corpus_dir, "entities_*"):
+            for e in storage.load_records(fp, ["id","type","title","body","content","name","text_payload"]):
                 text = " ".join(filter(None,[e.get("title",""),e.get("body",""),
                     e.get("content",""),e.get("name",""),e.get("text_payload","")])).strip()
                 if len(text) > 20:
@@ -21,3 +21,19 @@ class BM25Pipeline:
         scores = self.bm25.get_scores(query.lower().split())
         top_idx = scores.argsort()[-top_k:][::-1]
         return [{"text":self.corpus[i],"score":float(scores[i]),"metadata":self.metadata[i]} for i in top_idx]
+ 
+    def retrieve_batch(self, queries, top_k=10):
+        # Score each distinct term once for the whole batch; get_scores is a linear scan per term
+        tokenized = [q.lower().split() for q in queries]
+        scores = np.zeros((len(queries), len(self.corpus)))
+        postings = {}
+        for qi, toks in enumerate(tokenized):
+            for t in toks: postings.setdefault(t, []).append(qi)
+        for t, qis in postings.items():
+            ts = self.bm25.get_scores([t])
+            for qi in qis: scores[qi] += ts
+        out = []
+        for row in scores:
+            top_idx = row.argsort()[-top_k:][::-1]
+            out.append([{"text":self.corpus[i],"score":float(row[i]),"metadata":self.metadata[i]} for i in top_idx])
+        return out
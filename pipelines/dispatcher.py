@@ -0,0 +1,144 @@
+import random, re, threading, time
+import openai
+
+class CircuitOpen(RuntimeError):
+    pass
+
+def parse_reset(value):
+    """Seconds from an OpenAI reset header such as "1s", "6m0s", "250ms" or "0.5"."""
+    if value is None: return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    parts = re.findall(r"([\d.]+)(ms|s|m|h)", value)
+    return sum(float(n) * units[u] for n, u in parts) if parts else None
+
+def is_retryable(exc):
+    if isinstance(exc, openai.RateLimitError):
+        # An exhausted account quota is also a 429 but will not recover by waiting
+        body = getattr(exc, "body", None) or {}
+        code = body.get("code") if isinstance(body, dict) else None
+        return code != "insufficient_quota"
+    if isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code in (408, 409) or exc.status_code >= 500
+    return False
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `per_minute / 60` per second."""
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.blocked_until = 0.0
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def take(self, n):
+        """Block until `n` tokens are available (requests larger than the bucket wait for a full one)."""
+        n, waited = min(float(n), self.capacity), 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.blocked_until and self.tokens >= n:
+                    self.tokens -= n
+                    return waited
+                wait = max(self.blocked_until - now, (n - self.tokens) / self.rate)
+            time.sleep(wait); waited += wait
+
+    def sync(self, limit=None, remaining=None, reset=None):
+        """Align with the server's view of the quota from rate-limit response headers."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if limit:
+                self.capacity, self.rate = float(limit), limit / 60.0
+            if remaining is not None:
+                self.tokens = min(self.tokens, float(remaining))
+                if remaining <= 0 and reset:
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + reset)
+
+class AdaptiveDispatcher:
+    """Paces API calls against request and token quotas, retries only retryable errors
+    (honoring retry-after / x-ratelimit-reset-*), and opens a circuit breaker after
+    `breaker_threshold` consecutive failures so callers fail fast for `breaker_cooldown`s."""
+    def __init__(self, requests_per_minute=500, tokens_per_minute=300000, max_attempts=6,
+                 base_delay=1.0, max_delay=60.0, breaker_threshold=8, breaker_cooldown=60.0):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_attempts, self.base_delay, self.max_delay = max_attempts, base_delay, max_delay
+        self.breaker_threshold, self.breaker_cooldown = breaker_threshold, breaker_cooldown
+        self._failures, self._open_until = 0, 0.0
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "retries": 0, "fatal": 0, "breaker_trips": 0, "throttled_s": 0.0}
+
+    def _observe(self, headers):
+        if not headers: return
+        def num(name):
+            v = headers.get(name)
+            try: return float(v) if v is not None else None
+            except ValueError: return None
+        self.requests.sync(num("x-ratelimit-limit-requests"), num("x-ratelimit-remaining-requests"),
+                           parse_reset(headers.get("x-ratelimit-reset-requests")))
+        self.tokens.sync(num("x-ratelimit-limit-tokens"), num("x-ratelimit-remaining-tokens"),
+                         parse_reset(headers.get("x-ratelimit-reset-tokens")))
+
+    def _check_breaker(self):
+        with self._lock:
+            if self._failures >= self.breaker_threshold:
+                now = time.monotonic()
+                if now < self._open_until:
+                    raise CircuitOpen(f"Circuit open after {self._failures} consecutive failures; "
+                                      f"retry in {self._open_until - now:.0f}s")
+                # Half-open: let this call through as a probe; one more failure re-opens
+                self._failures = self.breaker_threshold - 1
+
+    def _record(self, ok):
+        with self._lock:
+            if ok:
+                self._failures = 0; return
+            self._failures += 1
+            if self._failures >= self.breaker_threshold:
+                self._open_until = time.monotonic() + self.breaker_cooldown
+                self.counters["breaker_trips"] += 1
+
+    def _delay(self, attempt, headers):
+        hinted = parse_reset((headers or {}).get("retry-after-ms"))
+        hinted = hinted / 1000 if hinted is not None else parse_reset((headers or {}).get("retry-after"))
+        if hinted is not None: return min(hinted, self.max_delay)
+        return min(self.max_delay, self.base_delay * 2 ** attempt) * (0.5 + random.random() / 2)
+
+    def call(self, request, est_tokens=1):
+        """Run `request()` (a with_raw_response call) under pacing and retry policy; returns the parsed body."""
+        self.counters["calls"] += 1
+        for attempt in range(self.max_attempts):
+            self._check_breaker()
+            self.counters["throttled_s"] += self.requests.take(1) + self.tokens.take(est_tokens)
+            try:
+                raw = request()
+            except Exception as e:
+                response = getattr(e, "response", None)
+                headers = getattr(response, "headers", None)
+                self._observe(headers)
+                if not is_retryable(e):
+                    self.counters["fatal"] += 1
+                    raise
+                self._record(False)
+                if attempt == self.max_attempts - 1: raise
+                self.counters["retries"] += 1
+                time.sleep(self._delay(attempt, headers))
+                continue
+            self._observe(raw.headers)
+            self._record(True)
+            return raw.parse()
+
+    def stats(self):
+        return dict(self.counters)
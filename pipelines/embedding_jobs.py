@@ -0,0 +1,137 @@
+import os, time, hashlib, multiprocessing as mp, numpy as np
+from pathlib import Path
+from pipelines.encoders import load_encoder, EMBED_CFG, ONNX_DIR, MAX_SEQ_LENGTH, _hub_name
+
+JOB_CFG = EMBED_CFG.get("jobs", {})
+MAX_SEQ = MAX_SEQ_LENGTH
+
+def _length_tokenizer(model_name, model=None):
+    """Fast tokenizer for length bucketing, found without network access: the loaded model's,
+    the exported ONNX one or the Hugging Face cache. None -> word-count estimate."""
+    try:
+        from tokenizers import Tokenizer
+        tok = getattr(model, "tokenizer", None)
+        tok = getattr(tok, "backend_tokenizer", tok)
+        if isinstance(tok, Tokenizer):
+            tok = Tokenizer.from_str(tok.to_str())
+        else:
+            local = ONNX_DIR / model_name.replace("/", "__") / "tokenizer.json"
+            if not local.exists():
+                from huggingface_hub import try_to_load_from_cache
+                local = try_to_load_from_cache(_hub_name(model_name), "tokenizer.json")
+            if not isinstance(local, (str, Path)): return None
+            tok = Tokenizer.from_file(str(local))
+        tok.enable_truncation(MAX_SEQ); tok.no_padding()
+        return tok
+    except Exception:
+        return None
+
+def token_lengths(texts, model_name=None, model=None):
+    tok = _length_tokenizer(model_name or EMBED_CFG.get("name", "all-MiniLM-L6-v2"), model)
+    if tok is None:
+        return np.array([min(int(len(t.split()) * 1.3) + 2, MAX_SEQ) for t in texts], dtype=np.int32)
+    return np.array([len(e.ids) for e in tok.encode_batch(list(texts), add_special_tokens=True)], dtype=np.int32)
+
+def plan_batches(lengths, max_batch_tokens, max_batch):
+    """Index batches over texts sorted longest first; a batch grows until its padded size
+    (rows x longest row) would exceed max_batch_tokens, so short texts go in big batches."""
+    order = np.argsort(-lengths, kind="stable")
+    batches, start = [], 0
+    while start < len(order):
+        longest = max(int(lengths[order[start]]), 1)
+        size = max(1, min(max_batch, max_batch_tokens // longest))
+        batches.append(order[start:start + size]); start += size
+    padded = sum(len(b) * int(lengths[b[0]]) for b in batches)
+    return batches, float(lengths.sum()) / max(padded, 1)
+
+def _cpu_times():
+    """Per-core (busy, total) jiffies from /proc/stat; None where unavailable."""
+    try:
+        with open("/proc/stat") as f:
+            rows = [l.split() for l in f if l.startswith("cpu") and l[3].isdigit()]
+    except OSError:
+        return None
+    out = []
+    for r in rows:
+        v = list(map(int, r[1:]))
+        out.append((sum(v) - v[3] - (v[4] if len(v) > 4 else 0), sum(v)))
+    return out
+
+_worker = {}
+
+def _init_worker(model_name, backend, threads, normalize):
+    if threads: os.environ["OMP_NUM_THREADS"] = os.environ["MKL_NUM_THREADS"] = str(threads)
+    _worker.update(model=load_encoder(model_name, backend, threads=threads), normalize=normalize)
+
+def _encode(job):
+    idx, texts = job
+    cpu, wall = time.process_time(), time.time()
+    emb = _worker["model"].encode(texts, batch_size=len(texts), normalize_embeddings=_worker["normalize"])
+    return idx, np.asarray(emb, dtype="float32"), os.getpid(), time.process_time() - cpu, time.time() - wall
+
+def corpus_key(texts, model_name=None, backend=None, normalize=True):
+    """Content hash of the texts and encoder settings, for naming cached embedding files."""
+    h = hashlib.sha256(f"{model_name or EMBED_CFG.get('name')}|{backend or EMBED_CFG.get('backend')}|{normalize}|{MAX_SEQ}".encode())
+    for t in texts:
+        h.update(t.encode()); h.update(b"\0")
+    return h.hexdigest()[:16]
+
+def embed_texts(texts, out_path=None, model_name=None, backend=None, normalize=True, workers=None,
+                model=None, label="texts"):
+    """Embed `texts` with length-bucketed batches spread over a pool of encoder processes.
+    Rows are written at their input positions, into a .npy memmap at `out_path` when given
+    (renamed into place once complete) or an in-memory array otherwise. Small jobs run
+    in-process, on `model` if the caller already has one loaded. Returns (embeddings, stats)."""
+    texts = [t or "" for t in texts]
+    n = len(texts)
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    threads = JOB_CFG.get("threads_per_worker") or 1
+    workers = workers or JOB_CFG.get("workers") or max(1, cores // threads)
+    if n < JOB_CFG.get("min_parallel", 2000): workers = 1
+    start = time.time()
+    lengths = token_lengths(texts, model_name, model)
+    batches, fill = plan_batches(lengths, JOB_CFG.get("max_batch_tokens", 8192), JOB_CFG.get("max_batch", 256))
+    jobs = ((b, [texts[i] for i in b]) for b in batches)
+
+    out, tmp, busy = None, None, {}
+    def write(idx, emb, pid, cpu, wall):
+        nonlocal out, tmp
+        if out is None:
+            dim = emb.shape[1]
+            if out_path:
+                tmp = Path(f"{out_path}.tmp.npy"); tmp.parent.mkdir(parents=True, exist_ok=True)
+                out = np.lib.format.open_memmap(tmp, mode="w+", dtype="float32", shape=(n, dim))
+            else:
+                out = np.empty((n, dim), dtype="float32")
+        out[idx] = emb
+        b = busy.setdefault(pid, [0.0, 0.0, 0])
+        b[0] += cpu; b[1] += wall; b[2] += len(idx)
+
+    cpu0 = _cpu_times()
+    if workers == 1:
+        _worker.update(model=model or load_encoder(model_name, backend), normalize=normalize)
+        for job in jobs: write(*_encode(job))
+    else:
+        ctx = mp.get_context(JOB_CFG.get("start_method", "spawn"))
+        with ctx.Pool(workers, _init_worker, (model_name, backend, threads, normalize)) as pool:
+            for res in pool.imap_unordered(_encode, jobs): write(*res)
+    cpu1 = _cpu_times()
+    if out is None:
+        out = np.zeros((0, EMBED_CFG.get("dimension", 384)), dtype="float32")
+    elif out_path:
+        out.flush(); del out
+        os.replace(tmp, out_path)
+        out = np.load(out_path, mmap_mode="r")
+
+    elapsed = time.time() - start
+    stats = {"texts": n, "seconds": round(elapsed, 2), "sentences_per_sec": round(n / max(elapsed, 1e-9), 1),
+             "workers": workers, "threads_per_worker": threads if workers > 1 else None,
+             "batches": len(batches), "padding_efficiency": round(fill, 3),
+             "worker_cpu_utilization": {str(pid): round(c / max(w, 1e-9), 2) for pid, (c, w, _) in busy.items()}}
+    if cpu0 and cpu1:
+        stats["core_utilization"] = [round((b1 - b0) / max(t1 - t0, 1), 2) for (b0, t0), (b1, t1) in zip(cpu0, cpu1)]
+    print(f"  Embedded {n} {label} in {elapsed:.1f}s ({stats['sentences_per_sec']:.0f}/s, {workers} worker(s), "
+          f"{len(batches)} batches, {fill:.0%} of padded tokens are real)")
+    if "core_utilization" in stats and len(stats["core_utilization"]) > 1:
+        print("  Core utilization: " + " ".join(f"{u:.0%}" for u in stats["core_utilization"]))
+    return out, stats
@@ -0,0 +1,125 @@
+import os, shutil, yaml, numpy as np
+from contextlib import contextmanager
+from pathlib import Path
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent first exports are not serialized
+    fcntl = None
+
+with open("config.yaml") as f:
+    config = yaml.safe_load(f)
+
+EMBED_CFG = config["models"].get("embedding", {})
+ONNX_DIR = Path(EMBED_CFG.get("onnx_dir", "models/onnx"))
+MAX_SEQ_LENGTH = EMBED_CFG.get("max_seq_length", 256)
+BACKENDS = ["torch", "onnx", "onnx-int8"]
+
+def _hub_name(model_name):
+    return model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+@contextmanager
+def _export_lock(out):
+    # Spawned embedding workers may all reach their first export at once; one exports, the rest wait
+    ONNX_DIR.mkdir(parents=True, exist_ok=True)
+    with open(ONNX_DIR / f"{out.name}.lock", "w") as f:
+        if fcntl: fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl: fcntl.flock(f, fcntl.LOCK_UN)
+
+def export_onnx(model_name, quantized=False):
+    """Export the transformer to ONNX once (needs torch + transformers only at export time),
+    optionally with int8 dynamic quantization. Returns the model path; the tokenizer is
+    saved alongside it so inference needs neither torch nor transformers. Exports are
+    written to a temporary name and renamed into place, under a per-model file lock."""
+    out = ONNX_DIR / model_name.replace("/", "__")
+    fp32, q = out / "model.onnx", out / "model.int8.onnx"
+    if fp32.exists() and (q.exists() or not quantized):
+        return q if quantized else fp32
+    with _export_lock(out):
+        if not fp32.exists():
+            import torch
+            from transformers import AutoTokenizer, AutoModel
+            print(f"Exporting {model_name} to ONNX...")
+            tmp = out.with_name(f"{out.name}.tmp{os.getpid()}")
+            shutil.rmtree(tmp, ignore_errors=True); tmp.mkdir(parents=True)
+            tok = AutoTokenizer.from_pretrained(_hub_name(model_name))
+            model = AutoModel.from_pretrained(_hub_name(model_name), torchscript=True).eval()
+            tok.save_pretrained(tmp)
+            dummy = tok(["export sample"], return_tensors="pt")
+            names = ["input_ids", "attention_mask", "token_type_ids"]
+            with torch.no_grad():
+                torch.onnx.export(model, tuple(dummy[n] for n in names), str(tmp / fp32.name), input_names=names,
+                    output_names=["last_hidden_state", "pooler_output"], opset_version=14,
+                    dynamic_axes={n: {0: "batch", 1: "seq"} for n in names + ["last_hidden_state"]})
+            # model.onnx marks a complete export, so it is moved in last
+            out.mkdir(parents=True, exist_ok=True)
+            for p in sorted(tmp.iterdir(), key=lambda p: p.name == fp32.name): os.replace(p, out / p.name)
+            tmp.rmdir()
+        if quantized and not q.exists():
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            print(f"Quantizing {fp32} to int8...")
+            tmp = out / f"model.int8.tmp{os.getpid()}.onnx"
+            quantize_dynamic(str(fp32), str(tmp), weight_type=QuantType.QInt8)
+            os.replace(tmp, q)
+    return q if quantized else fp32
+
+class OnnxEncoder:
+    """Drop-in for SentenceTransformer.encode on onnxruntime: mean pooling over the last
+    hidden state, optional L2 normalization, same max sequence length as the torch model."""
+    def __init__(self, model_name, quantized=False, max_seq_length=MAX_SEQ_LENGTH, threads=None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+        path = export_onnx(model_name, quantized)
+        self.tokenizer = Tokenizer.from_file(str(path.parent / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_seq_length)
+        self.tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads: opts.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(str(path), opts, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def encode(self, sentences, batch_size=32, normalize_embeddings=False, show_progress_bar=False, **_):
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+        # Length-sorted batches keep padding low; results are restored to input order
+        order = np.argsort([-len(s) for s in sentences], kind="stable")
+        chunks = []
+        rng = range(0, len(sentences), batch_size)
+        if show_progress_bar:
+            from tqdm import tqdm
+            rng = tqdm(rng, desc="Batches")
+        for i in rng:
+            enc = self.tokenizer.encode_batch([sentences[j] for j in order[i:i+batch_size]])
+            feeds = {"input_ids": np.array([e.ids for e in enc], dtype=np.int64),
+                     "attention_mask": np.array([e.attention_mask for e in enc], dtype=np.int64),
+                     "token_type_ids": np.array([e.type_ids for e in enc], dtype=np.int64)}
+            hidden = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+            mask = feeds["attention_mask"][..., None].astype("float32")
+            emb = (hidden * mask).sum(1) / np.clip(mask.sum(1), 1e-9, None)
+            if normalize_embeddings:
+                emb /= np.clip(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12, None)
+            chunks.append(emb.astype("float32"))
+        out = np.empty((len(sentences), chunks[0].shape[1] if chunks else 0), dtype="float32")
+        if chunks: out[order] = np.concatenate(chunks)
+        return out[0] if single else out
+
+def load_encoder(model_name=None, backend=None, threads=None):
+    """Sentence encoder for the configured backend: "torch" (SentenceTransformer),
+    "onnx" or "onnx-int8" (onnxruntime, exported on first use). `threads` caps intra-op
+    threads (used by the multi-process embedding jobs)."""
+    model_name = model_name or EMBED_CFG.get("name", "all-MiniLM-L6-v2")
+    backend = backend or EMBED_CFG.get("backend", "torch")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}; expected one of {BACKENDS}")
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        model = SentenceTransformer(model_name)
+        model.max_seq_length = MAX_SEQ_LENGTH
+        return model
+    return OnnxEncoder(model_name, quantized=backend == "onnx-int8", max_seq_length=MAX_SEQ_LENGTH, threads=threads)
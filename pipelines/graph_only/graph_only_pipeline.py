@@ -1,16 +1,21 @@
 import yaml
 from pipelines.graphrag.graphrag_pipeline import GraphRAGPipeline
-from pipelines.llm_client import generate
  
 with open("config.yaml") as f:
     config = yaml.safe_load(f)
  
 class GraphOnlyPipeline(GraphRAGPipeline):
-    def run(self, query):
-        seeds = self._get_seeds(query, k=config["retrieval"]["seed_k"])
-        nodes, edges = self._expand(seeds)
-        nodes, edges = self._prune(query, nodes, edges)
-        flat = "\n\n".join([n.get("text","")[:300] for n in nodes])
+    def build_prompt(self, query, nodes, edges):
+        flat = "\n\n".join([n.get("text","")[:300] for n in self.with_routing(nodes)])
         prompt = f"Context:\n{flat}\n\nRequest:\n{query}\n\nProvide: 1) Taxonomy 2) Routing 3) Dependencies 4) Questions 5) Criteria"
-        result = generate(prompt, "You are an expert enterprise planning assistant.", purpose="graph_only_generation")
-        return {"output":result["text"],"context":flat,"num_nodes":len(nodes),"num_edges":len(edges)}
+        return {"prompt":prompt,"system":"You are an expert enterprise planning assistant.","purpose":"graph_only_generation",
+                "context":flat,"num_nodes":len(nodes),"num_edges":len(edges)}
+ 
+    def citation_fix(self, req, output, partial=False):
+        return None  # no evidence binding, nothing to verify
+ 
+    def abort_rule(self, req):
+        return None
+ 
+    def result(self, req, output, regen):
+        return {"output":output,"context":req["context"],"num_nodes":req["num_nodes"],"num_edges":req["num_edges"]}
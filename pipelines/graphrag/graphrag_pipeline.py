@@ -1,16 +1,37 @@
-import json, re, yaml, numpy as np
-from neo4j import GraphDatabase
-from sentence_transformers import SentenceTransformer
-from pipelines.llm_client import generate
+import heapq, itertools, json, re, time, yaml, numpy as np
+from pipelines.llm_client import generate, generate_stream
+from pipelines.graphrag.neighborhood_cache import NeighborhoodCache, policy_hash
+from pipelines.graphrag.sparse_expansion import SparseExpansionEngine, tally
+from pipelines.graphrag.node_index import NodeIndex, partition_of
+from pipelines.graphrag.routing_tables import RoutingTables
+from pipelines.graphrag.retrieval_memo import RetrievalMemo
+from pipelines.semantic_cache import SemanticCache
+from pipelines.resources import Resources
  
 with open("config.yaml") as f:
     config = yaml.safe_load(f)
  
+# Ranking for rules with a neighbor `limit`; ties go to the smaller target id
+NEIGHBOR_ORDER = {"confidence": "coalesce(r.confidence, 0.0) DESC, b.id", "recency": "coalesce(r.created_at, '') DESC, b.id"}
+ 
+def apply_fanout(policy, fanout):
+    """Copy of an expansion policy with retrieval.fanout neighbor limits ("<label>.<EDGE>": N, or default_limit) set on its rules."""
+    out = {}
+    for label, rules in policy.items():
+        out[label] = []
+        for rule in rules:
+            rule = {k: v for k, v in rule.items() if k not in ("limit", "order_by")}
+            limit = (fanout.get("limits") or {}).get(f"{label}.{rule['edge']}", fanout.get("default_limit"))
+            if limit: rule.update(limit=int(limit), order_by=fanout.get("order_by", "confidence"))
+            out[label].append(rule)
+    return out
+ 
 class GraphRAGPipeline:
     def __init__(self):
-        self.embed_model = SentenceTransformer("all-MiniLM-L6-v2")
-        self.driver = GraphDatabase.driver(config["neo4j"]["uri"],
-            auth=(config["neo4j"]["user"], config["neo4j"]["password"]))
+        # Encoder, driver, node tables and sparse engines are shared by every pipeline in the process
+        self.resources = Resources()
+        self.embed_model = self.resources.encoder()
+        self.driver = self.resources.neo4j_driver(config["neo4j"])
         self.expansion_policy = {
             "Issue": [{"edge":"BELONGS_TO","target":"Component","max_depth":1},
                       {"edge":"OWNED_BY","target":"Owner","max_depth":1},
@@ -18,16 +39,77 @@ class GraphRAGPipeline:
             "Component": [{"edge":"DEPENDS_ON","target":"Component","max_depth":2},
                           {"edge":"OWNED_BY","target":"Owner","max_depth":1}],
             "Owner": [{"edge":"MAINTAINS","target":"CodeModule","max_depth":1}]}
+        # Fan-out control: top-N neighbors per rule and no expansion through hubs
+        fo = config["retrieval"].get("fanout", {})
+        self.expansion_policy = apply_fanout(self.expansion_policy, fo)
+        self.hub_degree = fo.get("hub_degree")
+        # "bfs": full max_hops expansion, then prune; "best_first": budgeted search, see _best_first
+        self.expansion_mode = config["retrieval"].get("expansion_mode", "bfs")
+        self.node_budget = config["retrieval"].get("node_budget", 40)
+        self.search_stats = {"queries": 0, "lookups": 0, "max_lookups": 0,
+                             "budget_stops": 0, "threshold_stops": 0, "exhausted_stops": 0}
+        self.policy_hash = policy_hash(self.expansion_policy)
+        self.neighborhood_cache = NeighborhoodCache(config["retrieval"].get("expansion_cache_size", 200000))
+        self._sparse = {}   # partition (None = whole graph) -> SparseExpansionEngine
+        self._nodes = None
+        # Per-repo node tables and sparse engines, loaded on first use; retrieval.partitions limits
+        # which repos this process serves (and fans out to)
+        self.partition_by_repo = config["retrieval"].get("partition_by_repo", False)
+        self._parts, self._partition_names = {}, config["retrieval"].get("partitions")
+        # Materialized owner rankings / co-occurrence / dependency closure per component (materialize_routing.py)
+        rt = config.get("routing", {})
+        self.routing = RoutingTables(max_components=rt.get("max_components", 3)) if rt.get("attach") else None
+        sc = config["retrieval"].get("semantic_cache", {})
+        self.semantic_cache = SemanticCache(sc.get("threshold", 0.95), sc.get("max_entries", 2048),
+            sc.get("ttl_seconds", 3600), sc.get("reuse_output", False)) if sc.get("enabled") else None
+        # Persisted retrieval results, shared by every graph pipeline with the same settings (see retrieve_batch)
+        rc, mc = config["retrieval"], config["retrieval"].get("memo", {})
+        self.retrieval_settings = {"policy": self.policy_hash, "hub_degree": self.hub_degree, "mode": self.expansion_mode,
+            "node_budget": self.node_budget if self.expansion_mode == "best_first" else None,
+            **{k: rc[k] for k in ["seed_k", "max_hops", "prune_threshold"]}, "partition_by_repo": self.partition_by_repo,
+            "partitions": sorted(self._partition_names) if self._partition_names else None,
+            # Anything that changes query embeddings; semantic-cache hits are never memoized, so its settings are not here
+            "encoder": {k: config["models"]["embedding"].get(k) for k in ["name", "backend", "max_seq_length", "onnx_dir"]}}
+        path = mc.get("path", "data/cache/retrieval_memo.sqlite")
+        self.memo = self.resources.get(("retrieval_memo", path), lambda: RetrievalMemo(path)) if mc.get("enabled") else None
  
-    def _get_seeds(self, query, k=10):
-        qe = self.embed_model.encode(query, normalize_embeddings=True).tolist()
-        with self.driver.session() as s:
-            nodes = [dict(r) for r in s.run(
-                "MATCH (n) WHERE n.embedding IS NOT NULL RETURN n.id AS id, labels(n)[0] AS label, n.text_payload AS text, n.embedding AS embedding")]
-        scored = [{"id":n["id"],"label":n["label"],"text":n["text"],"embedding":n["embedding"],
-                   "similarity":float(np.dot(qe,n["embedding"]))} for n in nodes if n["embedding"]]
-        scored.sort(key=lambda x: x["similarity"], reverse=True)
-        return scored[:k]
+    @property
+    def nodes(self):
+        # Loaded once and shared by seeding, pruning and the sparse engine; expansion never moves embeddings
+        if self._nodes is None:
+            self._nodes = self.resources.get(("node_index", config["neo4j"]["uri"], None), lambda: NodeIndex(self.driver))
+        return self._nodes
+ 
+    def partitions(self):
+        if self._partition_names is None:
+            with self.driver.session() as s:
+                self._partition_names = [r["p"] for r in s.run(
+                    "MATCH (n) WHERE n.id IS NOT NULL RETURN DISTINCT split(n.id, ':')[0] AS p")]
+        return sorted(self._partition_names)
+ 
+    def node_index(self, partition=None):
+        if partition is None: return self.nodes
+        if partition not in self._parts:
+            self._parts[partition] = self.resources.get(("node_index", config["neo4j"]["uri"], partition),
+                                                        lambda: NodeIndex(self.driver, partition))
+        return self._parts[partition]
+ 
+    def _scopes(self, repo):
+        """Node tables to search: the whole graph, the request's repo, or every served partition (fan-out)."""
+        if not self.partition_by_repo: return [None]
+        return [repo] if repo else self.partitions()
+ 
+    def _get_seeds(self, query, k=10, repo=None):
+        qe = self.embed_model.encode(query, normalize_embeddings=True)
+        seeds = []
+        for scope in self._scopes(repo):
+            idx = self.node_index(scope)
+            rows, sims = idx.top_k(qe, k)
+            seeds += [{"id":idx.ids[i],"label":idx.labels[i],"text":idx.texts[i],"similarity":float(sim)}
+                      for i, sim in zip(rows, sims)]
+        # Fan-out: each partition's top k, merged into the global top k
+        if len(seeds) > k: seeds = sorted(seeds, key=lambda x: (-x["similarity"], x["id"]))[:k]
+        return seeds
  
     def _expand(self, seeds, max_hops=3):
         visited, nodes, edges = set(), [], []
@@ -37,22 +119,158 @@ class GraphRAGPipeline:
                 cur, depth = frontier.pop(0)
                 if cur["id"] in visited or depth > max_hops: continue
                 visited.add(cur["id"]); nodes.append(cur)
-                for rule in self.expansion_policy.get(cur.get("label",""),[]):
-                    if depth + 1 > rule["max_depth"]: continue
-                    for r in s.run(f"MATCH (a {{id: $id}})-[r:{rule['edge']}]->(b:{rule['target']}) RETURN b.id AS id, labels(b)[0] AS label, b.text_payload AS text, b.embedding AS embedding, type(r) AS rt, r.confidence AS conf", id=cur["id"]):
-                        nb = dict(r)
-                        edges.append({"source":cur["id"],"target":nb["id"],"type":nb["rt"],"confidence":nb.get("conf",0.5)})
-                        if nb["id"] not in visited:
-                            frontier.append((nb, depth+1))
+                # A hub reached by expansion is kept but not expanded; seeds always are
+                if depth and self.hub_degree is not None and (cur.get("degree") or 0) > self.hub_degree: continue
+                for nb in self._neighbors(s, cur, depth):
+                    edges.append({"source":cur["id"],"target":nb["id"],"type":nb["rt"],"confidence":nb.get("conf",0.5)})
+                    if nb["id"] not in visited:
+                        frontier.append((nb, depth+1))
         return nodes, edges
  
+    def _best_first(self, query, seeds, max_hops=3, threshold=0.35, budget=40):
+        """Best-first replacement for _expand -> _prune. Nodes are taken from a priority queue
+        on query similarity x confidence of the edge that reached them (seeds: similarity) and
+        expanded as they are taken, so at most `budget` nodes are kept and at most `budget`
+        neighbor lookups are made. The search stops once the budget is filled or the best
+        frontier score falls below the threshold; every kept node is at or above it."""
+        qe = self.embed_model.encode(query, normalize_embeddings=True)
+        seq = itertools.count()
+        rel = self._relevance(qe, [sd["id"] for sd in seeds])
+        heap = [(-r, sd["id"], 0, next(seq), {**sd, "relevance": float(r)}) for sd, r in zip(seeds, rel)]
+        heapq.heapify(heap)
+        visited, nodes, fetched, lookups, stop = set(), [], [], 0, "exhausted"
+        with self.driver.session() as s:
+            while heap:
+                if len(nodes) >= budget: stop = "budget"; break
+                neg, nid, depth, _, cur = heapq.heappop(heap)
+                if -neg < threshold: stop = "threshold"; break
+                if nid in visited: continue
+                visited.add(nid); nodes.append(cur)
+                if depth and self.hub_degree is not None and (cur.get("degree") or 0) > self.hub_degree: continue
+                if any(depth + 1 <= rule["max_depth"] for rule in self.expansion_policy.get(cur.get("label",""),[])): lookups += 1
+                nbs = self._neighbors(s, cur, depth)
+                if not nbs: continue
+                for nb, r in zip(nbs, self._relevance(qe, [nb["id"] for nb in nbs])):
+                    fetched.append({"source":cur["id"],"target":nb["id"],"type":nb["rt"],"confidence":nb.get("conf",0.5)})
+                    if nb["id"] not in visited and depth + 1 <= max_hops:
+                        conf = 0.5 if nb.get("conf") is None else nb["conf"]
+                        heapq.heappush(heap, (-(r * conf), nb["id"], depth + 1, next(seq), {**nb, "relevance": float(r)}))
+        tally(self.search_stats, {"lookups": lookups, "stop": stop})
+        return nodes, [e for e in fetched if e["source"] in visited and e["target"] in visited]
+ 
+    def _neighbors(self, s, cur, depth):
+        key = (cur["id"], self.policy_hash, depth)
+        found = self.neighborhood_cache.get(key)
+        if found is not None: return found
+        found = []
+        for rule in self.expansion_policy.get(cur.get("label",""),[]):
+            if depth + 1 > rule["max_depth"]: continue
+            q = f"MATCH (a {{id: $id}})-[r:{rule['edge']}]->(b:{rule['target']}) RETURN b.id AS id, labels(b)[0] AS label, b.text_payload AS text, type(r) AS rt, r.confidence AS conf, b.out_degree AS degree"
+            if rule.get("limit"): q += f" ORDER BY {NEIGHBOR_ORDER[rule['order_by']]} LIMIT {rule['limit']}"
+            found.extend(dict(r) for r in s.run(q, id=cur["id"]))
+        self.neighborhood_cache.put(key, found)
+        return found
+ 
     def _prune(self, query, nodes, edges, threshold=0.35):
         qe = self.embed_model.encode(query, normalize_embeddings=True)
-        kept = [n for n in nodes if (float(np.dot(qe,n["embedding"])) if n.get("embedding") else 0.3) >= threshold]
-        for n in kept: n["relevance"] = float(np.dot(qe, n["embedding"])) if n.get("embedding") else 0.3
+        relevance = self._relevance(qe, [n["id"] for n in nodes])
+        kept = [n for n, r in zip(nodes, relevance) if r >= threshold]
+        for n, r in zip(kept, relevance[relevance >= threshold]): n["relevance"] = float(r)
         ids = {n["id"] for n in kept}
         return kept, [e for e in edges if e["source"] in ids and e["target"] in ids]
  
+    def _relevance(self, qe, ids):
+        if not self.partition_by_repo: return self.nodes.relevance(qe, ids)
+        out, parts = np.empty(len(ids)), [partition_of(i) for i in ids]
+        for p in set(parts):
+            sel = [j for j, q in enumerate(parts) if q == p]
+            out[sel] = self.node_index(p).relevance(qe, [ids[j] for j in sel])
+        return out
+ 
+    def _engine(self, partition=None):
+        if partition not in self._sparse:
+            # Pipelines with the same policy (GraphRAG / Graph-Only) share one engine
+            nodes = self.node_index(partition)
+            key = ("sparse", config["neo4j"]["uri"], partition, self.policy_hash, self.hub_degree)
+            self._sparse[partition] = self.resources.get(key, lambda: SparseExpansionEngine(
+                self.driver, self.expansion_policy, nodes, self.hub_degree))
+        return self._sparse[partition]
+ 
+    def _fan_out_batch(self, qe, k, max_hops, threshold):
+        """Batch retrieval across every served partition: each partition proposes its top k seeds,
+        the global top k per query are kept, and each partition expands its own share (edges
+        never cross repos). The walks are merged into the order of one BFS from the global
+        seed list, as in _search: by depth, then by the rank of the seed each path starts from."""
+        engines = [self._engine(p) for p in self.partitions()]
+        sims = [e.similarities(qe) for e in engines]
+        cands = [e.seeds(sm, k) for e, sm in zip(engines, sims)]
+        chosen = [[[] for _ in range(len(qe))] for _ in engines]
+        ranks = [[[] for _ in range(len(qe))] for _ in engines]
+        for q in range(len(qe)):
+            pool = sorted(((-sims[pi][q, r], engines[pi].ids[r], pi, r) for pi in range(len(engines)) for r in cands[pi][q]))
+            for rank, (_, _, pi, r) in enumerate(pool[:k]):
+                chosen[pi][q].append(r); ranks[pi][q].append(rank)
+        parts = [e.expand_batch(sm, [np.array(c, dtype=np.int64) for c in ch], max_hops, threshold, keys=True)
+                 if any(ch) else None for e, sm, ch in zip(engines, sims, chosen)]
+        out = []
+        for q in range(len(qe)):
+            nodes, edges = [], []
+            for pi, part in enumerate(parts):
+                if part is None or not chosen[pi][q]: continue
+                found, links, (node_keys, edge_keys) = part[q]
+                rank = ranks[pi][q]
+                nodes += [((d, rank[r]), n) for (d, r), n in zip(node_keys, found)]
+                edges += [((d, rank[r]), e) for (d, r), e in zip(edge_keys, links)]
+            # Stable sorts: ties share a seed, hence a partition, whose walk is already in BFS order
+            out.append(([n for _, n in sorted(nodes, key=lambda x: x[0])], [e for _, e in sorted(edges, key=lambda x: x[0])]))
+        return out
+
+    def retrieve_batch(self, queries, repos=None):
+        """Seeds, expansion and pruning for many queries at once on the in-memory sparse graph.
+        Returns one (nodes, edges) pair per query, matching _get_seeds -> _expand -> _prune.
+        With partition_by_repo, queries with a known repo only touch that repo's partition.
+        With retrieval.memo, stored results are reused and only the rest are retrieved."""
+        scopes = list(repos) if self.partition_by_repo and repos is not None else [None] * len(queries)
+        if self.memo is None: return self._retrieve_batch(list(queries), scopes)[0]
+        keys = [self.memo.key(q, sc, self.retrieval_settings) for q, sc in zip(queries, scopes)]
+        out = self.memo.get_many(keys)
+        todo = [i for i, r in enumerate(out) if r is None]
+        if todo:
+            start = time.time()
+            fresh, retrieved = self._retrieve_batch([queries[i] for i in todo], [scopes[i] for i in todo])
+            share = (time.time() - start) / max(1, sum(retrieved))
+            # A semantic-cache hit is a similar query's subgraph, so it is returned but not stored under this query
+            self.memo.put_many([(keys[i], queries[i], ret, share) for i, ret, r in zip(todo, fresh, retrieved) if r])
+            for i, ret in zip(todo, fresh): out[i] = ret
+        return out
+ 
+    def _retrieve_batch(self, queries, scopes):
+        """(results, whether each was retrieved rather than taken from the semantic cache)."""
+        rc = config["retrieval"]
+        qe = self.embed_model.encode(queries, batch_size=64, normalize_embeddings=True)
+        hits = [self.semantic_cache.get(q, scope=sc) for q, sc in zip(qe, scopes)] if self.semantic_cache else [None] * len(qe)
+        out = [h and h["retrieved"] for h in hits]
+        groups = {}
+        for i, h in enumerate(hits):
+            if h is None: groups.setdefault(scopes[i], []).append(i)
+        for scope, todo in groups.items():
+            start = time.time()
+            if self.expansion_mode == "best_first" and scope is None and self.partition_by_repo:
+                # The node budget spans partitions, so fanned-out best-first search runs per query
+                fresh = [self._search(queries[i]) for i in todo]
+            elif self.expansion_mode == "best_first":
+                fresh = self._engine(scope).best_first_batch(qe[todo], rc["seed_k"], rc["max_hops"], rc["prune_threshold"],
+                                                             self.node_budget, self.search_stats)
+            elif scope is None and self.partition_by_repo:
+                fresh = self._fan_out_batch(qe[todo], rc["seed_k"], rc["max_hops"], rc["prune_threshold"])
+            else:
+                fresh = self._engine(scope).retrieve_batch(qe[todo], rc["seed_k"], rc["max_hops"], rc["prune_threshold"])
+            share = (time.time() - start) / len(todo)
+            for i, ret in zip(todo, fresh):
+                out[i] = ret
+                if self.semantic_cache: self.semantic_cache.put(qe[i], queries[i], ret, share, scope=scope)
+        return out, [h is None for h in hits]
+ 
     def _serialize(self, nodes, edges):
         blocks, id_map = [], {}
         for i, n in enumerate(nodes):
@@ -63,21 +281,95 @@ class GraphRAGPipeline:
         ctx = "=== EVIDENCE BLOCKS ===\n" + "\n".join(blocks) + "\n\n=== RELATIONSHIPS ===\n" + "\n".join(rels)
         return ctx, list(id_map.values())
  
-    def run(self, query):
-        seeds = self._get_seeds(query, k=config["retrieval"]["seed_k"])
-        nodes, edges = self._expand(seeds, config["retrieval"]["max_hops"])
-        nodes, edges = self._prune(query, nodes, edges, config["retrieval"]["prune_threshold"])
-        context, valid_ids = self._serialize(nodes, edges)
+    def _search(self, query, scope=None):
+        rc = config["retrieval"]
+        seeds = self._get_seeds(query, k=rc["seed_k"], repo=scope)
+        if self.expansion_mode == "best_first":
+            return self._best_first(query, seeds, rc["max_hops"], rc["prune_threshold"], self.node_budget)
+        nodes, edges = self._expand(seeds, rc["max_hops"])
+        return self._prune(query, nodes, edges, rc["prune_threshold"])
+ 
+    def retrieve(self, query, repo=None):
+        """`repo` scopes retrieval to that repo's partition (with retrieval.partition_by_repo);
+        without it, seeds are fanned out across every served partition."""
+        scope = repo if self.partition_by_repo else None
+        begun, key = time.time(), self.memo and self.memo.key(query, scope, self.retrieval_settings)
+        if key:
+            hit = self.memo.get_many([key])[0]
+            if hit: return hit
+        if self.semantic_cache:
+            qe = self.embed_model.encode(query, normalize_embeddings=True)
+            hit = self.semantic_cache.get(qe, scope=scope)
+            if hit: return hit["retrieved"]
+            start = time.time()
+        nodes, edges = self._search(query, scope)
+        if self.semantic_cache: self.semantic_cache.put(qe, query, (nodes, edges), time.time() - start, scope=scope)
+        return self._memoize(key, query, (nodes, edges), begun)
+ 
+    def _memoize(self, key, query, retrieved, start):
+        if key: self.memo.put_many([(key, query, retrieved, time.time() - start)])
+        return retrieved
+ 
+    def run(self, query, repo=None):
+        return self.answer(query, *self.retrieve(query, repo), repo=repo)
+ 
+    def run_batch(self, queries, repos=None):
+        repos = repos or [None] * len(queries)
+        return [self.answer(q, nodes, edges, repo=r) for q, r, (nodes, edges) in zip(queries, repos, self.retrieve_batch(queries, repos))]
+ 
+    def with_routing(self, nodes):
+        return nodes + self.routing.evidence(nodes) if self.routing else nodes
+ 
+    def build_prompt(self, query, nodes, edges):
+        context, valid_ids = self._serialize(self.with_routing(nodes), edges)
         sys_prompt = "You are an expert enterprise planning assistant. Cite evidence [E1],[E2] etc for every claim. Only use provided evidence."
         prompt = f"{context}\n\n=== REQUEST ===\n{query}\n\n=== OUTPUT ===\n1. TAXONOMY CLASSIFICATION (cite evidence)\n2. ROUTING/OWNERSHIP (cite evidence)\n3. DEPENDENCIES (cite evidence)\n4. CLARIFICATION QUESTIONS\n5. ACCEPTANCE CRITERIA"
-        result = generate(prompt, sys_prompt, purpose="graphrag_generation")
-        output = result["text"]
-        # Citation verification
-        cited = set(re.findall(r'\[E\d+\]', output))
-        invalid = cited - set(valid_ids)
-        regen = False
-        if invalid:
-            fix = f"Your response cited non-existent evidence: {', '.join(invalid)}. Valid IDs: {', '.join(valid_ids)}. Revise, removing invalid citations.\n\nOriginal context:\n{context}\n\nYour response:\n{output}"
-            result2 = generate(fix, purpose="citation_fix")
-            output, regen = result2["text"], True
-        return {"output":output,"context":context,"num_nodes":len(nodes),"num_edges":len(edges),"evidence_ids":valid_ids,"was_regenerated":regen}
+        return {"prompt":prompt,"system":sys_prompt,"purpose":"graphrag_generation","context":context,
+                "valid_ids":valid_ids,"num_nodes":len(nodes),"num_edges":len(edges)}
+ 
+    def citation_fix(self, req, output, partial=False):
+        # Citation verification: a fix prompt if the output cites evidence outside valid_ids
+        invalid = set(re.findall(r'\[E\d+\]', output)) - set(req["valid_ids"])
+        if not invalid: return None
+        if partial:
+            return f"{req['prompt']}\n\nA previous attempt was stopped because it cited non-existent evidence: {', '.join(invalid)}. Valid IDs: {', '.join(req['valid_ids'])}. Write the complete response citing only valid IDs."
+        return f"Your response cited non-existent evidence: {', '.join(invalid)}. Valid IDs: {', '.join(req['valid_ids'])}. Revise, removing invalid citations.\n\nOriginal context:\n{req['context']}\n\nYour response:\n{output}"
+ 
+    def abort_rule(self, req):
+        # Stop streaming at the first citation outside valid_ids so the regeneration starts sooner
+        valid = set(req["valid_ids"])
+        def check(text):
+            bad = next((c for c in re.findall(r'\[E\d+\]', text) if c not in valid), None)
+            return f"invalid citation {bad}" if bad else None
+        return check
+ 
+    def result(self, req, output, regen):
+        return {"output":output,"context":req["context"],"num_nodes":req["num_nodes"],"num_edges":req["num_edges"],
+                "evidence_ids":req["valid_ids"],"was_regenerated":regen}
+ 
+    def answer(self, query, nodes, edges, repo=None):
+        reuse = self.semantic_cache is not None and self.semantic_cache.reuse_output
+        scope = repo if self.partition_by_repo else None
+        if reuse:
+            qe = self.embed_model.encode(query, normalize_embeddings=True)
+            hit = self.semantic_cache.get(qe, output=True, scope=scope)
+            if hit: return {**hit["output"], "semantic_cache_hit": hit["query"], "ttft_s": None}
+            start = time.time()
+        req = self.build_prompt(query, nodes, edges)
+        gen = generate_stream(req["prompt"], req["system"], purpose=req["purpose"], abort=self.abort_rule(req)).collect()
+        output = gen["text"]
+        fix, regen = self.citation_fix(req, output, partial=bool(gen["aborted"])), False
+        if fix and gen["aborted"]:
+            # The partial fix restates the whole task, so it keeps the system prompt and its answer is checked again
+            output, regen = generate(fix, req["system"], purpose="citation_fix")["text"], True
+            fix = self.citation_fix(req, output)
+        if fix:
+            output, regen = generate(fix, purpose="citation_fix")["text"], True
+        res = {**self.result(req, output, regen), "ttft_s": gen["ttft_s"]}
+        if reuse: self.semantic_cache.put(qe, query, (nodes, edges), output=res, generation_s=time.time() - start, scope=scope)
+        return res
+ 
+    def close(self):
+        """Release the shared encoder, driver, node tables and engines; each is closed once no pipeline holds it."""
+        self.resources.close()
+        self._nodes, self._parts, self._sparse = None, {}, {}
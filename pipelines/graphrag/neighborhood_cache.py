@@ -0,0 +1,97 @@
+import hashlib, json, threading, weakref
+from collections import OrderedDict
+from pipelines.graphrag.retrieval_memo import GraphVersionWatch
+
+# Every live cache registers here so graph writers in the same process can invalidate them.
+_caches = weakref.WeakSet()
+
+def register_invalidation(obj):
+    """Have invalidate_nodes reach `obj` (anything with invalidate(node_ids) and clear()) while it lives."""
+    _caches.add(obj)
+    return obj
+
+def policy_hash(policy):
+    return hashlib.sha1(json.dumps(policy, sort_keys=True).encode()).hexdigest()[:12]
+
+class NeighborhoodCache:
+    """LRU cache of expansion results keyed by (node id, expansion-policy hash, hop).
+
+    Memory is bounded by `max_items`, the total number of cached neighbor records
+    (each entry costs 1 + len(neighbors)), so hub nodes count for what they hold.
+
+    It backs the per-query Cypher expansion (GraphRAG.retrieve, measure_expansion.py, and
+    best-first search fanned out over partitions); batch retrieval runs on the in-memory
+    sparse graph and does not use it. The cache is dropped when build_knowledge_graph.py
+    writes a new graph version (checked at most once a second)."""
+    def __init__(self, max_items=200000):
+        self.max_items = max_items
+        self._data = OrderedDict()
+        self._refs = {}  # node id -> keys of entries that contain it (as owner or neighbor)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+        self._graph = GraphVersionWatch()
+        register_invalidation(self)
+
+    def get(self, key):
+        with self._lock:
+            if self._graph.changed(): self._reset()
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return [dict(nb) for nb in entry]
+
+    def put(self, key, neighbors):
+        cost = 1 + len(neighbors)
+        if cost > self.max_items: return
+        with self._lock:
+            if self._graph.changed(): self._reset()
+            if key in self._data: self._drop(key)
+            self._data[key] = [dict(nb) for nb in neighbors]
+            self._size += cost
+            for nid in {key[0], *(nb["id"] for nb in neighbors)}:
+                self._refs.setdefault(nid, set()).add(key)
+            while self._size > self.max_items:
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        entry = self._data.pop(key)
+        self._size -= 1 + len(entry)
+        for nid in {key[0], *(nb["id"] for nb in entry)}:
+            keys = self._refs.get(nid)
+            if keys is not None:
+                keys.discard(key)
+                if not keys: del self._refs[nid]
+
+    def invalidate(self, node_ids):
+        """Drop every entry that was expanded from, or returned, any of `node_ids`."""
+        with self._lock:
+            for nid in node_ids:
+                for key in list(self._refs.get(nid, ())):
+                    if key in self._data:
+                        self._drop(key)
+                        self.invalidations += 1
+
+    def _reset(self):
+        self.invalidations += len(self._data)
+        self._data.clear(); self._refs.clear(); self._size = 0
+
+    def clear(self):
+        with self._lock: self._reset()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"entries": len(self._data), "items": self._size, "hits": self.hits,
+                "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions, "invalidations": self.invalidations}
+
+def invalidate_nodes(node_ids=None):
+    """Invalidation hook for graph writers; None clears every cache in the process. Only
+    caches in the caller's process are reached: others see the new graph version instead."""
+    for cache in list(_caches):
+        if node_ids is None: cache.clear()
+        else: cache.invalidate(node_ids)
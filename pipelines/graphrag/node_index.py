@@ -0,0 +1,101 @@
+import numpy as np
+from pipelines.graphrag.neighborhood_cache import register_invalidation
+
+NODE_FIELDS = "n.id AS id, labels(n) AS labels, n.text_payload AS text, n.embedding AS embedding, n.out_degree AS degree"
+
+def partition_of(node_id):
+    """Repo partition of a node: ids are "<repo>:<kind>:<key>"."""
+    return node_id.split(":", 1)[0]
+
+class NodeIndex:
+    """Id-indexed node table loaded from Neo4j once: labels, text, out-degree (written by the
+    KG builder) and a float32 embedding matrix. Expansion then only has to move ids, labels and text; relevance for any set of
+    nodes is one matrix-vector product here. Shared by seeding, pruning and the sparse
+    engine. Registered with the invalidation hook, so ids upserted by the KG builder (and
+    ids never seen before) are re-read from the database on their next lookup. With a
+    `partition` (repo) only that repo's nodes are loaded or ever looked up."""
+    def __init__(self, driver, partition=None):
+        self.driver, self.partition = driver, partition
+        self.ids, self.index, self.labels, self.label_sets, self.texts = [], {}, [], [], []
+        self.emb, self.has_emb = np.zeros((0, 0), dtype="float32"), np.zeros(0, dtype=bool)
+        self.degree = np.zeros(0, dtype=np.int64)
+        self._stale, self._reload = set(), False
+        with driver.session() as s:
+            if partition is None:
+                rows = s.run(f"MATCH (n) WHERE n.id IS NOT NULL RETURN {NODE_FIELDS}")
+            else:
+                rows = s.run(f"MATCH (n) WHERE n.id STARTS WITH $prefix RETURN {NODE_FIELDS}", prefix=f"{partition}:")
+            self._upsert([dict(r) for r in rows])
+        register_invalidation(self)
+
+    def owns(self, node_id):
+        return self.partition is None or partition_of(node_id) == self.partition
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _upsert(self, rows):
+        dim = self.emb.shape[1] or next((len(r["embedding"]) for r in rows if r["embedding"]), 0)
+        new = [r for r in rows if r["id"] not in self.index]
+        if new:
+            self.emb = np.vstack([self.emb.reshape(-1, dim), np.zeros((len(new), dim), dtype="float32")])
+            self.has_emb = np.concatenate([self.has_emb, np.zeros(len(new), dtype=bool)])
+            self.degree = np.concatenate([self.degree, np.zeros(len(new), dtype=np.int64)])
+            for r in new:
+                self.index[r["id"]] = len(self.ids)
+                self.ids.append(r["id"]); self.labels.append(""); self.label_sets.append(set()); self.texts.append(None)
+        for r in rows:
+            i = self.index[r["id"]]
+            self.labels[i] = r["labels"][0] if r["labels"] else ""
+            self.label_sets[i] = set(r["labels"] or [])
+            self.texts[i] = r["text"]
+            self.has_emb[i] = bool(r["embedding"])
+            self.degree[i] = r.get("degree") or 0
+            self.emb[i] = r["embedding"] if r["embedding"] else 0.0
+
+    def _refresh(self, ids):
+        with self.driver.session() as s:
+            rows = [dict(r) for r in s.run(f"MATCH (n) WHERE n.id IN $ids RETURN {NODE_FIELDS}", ids=list(ids))]
+        self._upsert(rows)
+        self._stale.difference_update(ids)
+
+    def _sync(self, ids=()):
+        if self._reload:
+            self._stale.update(self.ids); self._reload = False
+        missing = self._stale | {i for i in ids if i not in self.index and self.owns(i)}
+        if missing: self._refresh(missing)
+
+    def rows(self, ids):
+        """Row numbers for `ids` (-1 for ids not in the graph), re-reading stale or unseen ids first."""
+        self._sync(ids)
+        return np.array([self.index.get(i, -1) for i in ids], dtype=np.int64)
+
+    def relevance(self, query_emb, ids, default=0.3):
+        """Cosine similarity of each node to the (normalized) query; `default` for nodes without embeddings."""
+        rows = self.rows(ids)
+        ok = rows >= 0
+        ok[ok] = self.has_emb[rows[ok]]
+        out = np.full(len(ids), default, dtype=np.float64)
+        out[ok] = self.emb[rows[ok]].astype(np.float64) @ np.asarray(query_emb, dtype=np.float64)
+        return out
+
+    def top_k(self, query_emb, k):
+        """Rows of the k most similar embedded nodes, best first, with their similarities.
+        Candidates are ranked in float32 over the whole matrix, then re-scored in float64."""
+        self._sync()
+        k = min(k, int(self.has_emb.sum()))
+        if not k: return np.zeros(0, dtype=np.int64), np.zeros(0)
+        qe = np.asarray(query_emb, dtype=np.float64)
+        masked = np.where(self.has_emb, self.emb @ qe.astype("float32"), -np.inf)
+        m = min(k + 32, int(self.has_emb.sum()))
+        cand = np.argpartition(-masked, m - 1)[:m]
+        cand = cand[self.has_emb[cand]]
+        exact = self.emb[cand].astype(np.float64) @ qe
+        order = np.lexsort((cand, -exact))[:k]
+        return cand[order], exact[order]
+
+    def invalidate(self, node_ids):
+        self._stale.update(i for i in node_ids if self.owns(i))
+
+    def clear(self):
+        self._reload = True
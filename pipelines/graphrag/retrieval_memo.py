@@ -0,0 +1,115 @@
+import hashlib, json, os, sqlite3, threading, time, uuid, zlib
+from contextlib import contextmanager
+from pathlib import Path
+
+GRAPH_VERSION_FILE = Path("data/graph_version.json")
+
+def bump_graph_version(**info):
+    """Called by the KG builder after every load: retrieval results memoized against the old
+    graph stop matching (and are dropped the next time a memo is opened)."""
+    GRAPH_VERSION_FILE.parent.mkdir(parents=True, exist_ok=True)
+    version = {"version": uuid.uuid4().hex[:16], "built_at": time.strftime("%Y-%m-%d %H:%M:%S"), **info}
+    tmp = GRAPH_VERSION_FILE.with_suffix(".tmp")
+    json.dump(version, open(tmp, "w"), indent=2)
+    tmp.replace(GRAPH_VERSION_FILE)
+    return version["version"]
+
+class GraphVersionWatch:
+    """Tells a long-lived in-memory cache that the KG builder, usually another process, has
+    loaded a new graph: one stat of the version file, at most every `interval` seconds."""
+    def __init__(self, interval=1.0):
+        self.interval, self._checked, self._stamp = interval, time.monotonic(), self.stamp()
+
+    @staticmethod
+    def stamp():
+        try:
+            return os.stat(GRAPH_VERSION_FILE).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def changed(self):
+        now = time.monotonic()
+        if now - self._checked < self.interval: return False
+        self._checked, stamp = now, self.stamp()
+        if stamp == self._stamp: return False
+        self._stamp = stamp
+        return True
+
+class RetrievalMemo:
+    """Retrieved subgraphs persisted in SQLite, keyed by hash(query, scope, retrieval settings,
+    graph version). Retrieval is deterministic given those, so every graph pipeline with the
+    same settings (GraphRAG, Graph-Only, prompt-only ablations) can reuse a result instead of
+    retrieving again, in this process or a later run. Results are zlib-compressed JSON. Rows
+    from an older graph version are deleted when the memo sees the version change."""
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._version, self._stamp = None, None
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.writes = 0
+        self.saved_s = 0.0
+        with self._tx() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS memo (key TEXT PRIMARY KEY, graph_version TEXT, query TEXT,
+                result BLOB, retrieval_s REAL, created REAL)""")
+
+    @contextmanager
+    def _tx(self):
+        # A connection per call: pipelines may retrieve from several threads
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            yield db
+            db.execute("COMMIT")
+        except BaseException:
+            if db.in_transaction: db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    def graph_version(self):
+        stamp = os.stat(GRAPH_VERSION_FILE).st_mtime_ns if GRAPH_VERSION_FILE.exists() else None
+        with self._lock:
+            if stamp != self._stamp:
+                self._stamp = stamp
+                self._version = json.load(open(GRAPH_VERSION_FILE))["version"] if stamp else "unversioned"
+                with self._tx() as db:
+                    gone = db.execute("DELETE FROM memo WHERE graph_version != ?", (self._version,)).rowcount
+                if gone: print(f"Retrieval memo: dropped {gone} results from an older graph")
+            return self._version
+
+    def key(self, query, scope, settings):
+        """`settings`: everything besides the query that decides the result (a JSON-able dict)."""
+        blob = json.dumps([self.graph_version(), scope, settings, query], sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode()).hexdigest()
+
+    def get_many(self, keys):
+        """Stored (nodes, edges) per key, None where nothing is stored."""
+        found = {}
+        with self._tx() as db:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                found.update((k, (r, s)) for k, r, s in db.execute(
+                    f"SELECT key, result, retrieval_s FROM memo WHERE key IN ({','.join('?' * len(chunk))})", chunk))
+        out = []
+        for k in keys:
+            if k in found:
+                result, retrieval_s = found[k]
+                nodes, edges = json.loads(zlib.decompress(result))
+                out.append((nodes, edges))
+                self.hits += 1; self.saved_s += retrieval_s or 0.0
+            else:
+                out.append(None); self.misses += 1
+        return out
+
+    def put_many(self, items):
+        """items: (key, query, (nodes, edges), retrieval seconds) tuples."""
+        version = self.graph_version()
+        rows = [(k, version, q[:500], zlib.compress(json.dumps(list(ret)).encode()), s, time.time()) for k, q, ret, s in items]
+        with self._tx() as db:
+            db.executemany("INSERT OR REPLACE INTO memo VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self.writes += len(rows)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                "writes": self.writes, "saved_s": self.saved_s}
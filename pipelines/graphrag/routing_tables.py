@@ -0,0 +1,56 @@
+import os
+from pathlib import Path
+from pipelines import storage
+
+ROUTING_DIR = Path("data/routing")
+TABLE = ROUTING_DIR / "routing_components"
+
+def summarize(row, max_owners=3, max_items=4):
+    """One evidence line for a component: ranked owners (with the modules they maintain),
+    co-occurring components and the dependency closure."""
+    name = row.get("name") or row["id"]
+    # Kept short: evidence blocks are cut at 300 characters, so the most useful parts come first
+    owners = "; ".join(f"{o['id'].rsplit(':', 1)[-1]} ({o['issues']} issues"
+                       + (f"; maintains {', '.join(m.rsplit(':', 1)[-1] for m in o['modules'][:2])}" if o.get("modules") else "") + ")"
+                       for o in row.get("owners", [])[:max_owners])
+    co = ", ".join(f"{c['id'].rsplit(':', 1)[-1]} ({c['count']})" for c in row.get("co_components", [])[:max_items])
+    deps = ", ".join(f"{d['id'].rsplit(':', 1)[-1]}" + (f" (depth {d['depth']})" if d["depth"] > 1 else "")
+                     for d in row.get("depends_on", [])[:max_items])
+    parts = [f"Routing summary for component {name} ({row.get('issues', 0)} issues)."]
+    if owners: parts.append(f"Owners by assigned issues: {owners}.")
+    if co: parts.append(f"Often filed together with: {co}.")
+    if deps: parts.append(f"Depends on: {deps}.")
+    return " ".join(parts)
+
+class RoutingTables:
+    """Per-component routing aggregates materialized by scripts/materialize_routing.py, held
+    as a dict keyed by component id. The table is re-read when the file changes, so a
+    long run picks up incremental refreshes."""
+    def __init__(self, path=TABLE, max_components=3):
+        self.path, self.max_components = Path(path), max_components
+        self.rows, self._stamp = {}, None
+        self.lookups = self.hits = 0
+
+    def _load(self):
+        fp = storage.resolve(self.path)
+        stamp = os.stat(fp).st_mtime_ns if fp else None
+        if stamp != self._stamp:
+            self.rows = {r["id"]: r for r in storage.load_records(fp)} if fp else {}
+            self._stamp = stamp
+
+    def get(self, component_id):
+        self._load()
+        self.lookups += 1
+        row = self.rows.get(component_id)
+        self.hits += row is not None
+        return row
+
+    def evidence(self, nodes):
+        """Routing evidence nodes for the most relevant retrieved components (one keyed lookup each)."""
+        comps = sorted((n for n in nodes if n.get("label") == "Component"), key=lambda n: -n.get("relevance", 0.0))
+        out = []
+        for n in comps[:self.max_components]:
+            row = self.get(n["id"])
+            if row: out.append({"id": f"{n['id']}#routing", "label": "RoutingSummary", "text": summarize(row),
+                                "relevance": n.get("relevance", 0.0)})
+        return out
@@ -0,0 +1,204 @@
+import heapq, itertools
+import numpy as np
+import scipy.sparse as sp
+from pipelines.graphrag.node_index import NodeIndex
+
+def _gather(csr, rows):
+    """Flatten the CSR rows `rows` in order: (position in `rows`, column, storage index)."""
+    starts, ends = csr.indptr[rows], csr.indptr[rows + 1]
+    counts = ends - starts
+    pos = np.repeat(np.arange(len(rows)), counts)
+    offs = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    idx = np.repeat(starts, counts) + offs
+    return pos, csr.indices[idx], idx
+
+def tally(stats, info):
+    """Accumulate one best-first search's info into a stats dict (see GraphRAGPipeline.search_stats)."""
+    stats["queries"] += 1; stats["lookups"] += info["lookups"]
+    stats["max_lookups"] = max(stats["max_lookups"], info["lookups"])
+    stats[f"{info['stop']}_stops"] += 1
+
+class SparseExpansionEngine:
+    """Batch counterpart of GraphRAGPipeline._get_seeds -> _expand -> _prune.
+
+    The graph is loaded once; every (source label, expansion rule) pair becomes a sparse
+    adjacency matrix. Hop-limited reachability for a whole batch of seed sets is computed
+    with sparse matrix-matrix products, and seeding plus the prune threshold come from one
+    dense query x node similarity matmul. Per query, the kept nodes, edges and relevance
+    scores match the per-query path, emitted in the same BFS order (parent, rule, neighbor).
+    Rules with a `limit` keep each node's top-N edges (see NEIGHBOR_ORDER); nodes whose
+    out-degree exceeds `hub_degree` are kept but only expanded when they are seeds."""
+    def __init__(self, driver, expansion_policy, nodes=None, hub_degree=None):
+        # Node table (ids, labels, text, embedding matrix) shared with the per-query path
+        self.nodes = nodes or NodeIndex(driver)
+        self.n = n = len(self.nodes)
+        self.ids, self.index = self.nodes.ids, self.nodes.index
+        self.labels, self.texts = self.nodes.labels, self.nodes.texts
+        label_sets = self.nodes.label_sets
+        self.hub = self.nodes.degree[:n] > hub_degree if hub_degree is not None else np.zeros(n, dtype=bool)
+        # A partitioned node table only pulls its own repo's edges
+        where = "" if self.nodes.partition is None else " WHERE a.id STARTS WITH $prefix"
+        with driver.session() as s:
+            edges_by_type = {}
+            for etype in sorted({rule["edge"] for rules in expansion_policy.values() for rule in rules}):
+                edges_by_type[etype] = [(self.index[r["src"]], self.index[r["tgt"]], r["conf"], r["created"]) for r in s.run(
+                    f"MATCH (a)-[r:{etype}]->(b){where} RETURN a.id AS src, b.id AS tgt, r.confidence AS conf, r.created_at AS created",
+                    prefix=f"{self.nodes.partition}:")
+                    if self.index.get(r["src"], n) < n and self.index.get(r["tgt"], n) < n]
+        # rules in policy order: (max_depth, edge type, adjacency CSR, confidence per stored entry)
+        self.rules, self.rule_labels = [], []
+        for label, rules in expansion_policy.items():
+            for rule in rules:
+                self.rule_labels.append(label)
+                sel = [(a, b, c, t) for a, b, c, t in edges_by_type[rule["edge"]]
+                       if self.labels[a] == label and rule["target"] in label_sets[b]]
+                if rule.get("limit"): sel = self._top(sel, rule)
+                self.rules.append((rule["max_depth"], rule["edge"], *self._csr(sel, n)))
+        scope = "" if self.nodes.partition is None else f" ({self.nodes.partition})"
+        print(f"Sparse expansion{scope}: {n} nodes, {sum(r[2].nnz for r in self.rules)} policy edges")
+
+    @property
+    def emb(self):
+        return self.nodes.emb[:self.n]
+
+    @property
+    def has_emb(self):
+        return self.nodes.has_emb[:self.n]
+
+    def _top(self, edges, rule):
+        # Same ranking as the per-query Cypher (NEIGHBOR_ORDER): the rule's key descending, then target id
+        key = (lambda e: 0.0 if e[2] is None else e[2]) if rule.get("order_by", "confidence") == "confidence" else (lambda e: e[3] or "")
+        taken, out = {}, []
+        for e in sorted(sorted(edges, key=lambda e: self.ids[e[1]]), key=key, reverse=True):
+            if taken.get(e[0], 0) < rule["limit"]:
+                taken[e[0]] = taken.get(e[0], 0) + 1; out.append(e)
+        return out
+
+    @staticmethod
+    def _csr(edges, n):
+        # Built by hand so each row keeps the neighbor order the database returned
+        src = np.array([e[0] for e in edges], dtype=np.int64)
+        order = np.argsort(src, kind="stable")
+        cols = np.array([e[1] for e in edges], dtype=np.int64)[order]
+        conf = np.array([np.nan if e[2] is None else e[2] for e in edges], dtype=float)[order]
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(src, minlength=n))])
+        return sp.csr_matrix((np.ones(len(cols), dtype="float32"), cols, indptr), shape=(n, n)), conf
+
+    def _layer_matrix(self, depth):
+        mats = [A for max_depth, _, A, _ in self.rules if depth + 1 <= max_depth]
+        return sum(mats[1:], mats[0]) if mats else None
+
+    def similarities(self, query_embs):
+        return np.asarray(query_embs, dtype=np.float64) @ self.emb.T.astype(np.float64)
+
+    def seeds(self, sims, k):
+        k = min(k, int(self.has_emb.sum()))
+        masked = np.where(self.has_emb, sims, -np.inf)
+        top = np.argpartition(-masked, k - 1, axis=1)[:, :k] if k else np.zeros((len(sims), 0), dtype=np.int64)
+        return [row[np.argsort(-masked[q, row], kind="stable")] for q, row in enumerate(top)]
+
+    def reachability(self, seed_rows, max_hops=3):
+        """BFS depth of every node per query (-1 = unreached), one sparse product per hop."""
+        b, n = len(seed_rows), len(self.emb)
+        depth = np.full((b, n), -1, dtype=np.int8)
+        r = np.repeat(np.arange(b), [len(x) for x in seed_rows])
+        c = np.concatenate(seed_rows) if b else np.zeros(0, dtype=np.int64)
+        depth[r, c] = 0
+        frontier = sp.csr_matrix((np.ones(len(r), dtype="float32"), (r, c)), shape=(b, n))
+        for d in range(max_hops):
+            M = self._layer_matrix(d)
+            if M is None or frontier.nnz == 0: break
+            nxt = (frontier @ M).tocoo()
+            new = depth[nxt.row, nxt.col] < 0
+            r, c = nxt.row[new], nxt.col[new]
+            depth[r, c] = d + 1
+            r, c = r[~self.hub[c]], c[~self.hub[c]]  # hubs reached by expansion are leaves
+            frontier = sp.csr_matrix((np.ones(len(r), dtype="float32"), (r, c)), shape=(b, n))
+        return depth
+
+    def _walk(self, seeds, depth, kept, relevance, keys=False):
+        """BFS from `seeds` over the kept nodes. With `keys`, also returns the (depth, position of
+        the seed the path starts from) of every node and of every edge's source, for merging
+        walks over disjoint partitions into one BFS order."""
+        nodes, edges, layer, d = [], [], np.asarray(seeds, dtype=np.int64), 0
+        root = np.arange(len(layer))
+        node_keys, edge_keys = [], []
+        while len(layer):
+            nodes.extend(int(i) for i in layer if kept[i])
+            node_keys.extend((d, int(r)) for i, r in zip(layer, root) if kept[i])
+            if d: layer, root = layer[~self.hub[layer]], root[~self.hub[layer]]
+            parts = [(*_gather(A, layer), ri) for ri, (max_depth, _, A, _) in enumerate(self.rules) if d + 1 <= max_depth]
+            if not parts: break
+            pos = np.concatenate([p[0] for p in parts])
+            cols = np.concatenate([p[1] for p in parts])
+            idx = np.concatenate([p[2] for p in parts])
+            rule = np.concatenate([np.full(len(p[0]), p[3]) for p in parts])
+            order = np.lexsort((np.arange(len(pos)), rule, pos))
+            pos, cols, idx, rule = pos[order], cols[order], idx[order], rule[order]
+            src, src_root = layer[pos], root[pos]
+            for u, v, i, ri, r in zip(src, cols, idx, rule, src_root):
+                if kept[u] and kept[v]:
+                    _, etype, _, conf = self.rules[ri]
+                    edges.append({"source": self.ids[u], "target": self.ids[v], "type": etype,
+                                  "confidence": None if np.isnan(conf[i]) else float(conf[i])})
+                    edge_keys.append((d, int(r)))
+            new = depth[cols] == d + 1
+            nxt, nxt_root = cols[new], src_root[new]
+            _, first = np.unique(nxt, return_index=True)
+            first = np.sort(first)
+            layer, root, d = nxt[first], nxt_root[first], d + 1
+        nodes = [{"id": self.ids[i], "label": self.labels[i], "text": self.texts[i],
+                  "relevance": float(relevance[i])} for i in nodes]
+        return (nodes, edges, (node_keys, edge_keys)) if keys else (nodes, edges)
+
+    def expand_batch(self, sims, seed_rows, max_hops=3, threshold=0.35, keys=False):
+        """Expansion and pruning from given seed rows (e.g. seeds chosen across partitions).
+        `keys` adds each walk's BFS order keys (see _walk)."""
+        depth = self.reachability(seed_rows, max_hops)
+        relevance = np.where(self.has_emb, sims, 0.3)
+        kept = (depth >= 0) & (relevance >= threshold)
+        return [self._walk(seed_rows[q], depth[q], kept[q], relevance[q], keys) for q in range(len(seed_rows))]
+
+    def best_first(self, relevance, seeds, max_hops=3, threshold=0.35, budget=40):
+        """In-memory counterpart of GraphRAGPipeline._best_first for one query (same pop order,
+        nodes and edges). Returns (nodes, edges, info): neighbor lookups, records fetched, distinct
+        nodes reached and why the search stopped (budget, threshold or exhausted)."""
+        seq = itertools.count()
+        heap = [(-relevance[r], self.ids[r], 0, next(seq), int(r)) for r in seeds]
+        heapq.heapify(heap)
+        visited, order, fetched, lookups, stop = set(), [], [], 0, "exhausted"
+        while heap:
+            if len(order) >= budget: stop = "budget"; break
+            neg, _, d, _, u = heapq.heappop(heap)
+            if -neg < threshold: stop = "threshold"; break
+            if u in visited: continue
+            visited.add(u); order.append(u)
+            if d and self.hub[u]: continue
+            rules = [r for r, label in zip(self.rules, self.rule_labels) if d + 1 <= r[0] and label == self.labels[u]]
+            if rules: lookups += 1  # one neighbor lookup in the per-query path
+            for _, etype, A, conf in rules:
+                for i in range(A.indptr[u], A.indptr[u + 1]):
+                    v, c = int(A.indices[i]), conf[i]
+                    fetched.append((u, v, etype, None if np.isnan(c) else float(c)))
+                    if v not in visited and d + 1 <= max_hops:
+                        heapq.heappush(heap, (-(relevance[v] * (0.5 if np.isnan(c) else c)), self.ids[v], d + 1, next(seq), v))
+        edges = [{"source": self.ids[u], "target": self.ids[v], "type": t, "confidence": c}
+                 for u, v, t, c in fetched if u in visited and v in visited]
+        info = {"lookups": lookups, "records": len(fetched), "reached": len({int(r) for r in seeds} | {v for _, v, _, _ in fetched}),
+                "stop": stop}
+        return [{"id": self.ids[i], "label": self.labels[i], "text": self.texts[i], "relevance": float(relevance[i])}
+                for i in order], edges, info
+
+    def best_first_batch(self, query_embs, k=10, max_hops=3, threshold=0.35, budget=40, stats=None):
+        sims = self.similarities(query_embs)
+        relevance = np.where(self.has_emb, sims, 0.3)
+        out = []
+        for q, seeds in enumerate(self.seeds(sims, k)):
+            nodes, edges, info = self.best_first(relevance[q], seeds, max_hops, threshold, budget)
+            if stats is not None: tally(stats, info)
+            out.append((nodes, edges))
+        return out
+
+    def retrieve_batch(self, query_embs, k=10, max_hops=3, threshold=0.35):
+        sims = self.similarities(query_embs)
+        return self.expand_batch(sims, self.seeds(sims, k), max_hops, threshold)
@@ -1,11 +1,15 @@
-import os, json, time, yaml
+import os, json, time, yaml, atexit, threading
 from pathlib import Path
-from tenacity import retry, stop_after_attempt, wait_exponential
+try:
+    import fcntl
+except ImportError:  # Windows: appends are serialized by the in-process lock only
+    fcntl = None
 
 with open("config.yaml") as f:
     config = yaml.safe_load(f)
 
-COST_LOG = Path(config.get("cost_tracking", {}).get("log_file", "results/api_costs.jsonl"))
+COST_CFG = config.get("cost_tracking", {})
+COST_LOG = Path(COST_CFG.get("log_file", "results/api_costs.jsonl"))
 COST_LOG.parent.mkdir(parents=True, exist_ok=True)
 
 PRICING = {
@@ -14,60 +18,246 @@ PRICING = {
 }
 
 from openai import OpenAI
-client = OpenAI()
+from pipelines.dispatcher import AdaptiveDispatcher
+# Retries are owned by the dispatcher, so the SDK's own retry loop is disabled
+client = OpenAI(max_retries=0)
+dispatcher = AdaptiveDispatcher(**config["models"]["openai"].get("dispatcher", {}))
 MODEL = config["models"]["openai"]["generation_model"]
 MINI_MODEL = config["models"]["openai"]["mini_model"]
 TEMPERATURE = config["models"]["openai"]["temperature"]
 MAX_TOKENS = config["models"]["openai"]["max_tokens"]
 
-def log_cost(model, input_tokens, output_tokens, purpose=""):
+class BudgetExceeded(RuntimeError):
+    pass
+
+class UsageTracker:
+    """Running per-(model, purpose) usage totals plus a buffered cost-log writer.
+
+    Totals start from the existing log (read once) and are updated in memory, so cost
+    queries are O(1). Log lines are buffered and appended in one locked write (flock
+    across processes, a threading lock within one), every `flush_every` calls and at exit.
+    The budget applies to spend and tokens recorded by this process, or, after
+    share_budget(scope), by every process logging under the same scope."""
+    def __init__(self, log_path, flush_every=20, budget_usd=None, budget_tokens=None):
+        self.log_path = Path(log_path)
+        self.flush_every = flush_every
+        self.budget_usd, self.budget_tokens = budget_usd, budget_tokens
+        self.totals = {}
+        self.session_cost, self.session_tokens = 0.0, 0
+        self.scope, self.scope_cost, self.scope_tokens, self._offset = None, 0.0, 0, 0
+        self._buffer, self._loaded = [], False
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def _add(self, entry):
+        t = self.totals.setdefault((entry.get("model", "unknown"), entry.get("purpose", "unknown")),
+                                   {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cost": 0.0})
+        t["calls"] += 1
+        t["input_tokens"] += entry.get("input_tokens", 0)
+        t["output_tokens"] += entry.get("output_tokens", 0)
+        t["cost"] += entry.get("cost_usd", 0)
+
+    def _ensure_loaded(self):
+        # Must run before our first flush, otherwise our own lines would be counted twice
+        if self._loaded: return
+        if self.log_path.exists():
+            with open(self.log_path) as f:
+                for line in f:
+                    if line.strip(): self._add(json.loads(line))
+        self._loaded = True
+
+    def share_budget(self, scope):
+        """Count the spend of every process that logs under `scope` (e.g. the workers of one work
+        queue) against the budget; it is read back from the shared cost log before each call."""
+        with self._lock:
+            self.scope, self.scope_cost, self.scope_tokens, self._offset = scope, 0.0, 0, 0
+
+    def _read_scope(self):
+        # Complete lines appended since the last read, including this process's own
+        if not self.log_path.exists(): return
+        with open(self.log_path, "rb") as f:
+            if fcntl: fcntl.flock(f, fcntl.LOCK_SH)
+            try:
+                f.seek(self._offset); data = f.read()
+            finally:
+                if fcntl: fcntl.flock(f, fcntl.LOCK_UN)
+        end = data.rfind(b"\n") + 1
+        self._offset += end
+        for line in data[:end].splitlines():
+            try:
+                e = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if e.get("budget_scope") == self.scope:
+                self.scope_cost += e.get("cost_usd", 0)
+                self.scope_tokens += e.get("input_tokens", 0) + e.get("output_tokens", 0)
+
+    def record(self, entry):
+        with self._lock:
+            if self.scope is not None: entry["budget_scope"] = self.scope
+            self._ensure_loaded()
+            self._add(entry)
+            self.session_cost += entry.get("cost_usd", 0)
+            self.session_tokens += entry.get("input_tokens", 0) + entry.get("output_tokens", 0)
+            self._buffer.append(json.dumps(entry) + "\n")
+            # A shared budget is only as current as the log other processes read
+            shared = self.scope is not None and (self.budget_usd is not None or self.budget_tokens is not None)
+            if shared or len(self._buffer) >= self.flush_every: self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._buffer: return
+        with open(self.log_path, "a") as f:
+            if fcntl: fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write("".join(self._buffer)); f.flush()
+            finally:
+                if fcntl: fcntl.flock(f, fcntl.LOCK_UN)
+        self._buffer = []
+
+    def check_budget(self):
+        if self.budget_usd is None and self.budget_tokens is None: return
+        with self._lock:
+            if self.scope is None:
+                cost, tokens, who = self.session_cost, self.session_tokens, ""
+            else:
+                # Our buffered lines go out first, so every scoped process sees them at its next check
+                self._flush_locked(); self._read_scope()
+                cost, tokens, who = self.scope_cost, self.scope_tokens, f" ({self.scope})"
+        if self.budget_usd is not None and cost >= self.budget_usd:
+            raise BudgetExceeded(f"Spend budget reached{who}: ${cost:.4f} >= ${self.budget_usd:.4f}")
+        if self.budget_tokens is not None and tokens >= self.budget_tokens:
+            raise BudgetExceeded(f"Token budget reached{who}: {tokens} >= {self.budget_tokens}")
+
+    def by_purpose(self):
+        with self._lock:
+            self._ensure_loaded()
+            out = {}
+            for (_, purpose), t in self.totals.items():
+                p = out.setdefault(purpose, {"calls": 0, "cost": 0.0})
+                p["calls"] += t["calls"]; p["cost"] += t["cost"]
+            return out
+
+    def total_cost(self):
+        with self._lock:
+            self._ensure_loaded()
+            return sum(t["cost"] for t in self.totals.values())
+
+usage = UsageTracker(COST_LOG, COST_CFG.get("flush_every", 20),
+                     COST_CFG.get("budget_usd"), COST_CFG.get("budget_tokens"))
+
+BATCH_DISCOUNT = 0.5  # Batch API price relative to synchronous calls
+
+def log_cost(model, input_tokens, output_tokens, purpose="", batch=False, **extra):
     pricing = PRICING.get(model, {"input": 5.0, "output": 15.0})
     cost = (input_tokens * pricing["input"] + output_tokens * pricing["output"]) / 1_000_000
+    if batch: cost *= BATCH_DISCOUNT
     entry = {"timestamp": time.strftime("%Y-%m-%d %H:%M:%S"), "model": model,
              "input_tokens": input_tokens, "output_tokens": output_tokens,
              "cost_usd": round(cost, 6), "purpose": purpose}
-    with open(COST_LOG, "a") as f:
-        f.write(json.dumps(entry) + "\n")
+    if batch: entry["batch"] = True
+    entry.update(extra)
+    usage.record(entry)
     return cost
 
-@retry(stop=stop_after_attempt(5), wait=wait_exponential(multiplier=1, min=2, max=60))
 def generate(prompt, system_prompt=None, model=None, purpose="generation"):
+    # Checked once per logical call, before any attempt is dispatched
+    usage.check_budget()
+    return _generate(prompt, system_prompt, model, purpose)
+
+def _generate(prompt, system_prompt=None, model=None, purpose="generation"):
     model = model or MODEL
     messages = []
     if system_prompt:
         messages.append({"role": "system", "content": system_prompt})
     messages.append({"role": "user", "content": prompt})
-    response = client.chat.completions.create(
-        model=model, messages=messages, temperature=TEMPERATURE,
-        max_tokens=MAX_TOKENS, top_p=config["models"]["openai"].get("top_p", 0.95))
+    # Rough pre-dispatch token charge (~4 chars/token); max_tokens counts against TPM too
+    est_tokens = len(prompt + (system_prompt or "")) // 4 + MAX_TOKENS
+    sent = {}
+    def request():
+        sent["at"] = time.time()  # the attempt that succeeded; pacing and retries are not latency
+        return client.chat.completions.with_raw_response.create(
+            model=model, messages=messages, temperature=TEMPERATURE,
+            max_tokens=MAX_TOKENS, top_p=config["models"]["openai"].get("top_p", 0.95))
+    response = dispatcher.call(request, est_tokens)
+    latency = round(time.time() - sent["at"], 4)
     text = response.choices[0].message.content
     input_tokens = response.usage.prompt_tokens
     output_tokens = response.usage.completion_tokens
-    cost = log_cost(model, input_tokens, output_tokens, purpose)
+    cost = log_cost(model, input_tokens, output_tokens, purpose, latency_s=latency)
     return {"text": text, "input_tokens": input_tokens,
             "output_tokens": output_tokens, "cost_usd": cost}
 
+class CompletionStream:
+    """Streaming chat completion. Iterating yields text deltas as they arrive. After each
+    delta `abort(text_so_far)` is consulted; a truthy return (the reason) cancels the request.
+    Once iteration ends, `result` holds the generate()-style dict plus ttft_s (request sent ->
+    first token), tokens_per_s (output tokens after the first one / decode time) and aborted,
+    and the call is in the cost log. Usage of an aborted stream is estimated (~4 chars/token
+    prompt, one token per chunk received)."""
+    def __init__(self, prompt, system_prompt=None, model=None, purpose="generation", abort=None):
+        self.model = model or MODEL
+        self.purpose, self.abort = purpose, abort
+        self.messages = ([{"role": "system", "content": system_prompt}] if system_prompt else []) + \
+                        [{"role": "user", "content": prompt}]
+        self.est_input = len(prompt + (system_prompt or "")) // 4
+        self.text, self.result = "", None
+
+    def __iter__(self):
+        sent = {}
+        def request():
+            sent["at"] = time.time()
+            return client.chat.completions.with_raw_response.create(
+                model=self.model, messages=self.messages, temperature=TEMPERATURE, max_tokens=MAX_TOKENS,
+                top_p=config["models"]["openai"].get("top_p", 0.95), stream=True, stream_options={"include_usage": True})
+        stream = dispatcher.call(request, self.est_input + MAX_TOKENS)
+        first = reported = aborted = None
+        chunks = 0
+        try:
+            for chunk in stream:
+                if chunk.usage: reported = chunk.usage
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta: continue
+                if first is None: first = time.time()
+                chunks += 1
+                self.text += delta
+                yield delta
+                aborted = self.abort(self.text) if self.abort else None
+                if aborted: break
+        finally:
+            end = time.time()
+            if reported is None: stream.close()
+            input_tokens = reported.prompt_tokens if reported else self.est_input
+            output_tokens = reported.completion_tokens if reported else chunks
+            ttft = round(first - sent["at"], 4) if first else None
+            tps = round((output_tokens - 1) / (end - first), 1) if first and end > first and output_tokens > 1 else None
+            extra = {"stream": True, "ttft_s": ttft, "tokens_per_s": tps, "latency_s": round(end - sent["at"], 4)}
+            if aborted: extra["aborted"] = str(aborted)
+            if reported is None: extra["usage_estimated"] = True
+            cost = log_cost(self.model, input_tokens, output_tokens, self.purpose, **extra)
+            self.result = {"text": self.text, "input_tokens": input_tokens, "output_tokens": output_tokens,
+                           "cost_usd": cost, "ttft_s": ttft, "tokens_per_s": tps, "aborted": aborted or None}
+
+    def collect(self):
+        for _ in self: pass
+        return self.result
+
+def generate_stream(prompt, system_prompt=None, model=None, purpose="generation", abort=None):
+    """Streaming counterpart of generate(): returns a CompletionStream (iterate it, or .collect())."""
+    usage.check_budget()
+    return CompletionStream(prompt, system_prompt, model, purpose, abort)
+
 def generate_mini(prompt, system_prompt=None, purpose="evaluation"):
     return generate(prompt, system_prompt, model=MINI_MODEL, purpose=purpose)
 
 def get_total_cost():
-    total = 0.0
-    if COST_LOG.exists():
-        with open(COST_LOG) as f:
-            for line in f:
-                total += json.loads(line).get("cost_usd", 0)
-    return total
+    return usage.total_cost()
 
 def print_cost_summary():
-    costs = {}
-    if COST_LOG.exists():
-        with open(COST_LOG) as f:
-            for line in f:
-                entry = json.loads(line)
-                p = entry.get("purpose", "unknown")
-                costs.setdefault(p, {"calls": 0, "cost": 0.0})
-                costs[p]["calls"] += 1
-                costs[p]["cost"] += entry.get("cost_usd", 0)
+    costs = usage.by_purpose()
     print("\n--- API Cost Summary ---")
     total = 0
     for purpose, data in sorted(costs.items()):
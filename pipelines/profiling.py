@@ -0,0 +1,211 @@
+import atexit, json, os, sys, threading, time, tracemalloc, yaml
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+with open("config.yaml") as f:
+    config = yaml.safe_load(f)
+
+PROF_CFG = config.get("profiling", {})
+MODES = ["cpu", "memory", "all"]
+
+class Profiler:
+    """Sampling profiler plus tracemalloc, split into named stages (`mark` / `stage`).
+
+    A daemon thread reads every thread's Python stack every `interval` seconds
+    (sys._current_frames) and counts identical stacks per stage. The cost is one stack walk
+    per sample, however much code runs in between, so production-sized runs can be profiled.
+    Samples are wall-clock: threads blocked on I/O or locks show up where they wait. With
+    memory profiling, tracemalloc traces allocations; this slows pure-Python code many times
+    over (about 20x for a tight loop), so memory is only traced when asked for. Each stage's traced peak is attributed
+    to source lines by diffing two snapshots. One is taken when the stage starts. The other is
+    taken near the peak: the sampler takes a new one when traced memory passes the last by
+    `snapshot_growth`, at most every `min_snapshot_s`. Child processes (e.g. embedding
+    workers) are not profiled.
+
+    stop() writes to `out_dir`:
+    - profile.speedscope.json: one sampled profile per stage, for https://www.speedscope.app
+    - <stage>.collapsed: folded stacks for flamegraph.pl
+    - memory.txt: each stage's top allocating lines
+    - summary.json
+    stop() is also registered with atexit, so a script that exits early still writes them."""
+    def __init__(self, name, mode="cpu", out_dir=None, interval=None, top_lines=None, frames=None):
+        self.name, self.cpu, self.memory = name, mode in ["cpu", "all"], mode in ["memory", "all"]
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        self.out_dir = Path(out_dir or PROF_CFG.get("out_dir", "results/profiles")) / f"{name}-{stamp}-{os.getpid()}"
+        self.interval = interval or PROF_CFG.get("interval_ms", 10) / 1000
+        self.top_lines = top_lines or PROF_CFG.get("top_lines", 25)
+        self.frames = frames or PROF_CFG.get("tracemalloc_frames", 1)
+        self.snapshot_growth, self.min_snapshot_s = PROF_CFG.get("snapshot_growth", 0.1), PROF_CFG.get("min_snapshot_s", 5)
+        self.stages, self.order, self._current = {}, [], None
+        self._stop, self._thread, self._stopped = threading.Event(), None, False
+        self._lock = threading.Lock()
+
+    def start(self, stage="main"):
+        if self.memory and not tracemalloc.is_tracing(): tracemalloc.start(self.frames)
+        self.mark(stage)
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        print(f"Profiling {self.name} ({'cpu' if not self.memory else 'memory' if not self.cpu else 'cpu + memory'}) -> {self.out_dir}")
+        return self
+
+    def _stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = {"wall": 0.0, "samples": Counter(), "peak": 0, "snapshot": None, "snap_size": 0,
+                                 "snap_at": 0.0, "baseline": None}
+            self.order.append(name)
+        st = self.stages[name]
+        if self.memory:
+            # Growth is measured from where this stage (re)started
+            st["baseline"] = self._take()
+            st["snap_size"], _ = tracemalloc.get_traced_memory()
+            st["snapshot"], st["snap_at"] = None, time.time()
+        return st
+
+    def _close(self, now):
+        name, since = self._current
+        st = self.stages[name]
+        st["wall"] += now - since
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # Short stages, and growth since the sampler's last snapshot, are caught on the way out
+            if st["snapshot"] is None or current > st["snap_size"] * (1 + self.snapshot_growth): self._snapshot(st, current)
+            st["peak"] = max(st["peak"], peak)
+            tracemalloc.reset_peak()
+
+    def mark(self, name):
+        """Attribute everything from now on (until the next mark) to stage `name`."""
+        with self._lock:
+            if self._current: self._close(time.time())
+            self._stage(name)
+            # Started after the baseline snapshot, so the profiler's own work is not charged to the stage
+            self._current = (name, time.time())
+
+    @contextmanager
+    def stage(self, name):
+        outer = self._current[0] if self._current else "main"
+        self.mark(name)
+        try:
+            yield
+        finally:
+            self.mark(outer)
+
+    @staticmethod
+    def _take():
+        return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                                          tracemalloc.Filter(False, __file__)])
+
+    def _snapshot(self, st, size):
+        snap = self._take()
+        diff = snap.compare_to(st["baseline"], "lineno")
+        # Re-entered stages keep the allocating lines of their highest peak
+        if st.get("peak_lines") is None or size >= st.get("lines_at", 0):
+            st["peak_lines"] = [{"line": f"{s.traceback[0].filename}:{s.traceback[0].lineno}", "mb": s.size_diff / 2**20,
+                                 "blocks": s.count_diff, "total_mb": s.size / 2**20}
+                                for s in diff[:self.top_lines] if s.size_diff > 0]
+            st["lines_at"] = size
+        st.update(snapshot=snap, snap_size=size, snap_at=time.time())
+
+    def _run(self):
+        me, names, n = threading.get_ident(), {}, 0
+        while not self._stop.wait(self.interval):
+            if n % 100 == 0: names = {t.ident: t.name for t in threading.enumerate()}
+            n += 1
+            # Holding the lock keeps mark()'s own snapshots out of the samples
+            with self._lock:
+                st = self.stages[self._current[0]]
+                if self.cpu:
+                    for tid, frame in sys._current_frames().items():
+                        if tid == me: continue
+                        stack = []
+                        while frame is not None:
+                            code = frame.f_code
+                            stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                            frame = frame.f_back
+                        stack.append((names.get(tid, f"thread-{tid}"), "", 0))
+                        st["samples"][tuple(reversed(stack))] += 1
+                if self.memory:
+                    current, _ = tracemalloc.get_traced_memory()
+                    if current > st["snap_size"] * (1 + self.snapshot_growth) and time.time() - st["snap_at"] >= self.min_snapshot_s:
+                        self._snapshot(st, current)
+
+    @staticmethod
+    def _frame_name(frame):
+        name, path, line = frame
+        return f"{name} ({os.path.basename(path)}:{line})" if path else name
+
+    def stop(self):
+        if self._stopped: return
+        self._stopped = True
+        self._stop.set()
+        if self._thread: self._thread.join()
+        with self._lock: self._close(time.time())
+        if self.memory: tracemalloc.stop()
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        frames, index, profiles, summary = [], {}, [], {"name": self.name, "interval_s": self.interval, "stages": {}}
+        for name in self.order:
+            st = self.stages[name]
+            samples, weights = [], []
+            for stack, count in st["samples"].items():
+                for f in stack:
+                    if f not in index:
+                        index[f] = len(frames)
+                        frames.append({"name": self._frame_name(f), **({"file": f[1], "line": f[2]} if f[1] else {})})
+                samples.append([index[f] for f in stack]); weights.append(count * self.interval)
+            if samples:
+                profiles.append({"type": "sampled", "name": name, "unit": "seconds", "startValue": 0,
+                                 "endValue": sum(weights), "samples": samples, "weights": weights})
+                safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+                with open(self.out_dir / f"{safe}.collapsed", "w") as f:
+                    for stack, count in st["samples"].most_common():
+                        f.write(";".join(self._frame_name(fr).replace(";", ",") for fr in stack) + f" {count}\n")
+            # Own time: the innermost frame of each main-thread sample
+            own = Counter()
+            for stack, count in st["samples"].items():
+                if stack[0][0] == "MainThread": own[self._frame_name(stack[-1])] += count
+            summary["stages"][name] = {"wall_s": round(st["wall"], 3), "samples": sum(st["samples"].values()),
+                                       "top_functions": [[fn, c] for fn, c in own.most_common(10)],
+                                       "peak_mb": round(st["peak"] / 2**20, 2) if self.memory else None,
+                                       "top_lines": st.get("peak_lines") or []}
+        if profiles:
+            json.dump({"$schema": "https://www.speedscope.app/file-format-schema.json", "name": self.name,
+                       "exporter": "pipelines/profiling.py", "shared": {"frames": frames}, "profiles": profiles},
+                      open(self.out_dir / "profile.speedscope.json", "w"))
+        if self.memory:
+            with open(self.out_dir / "memory.txt", "w") as f:
+                for name, s in summary["stages"].items():
+                    f.write(f"== {name}: traced peak {s['peak_mb']:.1f} MB; growth during the stage by line (MB, blocks, MB live at that line)\n")
+                    for t in s["top_lines"]: f.write(f"  {t['mb']:>+9.2f} MB {t['blocks']:>+9d} {t['total_mb']:>9.2f} MB  {t['line']}\n")
+        json.dump(summary, open(self.out_dir / "summary.json", "w"), indent=2)
+
+        print(f"\nProfile ({self.name}): {self.out_dir}")
+        print(f"  {'Stage':<28} {'Wall':>9} {'Samples':>8} {'Peak MB':>8}  Hottest (main thread, own time)")
+        for name, s in summary["stages"].items():
+            hot = s["top_functions"][0][0] if s["top_functions"] else "-"
+            peak = f"{s['peak_mb']:>8.1f}" if self.memory else f"{'-':>8}"
+            print(f"  {name[:28]:<28} {s['wall_s']:>8.1f}s {s['samples']:>8d} {peak}  {hot}")
+            if s["top_lines"]: print(f"  {'':<28} top allocation: +{s['top_lines'][0]['mb']:.1f} MB at {s['top_lines'][0]['line']}")
+
+class NoProfiler:
+    """Stand-in when profiling is off; stages cost nothing."""
+    def mark(self, name):
+        pass
+
+    @contextmanager
+    def stage(self, name):
+        yield
+
+    def stop(self):
+        pass
+
+def start(name, mode=None):
+    """Profiler for script `name` if `mode` (cpu | memory | all, from --profile) is set, else a no-op."""
+    if not mode: return NoProfiler()
+    if mode not in MODES: raise ValueError(f"Unknown profile mode {mode!r}; expected one of {MODES}")
+    return Profiler(name, mode).start()
+
+def add_argument(parser):
+    parser.add_argument("--profile", nargs="?", const="cpu", default=None, choices=MODES,
+                        help="sample stacks per stage into results/profiles/ (cpu, the default); memory | all "
+                             "also trace allocations with tracemalloc, which slows Python code many times over")
@@ -0,0 +1,67 @@
+import threading, time
+from pipelines.encoders import load_encoder, EMBED_CFG
+
+class Registry:
+    """Process-wide shared resources (encoders, Neo4j drivers, node tables, indexes) keyed by
+    what defines them. The first acquire creates a resource, later ones get the same object;
+    creation of one key never blocks lookups of another. Each acquire is matched by a release;
+    the last release closes the resource (`close(value)`) and forgets it."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> {"value", "refs", "close", "ready" (creation lock), "load_s"}
+
+    def acquire(self, key, factory, close=None):
+        with self._lock:
+            entry = self._entries.setdefault(key, {"value": None, "refs": 0, "close": close,
+                                                   "ready": threading.Lock(), "load_s": None})
+            entry["refs"] += 1
+        try:
+            with entry["ready"]:
+                if entry["load_s"] is None:
+                    start = time.time()
+                    entry["value"] = factory()
+                    entry["load_s"] = time.time() - start
+        except BaseException:
+            self.release(key)
+            raise
+        return entry["value"]
+
+    def release(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None: return
+            entry["refs"] -= 1
+            if entry["refs"] > 0: return
+            del self._entries[key]
+        if entry["close"] is not None and entry["load_s"] is not None: entry["close"](entry["value"])
+
+    def stats(self):
+        """{key: (references, seconds it took to create)} for every live resource."""
+        with self._lock:
+            return {key: (e["refs"], e["load_s"]) for key, e in self._entries.items()}
+
+REGISTRY = Registry()
+
+class Resources:
+    """The shared resources one owner (e.g. a pipeline) holds; close() releases them all."""
+    def __init__(self, registry=REGISTRY):
+        self.registry, self.keys = registry, []
+
+    def get(self, key, factory, close=None):
+        value = self.registry.acquire(key, factory, close)
+        self.keys.append(key)
+        return value
+
+    def encoder(self, model_name=None, backend=None):
+        model_name = model_name or EMBED_CFG.get("name", "all-MiniLM-L6-v2")
+        backend = backend or EMBED_CFG.get("backend", "torch")
+        return self.get(("encoder", model_name, backend), lambda: load_encoder(model_name, backend))
+
+    def neo4j_driver(self, cfg):
+        from neo4j import GraphDatabase
+        return self.get(("neo4j", cfg["uri"], cfg["user"]),
+                        lambda: GraphDatabase.driver(cfg["uri"], auth=(cfg["user"], cfg["password"])),
+                        close=lambda d: d.close())
+
+    def close(self):
+        while self.keys: self.registry.release(self.keys.pop())
@@ -0,0 +1,110 @@
+import copy, time, threading, numpy as np
+from collections import OrderedDict
+from pipelines.graphrag.neighborhood_cache import register_invalidation
+from pipelines.graphrag.retrieval_memo import GraphVersionWatch
+
+class SemanticCache:
+    """Results of recent queries, looked up by query-embedding similarity so near-restatements
+    of an earlier request (repeated crash reports against one component, say) reuse its
+    retrieved subgraph and, with `reuse_output`, its generated plan.
+
+    Embeddings of the at most `max_entries` live queries sit in one preallocated matrix, so a
+    lookup is a single matrix-vector product. Entries expire `ttl_seconds` after they were
+    stored and are evicted least recently used first. When build_knowledge_graph.py finishes a
+    load (a new data/graph_version.json), the whole cache is dropped on the next lookup; graph
+    writes made in this process drop just the entries whose subgraph contains an upserted node
+    (via invalidate_nodes). An entry stored with a
+    `scope` (the repo a partitioned retrieval was limited to) only answers lookups in that scope."""
+    def __init__(self, threshold=0.95, max_entries=2048, ttl_seconds=3600, reuse_output=False):
+        self.threshold, self.max_entries, self.ttl, self.reuse_output = threshold, max_entries, ttl_seconds, reuse_output
+        self.emb = None
+        self.live = np.zeros(max_entries, dtype=bool)
+        self.scope = np.full(max_entries, None, dtype=object)
+        self._entries = OrderedDict()  # slot -> entry, least recently used first
+        self._free = list(range(max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+        self.lookups = self.hits = self.output_lookups = self.output_hits = 0
+        self.evictions = self.expirations = self.invalidations = 0
+        self.saved_s = 0.0
+        self._graph = GraphVersionWatch()
+        register_invalidation(self)
+
+    def _drop(self, slot):
+        del self._entries[slot]
+        self.live[slot] = False
+        self._free.append(slot)
+
+    def _reset(self):
+        self.invalidations += len(self._entries)
+        for slot in list(self._entries): self._drop(slot)
+
+    def _expire(self):
+        if self._graph.changed(): self._reset()
+        if not self.ttl: return
+        cutoff = time.time() - self.ttl
+        for slot in [s for s, e in self._entries.items() if e["created"] < cutoff]:
+            self._drop(slot); self.expirations += 1
+
+    def _best(self, qe, scope=None):
+        if not self._entries: return None, -1.0
+        sims = np.where(self.live & (self.scope == scope), self.emb @ np.asarray(qe, dtype="float32"), -np.inf)
+        slot = int(np.argmax(sims))
+        return slot, float(sims[slot])
+
+    def get(self, qe, output=False, scope=None):
+        """Copy of the closest cached entry at or above the threshold (None on a miss). With
+        `output`, only entries that hold a generated result count as hits."""
+        with self._lock:
+            self._expire()
+            slot, sim = self._best(qe, scope)
+            entry = self._entries.get(slot) if sim >= self.threshold else None
+            if output:
+                self.output_lookups += 1
+                if entry is None or entry["output"] is None: return None
+                self.output_hits += 1; self.saved_s += entry["generation_s"]
+            else:
+                self.lookups += 1
+                if entry is None: return None
+                self.hits += 1; self.saved_s += entry["retrieval_s"]
+            self._entries.move_to_end(slot)
+            return {"query": entry["query"], "similarity": sim, "retrieved": copy.deepcopy(entry["retrieved"]),
+                    "output": copy.deepcopy(entry["output"])}
+
+    def put(self, qe, query, retrieved, retrieval_s=0.0, output=None, generation_s=0.0, scope=None):
+        """Store a query's (nodes, edges); a repeat of the same query updates its entry (e.g. to add the output)."""
+        qe = np.asarray(qe, dtype="float32")
+        with self._lock:
+            if self.emb is None:
+                self.emb = np.zeros((self.max_entries, len(qe)), dtype="float32")
+            if self._graph.changed(): self._reset()
+            slot, sim = self._best(qe, scope)
+            if sim >= 1 - 1e-6:
+                entry = self._entries[slot]
+                if output is not None: entry.update(output=copy.deepcopy(output), generation_s=generation_s)
+                self._entries.move_to_end(slot)
+                return
+            if not self._free:
+                self._drop(next(iter(self._entries))); self.evictions += 1
+            slot = self._free.pop()
+            self.emb[slot], self.live[slot], self.scope[slot] = qe, True, scope
+            nodes = retrieved[0] if retrieved else []
+            self._entries[slot] = {"query": query, "retrieved": copy.deepcopy(retrieved), "created": time.time(),
+                                   "retrieval_s": retrieval_s, "output": copy.deepcopy(output),
+                                   "generation_s": generation_s, "node_ids": {n["id"] for n in nodes}}
+
+    def invalidate(self, node_ids):
+        node_ids = set(node_ids)
+        with self._lock:
+            for slot in [s for s, e in self._entries.items() if e["node_ids"] & node_ids]:
+                self._drop(slot); self.invalidations += 1
+
+    def clear(self):
+        with self._lock: self._reset()
+
+    def stats(self):
+        return {"entries": len(self._entries), "lookups": self.lookups, "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "output_lookups": self.output_lookups, "output_hits": self.output_hits,
+                "output_hit_rate": self.output_hits / self.output_lookups if self.output_lookups else 0.0,
+                "saved_s": self.saved_s, "evictions": self.evictions, "expirations": self.expirations,
+                "invalidations": self.invalidations}
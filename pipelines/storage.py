@@ -0,0 +1,126 @@
+import json, yaml
+from functools import lru_cache
+from pathlib import Path
+
+with open("config.yaml") as f:
+    config = yaml.safe_load(f)
+
+STORAGE_CFG = config.get("storage", {})
+FORMAT = STORAGE_CFG.get("format", "parquet")        # parquet | json
+COMPRESSION = STORAGE_CFG.get("compression", "zstd")
+ROW_GROUP_SIZE = STORAGE_CFG.get("row_group_size", 10000)
+SUFFIXES = {"parquet": ".parquet", "json": ".json"}
+
+@lru_cache(maxsize=1)
+def _schemas():
+    """Typed schemas keyed by dataset stem (results_<pipeline> files share "results")."""
+    import pyarrow as pa
+    s, i64, f64, b = pa.string(), pa.int64(), pa.float64(), pa.bool_()
+    strs = pa.list_(s)
+    return {
+        "issues": pa.schema([("id", i64), ("title", s), ("body", s), ("state", s), ("labels", strs),
+            ("assignees", strs), ("author", s), ("created_at", s), ("closed_at", s), ("url", s), ("repo", s),
+            ("comments", pa.list_(pa.struct([("author", s), ("body", s)])))]),
+        "prs": pa.schema([("id", i64), ("title", s), ("body", s), ("labels", strs), ("assignees", strs),
+            ("author", s), ("created_at", s), ("merged", b), ("url", s), ("repo", s), ("files_changed", strs)]),
+        "docs": pa.schema([("path", s), ("content", s), ("repo", s)]),
+        "entities_issues": pa.schema([("id", s), ("type", s), ("number", i64), ("title", s), ("body", s),
+            ("labels", strs), ("state", s), ("repo", s)]),
+        "entities_components": pa.schema([("id", s), ("type", s), ("name", s)]),
+        "entities_services": pa.schema([("id", s), ("type", s), ("name", s)]),
+        "entities_owners": pa.schema([("id", s), ("type", s), ("name", s)]),
+        "entities_code_modules": pa.schema([("id", s), ("type", s), ("name", s)]),
+        "entities_doc_pages": pa.schema([("id", s), ("type", s), ("path", s), ("content", s)]),
+        "relations": pa.schema([("source", s), ("target", s), ("type", s), ("confidence", f64), ("created_at", s)]),
+        "benchmark_raw": pa.schema([("instance_id", s), ("issue_id", s), ("title", s), ("text", s), ("labels", s),
+            ("task_type", s), ("repo", s),
+            ("gold_labels", pa.struct([("routing", s), ("taxonomy", s), ("dependencies", strs)]))]),
+        "routing_components": pa.schema([("id", s), ("repo", s), ("name", s), ("issues", i64),
+            ("owners", pa.list_(pa.struct([("id", s), ("score", f64), ("issues", i64), ("modules", strs)]))),
+            ("co_components", pa.list_(pa.struct([("id", s), ("count", i64)]))),
+            ("depends_on", pa.list_(pa.struct([("id", s), ("depth", i64), ("count", i64)])))]),
+        "results": pa.schema([("instance_id", s), ("pipeline", s), ("query", s), ("output", s), ("context", s),
+            ("latency_seconds", f64), ("task_type", s), ("generation", s), ("ttft_s", f64)]),
+    }
+
+def schema_for(stem):
+    schemas = _schemas()
+    return schemas.get("results" if stem.startswith("results_") else stem)
+
+def _base(path):
+    path = Path(path)
+    return path.with_suffix("") if path.suffix in SUFFIXES.values() else path
+
+def resolve(path):
+    """Existing file for a dataset path given with or without suffix, preferring the configured
+    format; None if the dataset has not been written yet."""
+    base = _base(path)
+    for fmt in [FORMAT] + [f for f in SUFFIXES if f != FORMAT]:
+        fp = base.with_suffix(SUFFIXES[fmt])
+        if fp.exists(): return fp
+    return None
+
+def exists(path):
+    return resolve(path) is not None
+
+def glob(directory, pattern):
+    """Dataset paths (without suffix) under `directory` matching `pattern`, e.g. "entities_*"."""
+    stems = {fp.with_suffix("") for suffix in SUFFIXES.values() for fp in Path(directory).glob(pattern + suffix)}
+    return sorted(stems)
+
+def _strip_nulls(rows):
+    # Columns absent from a record come back as null; drop them so .get() defaults behave as with JSON
+    return [{k: v for k, v in r.items() if v is not None} for r in rows]
+
+def save_records(records, path, fmt=None):
+    """Write a list of dicts as Parquet (typed schema where one is defined, zstd, row groups)
+    or indented JSON. Returns the file written."""
+    fmt = fmt or FORMAT
+    fp = _base(path).with_suffix(SUFFIXES[fmt])
+    fp.parent.mkdir(parents=True, exist_ok=True)
+    tmp = fp.with_name(fp.name + ".tmp")
+    if fmt == "json":
+        json.dump(records, open(tmp, "w"), indent=2)
+    else:
+        import pyarrow as pa, pyarrow.parquet as pq
+        schema = schema_for(fp.stem)
+        if schema is not None:
+            # Fields outside the typed schema are kept as inferred columns rather than dropped
+            extra = sorted({k for r in records for k in r} - set(schema.names))
+            if extra:
+                inferred = pa.Table.from_pylist([{k: r.get(k) for k in extra} for r in records]).schema
+                schema = pa.unify_schemas([schema, inferred])
+        table = pa.Table.from_pylist(records, schema=schema)
+        pq.write_table(table, tmp, compression=COMPRESSION, row_group_size=ROW_GROUP_SIZE)
+    tmp.replace(fp)  # checkpoints are rewritten often; never leave a half-written file behind
+    return fp
+
+def load_table(path, columns=None):
+    """Memory-mapped Arrow table with only `columns` read (columns missing from the file are skipped)."""
+    import pyarrow as pa, pyarrow.parquet as pq
+    fp = resolve(path)
+    if fp is None: raise FileNotFoundError(f"No dataset at {_base(path)}(.parquet|.json)")
+    if fp.suffix == ".json":
+        table = pa.Table.from_pylist(json.load(open(fp)))
+        return table.select([c for c in columns if c in table.column_names]) if columns else table
+    if columns:
+        present = set(pq.read_schema(fp).names)
+        columns = [c for c in columns if c in present]
+    return pq.read_table(fp, columns=columns, memory_map=True)
+
+def load_records(path, columns=None):
+    """List of dicts from a Parquet or JSON dataset, optionally projected to `columns`."""
+    fp = resolve(path)
+    if fp is None: raise FileNotFoundError(f"No dataset at {_base(path)}(.parquet|.json)")
+    if fp.suffix == ".json":
+        rows = json.load(open(fp))
+        return [{k: r[k] for k in columns if k in r} for r in rows] if columns else rows
+    return _strip_nulls(load_table(fp, columns).to_pylist())
+
+def count_records(path):
+    """Row count without loading the data (Parquet footer) where possible."""
+    fp = resolve(path)
+    if fp is None: return 0
+    if fp.suffix == ".json": return len(json.load(open(fp)))
+    import pyarrow.parquet as pq
+    return pq.ParquetFile(fp).metadata.num_rows
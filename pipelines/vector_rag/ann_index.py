@@ -0,0 +1,80 @@
+import json, hashlib, numpy as np, faiss
+
+INDEX_TYPES = ["flat", "hnsw", "ivf_flat", "ivf_pq"]
+DEFAULTS = {"type": "flat", "hnsw_m": 32, "ef_construction": 200, "ef_search": 64,
+            "nlist": None, "nprobe": 16, "pq_m": 48, "pq_nbits": 8, "refine_k_factor": 4, "train_sample": 100000, "seed": 42}
+
+def index_spec(cfg=None):
+    """Config (retrieval.vector_index) merged over the defaults."""
+    spec = {**DEFAULTS, **(cfg or {})}
+    if spec["type"] not in INDEX_TYPES:
+        raise ValueError(f"Unknown vector index type {spec['type']!r}; expected one of {INDEX_TYPES}")
+    return spec
+
+def spec_key(spec):
+    """Short hash of the build-time parameters (search-time ef_search/nprobe/refine k_factor excluded;
+    whether IVF-PQ is refined at all is build-time)."""
+    build = {k: v for k, v in spec.items() if k not in ("ef_search", "nprobe", "refine_k_factor")}
+    if spec["type"] == "ivf_pq": build["refine"] = bool(spec.get("refine_k_factor"))
+    return hashlib.sha256(json.dumps(build, sort_keys=True).encode()).hexdigest()[:10]
+
+def _nlist(spec, n):
+    return int(spec["nlist"] or max(1, min(int(4 * np.sqrt(n)), n // 39)))
+
+def build_index(embs, spec):
+    """Inner-product index over L2-normalized float32 rows. IVF variants train their coarse
+    quantizer (and PQ codebooks) on a random sample; corpora too small to train on (fewer than
+    4 * 39 rows, or than the 2^pq_nbits centroids of each PQ codebook) fall back to the exact
+    flat index. PQ codes alone cap recall however many lists are probed, so with
+    `refine_k_factor` IVF-PQ proposes k * refine_k_factor candidates that are re-ranked
+    exactly against the stored float vectors (faiss.IndexRefineFlat)."""
+    embs = np.ascontiguousarray(embs, dtype="float32")
+    n, d = embs.shape
+    kind = spec["type"]
+    if kind.startswith("ivf") and n < 39 * 4 or kind == "ivf_pq" and n < 2 ** spec["pq_nbits"]:
+        kind = "flat"
+    if kind == "flat":
+        index = faiss.IndexFlatIP(d)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(d, spec["hnsw_m"], faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = spec["ef_construction"]
+    else:
+        nlist = _nlist(spec, n)
+        quantizer = faiss.IndexFlatIP(d)
+        if kind == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, d, nlist, faiss.METRIC_INNER_PRODUCT)
+        else:
+            if d % spec["pq_m"]:
+                raise ValueError(f"pq_m={spec['pq_m']} must divide the embedding dimension {d}")
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, spec["pq_m"], spec["pq_nbits"], faiss.METRIC_INNER_PRODUCT)
+        rng = np.random.default_rng(spec["seed"])
+        sample = embs[np.sort(rng.choice(n, min(n, spec["train_sample"]), replace=False))]
+        index.train(sample)
+        if kind == "ivf_pq" and spec.get("refine_k_factor"):
+            index = faiss.IndexRefineFlat(index)
+    index.add(embs)
+    set_search_params(index, spec)
+    return index
+
+def set_search_params(index, spec):
+    """Apply search-time knobs (HNSW efSearch, IVF nprobe, refine k_factor) to a built or loaded index."""
+    if isinstance(index, faiss.IndexRefine):
+        index.k_factor = spec.get("refine_k_factor") or 1
+        set_search_params(faiss.downcast_index(index.base_index), spec)
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = spec["ef_search"]
+    elif isinstance(index, faiss.IndexIVF):
+        index.nprobe = min(spec["nprobe"], index.nlist)
+    return index
+
+def load_or_build(embs, path, spec):
+    """Flat indexes are rebuilt (cheap); ANN indexes are cached at `path` by faiss.write_index."""
+    if spec["type"] == "flat":
+        return build_index(embs, spec)
+    if path.exists():
+        return set_search_params(faiss.read_index(str(path)), spec)
+    index = build_index(embs, spec)
+    tmp = path.with_suffix(".tmp")
+    faiss.write_index(index, str(tmp))
+    tmp.replace(path)
+    return index
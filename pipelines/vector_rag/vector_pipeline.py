@@ -1,28 +1,60 @@
-import json, numpy as np, faiss
-from sentence_transformers import SentenceTransformer
+import yaml, numpy as np
 from pathlib import Path
+from pipelines.resources import Resources
+from pipelines.embedding_jobs import embed_texts, corpus_key
+from pipelines.vector_rag.ann_index import index_spec, spec_key, load_or_build
+from pipelines import storage
+ 
+with open("config.yaml") as f:
+    config = yaml.safe_load(f)
+ 
+INDEX_DIR = Path("data/indexes")
+ 
+def load_corpus(corpus_dir="data/processed"):
+    corpus, metadata = [], []
+    for fp in storage.glob(corpus_dir, "entities_*"):
+        for e in storage.load_records(fp, ["id","type","title","body","content","name","text_payload"]):
+            text = " ".join(filter(None,[e.get("title",""),e.get("body",""),
+                e.get("content",""),e.get("name",""),e.get("text_payload","")])).strip()
+            if len(text) > 20:
+                for i in range(0, len(text), 1848):
+                    corpus.append(text[i:i+2048])
+                    metadata.append({"entity_id":e.get("id",""),"entity_type":e.get("type","")})
+    return corpus, metadata
+ 
+def embeddings_path(corpus, model_name="all-MiniLM-L6-v2"):
+    # Corpus embeddings are cached by content hash (scripts/build_indexes.py builds them ahead of runs)
+    return INDEX_DIR / f"vector_{corpus_key(corpus, model_name)}.npy"
  
 class VectorRAGPipeline:
     def __init__(self, corpus_dir="data/processed", model_name="all-MiniLM-L6-v2"):
-        self.model = SentenceTransformer(model_name)
-        self.corpus, self.metadata = [], []
-        for fp in Path(corpus_dir).glob("entities_*.json"):
-            for e in json.load(open(fp)):
-                text = " ".join(filter(None,[e.get("title",""),e.get("body",""),
-                    e.get("content",""),e.get("name",""),e.get("text_payload","")])).strip()
-                if len(text) > 20:
-                    for i in range(0, len(text), 1848):
-                        self.corpus.append(text[i:i+2048])
-                        self.metadata.append({"entity_id":e.get("id",""),"entity_type":e.get("type","")})
-        print(f"Vector RAG: Embedding {len(self.corpus)} chunks...")
-        embs = self.model.encode(self.corpus, show_progress_bar=True, batch_size=64, normalize_embeddings=True)
-        embs = np.array(embs, dtype="float32")
-        self.index = faiss.IndexFlatIP(embs.shape[1])
-        self.index.add(embs)
-        print(f"FAISS index: {self.index.ntotal} vectors")
+        self.resources = Resources()
+        self.model = self.resources.encoder(model_name)
+        self.corpus, self.metadata = load_corpus(corpus_dir)
+        self.embeddings_path = embeddings_path(self.corpus, model_name)
+        if self.embeddings_path.exists():
+            print(f"Vector RAG: Loading {len(self.corpus)} chunk embeddings from {self.embeddings_path}")
+            embs = np.load(self.embeddings_path, mmap_mode="r")
+        else:
+            print(f"Vector RAG: Embedding {len(self.corpus)} chunks...")
+            embs, _ = embed_texts(self.corpus, self.embeddings_path, model_name, model=self.model, label="chunks")
+        # Exact inner product by default; HNSW / IVF-Flat / IVF-PQ via retrieval.vector_index
+        self.index_spec = index_spec(config["retrieval"].get("vector_index"))
+        index_path = self.embeddings_path.with_suffix(f".{self.index_spec['type']}-{spec_key(self.index_spec)}.faiss")
+        self.index = self.resources.get(("faiss", str(index_path)), lambda: load_or_build(embs, index_path, self.index_spec))
+        print(f"FAISS index ({self.index_spec['type']}): {self.index.ntotal} vectors")
  
     def retrieve(self, query, top_k=10):
         qe = self.model.encode([query], normalize_embeddings=True).astype("float32")
         scores, indices = self.index.search(qe, top_k)
         return [{"text":self.corpus[i],"score":float(s),"metadata":self.metadata[i]}
                 for s, i in zip(scores[0], indices[0]) if i >= 0]
+ 
+    def retrieve_batch(self, queries, top_k=10):
+        qe = self.model.encode(list(queries), batch_size=64, normalize_embeddings=True).astype("float32")
+        scores, indices = self.index.search(qe, top_k)
+        return [[{"text":self.corpus[i],"score":float(s),"metadata":self.metadata[i]}
+                 for s, i in zip(srow, irow) if i >= 0] for srow, irow in zip(scores, indices)]
+ 
+    def close(self):
+        self.resources.close()
@@ -0,0 +1,249 @@
+import json, os, socket, sqlite3, threading, time
+from contextlib import contextmanager
+from pathlib import Path
+try:
+    import fcntl
+except ImportError:  # Windows: the file backend is then only safe within one process
+    fcntl = None
+
+def worker_name():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+class SQLiteQueue:
+    """(pipeline, instance_id) tasks in one SQLite file shared by every worker.
+
+    A worker leases a batch of tasks for `lease_seconds`; heartbeats extend the lease while
+    it works. Tasks whose lease runs out (the worker crashed or hung) become leasable again,
+    and a late complete() from the old holder is ignored. Every write runs in an IMMEDIATE
+    transaction, so concurrent leases never hand out the same task. The default rollback
+    journal is kept (WAL needs shared memory, which hosts sharing the file over a network
+    filesystem do not have). A task that failed `max_attempts` times is parked as "failed"."""
+    def __init__(self, path, lease_seconds=600, max_attempts=3):
+        self.path, self.lease_seconds, self.max_attempts = Path(path), lease_seconds, max_attempts
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._tx() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS tasks (pipeline TEXT, instance_id TEXT, payload TEXT,
+                status TEXT DEFAULT 'pending', worker TEXT, lease_expires REAL, attempts INTEGER DEFAULT 0,
+                result TEXT, error TEXT, updated REAL, PRIMARY KEY (pipeline, instance_id))""")
+
+    @contextmanager
+    def _tx(self):
+        # A fresh connection per call keeps the queue usable from the heartbeat thread and forked workers
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            yield db
+            db.execute("COMMIT")
+        except BaseException:
+            if db.in_transaction: db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    def enqueue(self, pipeline, tasks):
+        """Add {instance_id: payload} tasks; ones already queued (in any state) are left alone."""
+        with self._tx() as db:
+            before = db.total_changes
+            db.executemany("INSERT OR IGNORE INTO tasks (pipeline, instance_id, payload, updated) VALUES (?, ?, ?, ?)",
+                           [(pipeline, iid, json.dumps(p), time.time()) for iid, p in tasks.items()])
+            return db.total_changes - before
+
+    def lease(self, worker, n, pipelines):
+        """Up to n available tasks of one pipeline (the first in `pipelines` with work left),
+        as (pipeline, instance_id, payload) tuples."""
+        now = time.time()
+        with self._tx() as db:
+            # A task whose holders keep dying (e.g. it runs the worker out of memory) is parked, not retried forever
+            db.execute("""UPDATE tasks SET status = 'failed', error = 'lease expired', worker = NULL, lease_expires = NULL
+                WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?""", (now, self.max_attempts))
+            for pipeline in pipelines:
+                rows = db.execute("""SELECT instance_id, payload FROM tasks WHERE pipeline = ? AND (status = 'pending'
+                    OR (status = 'leased' AND lease_expires < ?)) ORDER BY rowid LIMIT ?""", (pipeline, now, n)).fetchall()
+                if not rows: continue
+                db.executemany("""UPDATE tasks SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1,
+                    updated = ? WHERE pipeline = ? AND instance_id = ?""",
+                    [(worker, now + self.lease_seconds, now, pipeline, iid) for iid, _ in rows])
+                return [(pipeline, iid, json.loads(p)) for iid, p in rows]
+        return []
+
+    def heartbeat(self, worker, keys):
+        """Extend the leases `worker` still holds; returns the keys it has lost."""
+        now = time.time()
+        with self._tx() as db:
+            lost = []
+            for pipeline, iid in keys:
+                cur = db.execute("""UPDATE tasks SET lease_expires = ?, updated = ? WHERE pipeline = ? AND instance_id = ?
+                    AND status = 'leased' AND worker = ?""", (now + self.lease_seconds, now, pipeline, iid, worker))
+                if not cur.rowcount: lost.append((pipeline, iid))
+            return lost
+
+    def complete(self, worker, pipeline, instance_id, result):
+        """Store a result; False if the lease was lost (another worker now owns the task)."""
+        with self._tx() as db:
+            return db.execute("""UPDATE tasks SET status = 'done', result = ?, lease_expires = NULL, updated = ?
+                WHERE pipeline = ? AND instance_id = ? AND status = 'leased' AND worker = ?""",
+                (json.dumps(result), time.time(), pipeline, instance_id, worker)).rowcount > 0
+
+    def release(self, worker, keys, error=None):
+        """Hand leased tasks back. With `error` the attempt counts towards max_attempts;
+        without one (e.g. the worker is stopping) it does not."""
+        with self._tx() as db:
+            for pipeline, iid in keys:
+                db.execute("""UPDATE tasks SET status = CASE WHEN ? IS NOT NULL AND attempts >= ? THEN 'failed' ELSE 'pending' END,
+                    attempts = attempts - (? IS NULL), error = COALESCE(?, error), worker = NULL, lease_expires = NULL,
+                    updated = ? WHERE pipeline = ? AND instance_id = ? AND status = 'leased' AND worker = ?""",
+                    (error, self.max_attempts, error, error, time.time(), pipeline, iid, worker))
+
+    def results(self, pipeline):
+        with self._tx() as db:
+            return [json.loads(r) for (r,) in db.execute(
+                "SELECT result FROM tasks WHERE pipeline = ? AND status = 'done' ORDER BY rowid", (pipeline,))]
+
+    def counts(self):
+        """{pipeline: {status: count}}, with leases past expiry reported as "expired"."""
+        with self._tx() as db:
+            rows = db.execute("""SELECT pipeline, CASE WHEN status = 'leased' AND lease_expires < ? THEN 'expired'
+                ELSE status END, COUNT(*) FROM tasks GROUP BY 1, 2""", (time.time(),)).fetchall()
+        out = {}
+        for pipeline, status, n in rows: out.setdefault(pipeline, {})[status] = n
+        return out
+
+class FileQueue:
+    """The same queue as one JSON state file guarded by an flock'd lock file, for filesystems
+    where SQLite locking is unreliable. Results are appended to `<name>.results.jsonl` and
+    only count when the state file marks the writer's lease as completed."""
+    def __init__(self, path, lease_seconds=600, max_attempts=3):
+        self.path, self.lease_seconds, self.max_attempts = Path(path), lease_seconds, max_attempts
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock_path = self.path.with_suffix(".lock")
+        self.results_path = self.path.with_suffix(".results.jsonl")
+        self._local = threading.Lock()
+
+    @contextmanager
+    def _state(self, write=True):
+        with self._local, open(self.lock_path, "a") as lock:
+            if fcntl: fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                state = json.load(open(self.path)) if self.path.exists() else {"tasks": {}}
+                yield state
+                if write:
+                    tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+                    with open(tmp, "w") as f: json.dump(state, f)
+                    os.replace(tmp, self.path)
+            finally:
+                if fcntl: fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _key(pipeline, instance_id):
+        return f"{pipeline}\t{instance_id}"
+
+    def enqueue(self, pipeline, tasks):
+        with self._state() as st:
+            new = {self._key(pipeline, iid): {"payload": p, "status": "pending", "attempts": 0}
+                   for iid, p in tasks.items() if self._key(pipeline, iid) not in st["tasks"]}
+            st["tasks"].update(new)
+            return len(new)
+
+    def lease(self, worker, n, pipelines):
+        now = time.time()
+        with self._state() as st:
+            for t in st["tasks"].values():
+                if t["status"] == "leased" and t["lease_expires"] < now and t["attempts"] >= self.max_attempts:
+                    t.update(status="failed", error="lease expired", worker=None, lease_expires=None)
+            for pipeline in pipelines:
+                out = []
+                for key, t in st["tasks"].items():
+                    if len(out) == n: break
+                    p, iid = key.split("\t", 1)
+                    if p != pipeline: continue
+                    if t["status"] == "pending" or (t["status"] == "leased" and t["lease_expires"] < now):
+                        t.update(status="leased", worker=worker, lease_expires=now + self.lease_seconds,
+                                 attempts=t["attempts"] + 1)
+                        out.append((p, iid, t["payload"]))
+                if out: return out
+        return []
+
+    def heartbeat(self, worker, keys):
+        with self._state() as st:
+            lost = []
+            for pipeline, iid in keys:
+                t = st["tasks"].get(self._key(pipeline, iid))
+                if t and t["status"] == "leased" and t.get("worker") == worker:
+                    t["lease_expires"] = time.time() + self.lease_seconds
+                else:
+                    lost.append((pipeline, iid))
+            return lost
+
+    def complete(self, worker, pipeline, instance_id, result):
+        with self._state() as st:
+            t = st["tasks"].get(self._key(pipeline, instance_id))
+            if not t or t["status"] != "leased" or t.get("worker") != worker: return False
+            with open(self.results_path, "a") as f: f.write(json.dumps({"key": self._key(pipeline, instance_id),
+                                                                        "worker": worker, "result": result}) + "\n")
+            t.update(status="done", lease_expires=None)
+            return True
+
+    def release(self, worker, keys, error=None):
+        with self._state() as st:
+            for pipeline, iid in keys:
+                t = st["tasks"].get(self._key(pipeline, iid))
+                if not t or t["status"] != "leased" or t.get("worker") != worker: continue
+                if error is None: t["attempts"] -= 1
+                else: t["error"] = error
+                t.update(status="failed" if error is not None and t["attempts"] >= self.max_attempts else "pending",
+                         worker=None, lease_expires=None)
+
+    def results(self, pipeline):
+        with self._state(write=False) as st:
+            done = {k: t.get("worker") for k, t in st["tasks"].items() if t["status"] == "done"}
+            out = {}
+            if self.results_path.exists():
+                for line in open(self.results_path):
+                    if not line.strip(): continue
+                    r = json.loads(line)
+                    if r["key"].split("\t", 1)[0] == pipeline and done.get(r["key"]) == r["worker"]:
+                        out[r["key"]] = r["result"]
+            return list(out.values())
+
+    def counts(self):
+        now = time.time()
+        with self._state(write=False) as st:
+            out = {}
+            for key, t in st["tasks"].items():
+                status = "expired" if t["status"] == "leased" and t["lease_expires"] < now else t["status"]
+                c = out.setdefault(key.split("\t", 1)[0], {})
+                c[status] = c.get(status, 0) + 1
+            return out
+
+BACKENDS = {"sqlite": SQLiteQueue, "file": FileQueue}
+
+def open_queue(path, backend="sqlite", lease_seconds=600, max_attempts=3):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown work queue backend {backend!r}; expected one of {sorted(BACKENDS)}")
+    return BACKENDS[backend](path, lease_seconds, max_attempts)
+
+class Heartbeat:
+    """Background thread renewing the leases in `held` every `interval` seconds; keys
+    another worker has reclaimed are moved to `lost`."""
+    def __init__(self, queue, worker, interval=60):
+        self.queue, self.worker, self.interval = queue, worker, interval
+        self.held, self.lost = set(), set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            keys = list(self.held)
+            if not keys: continue
+            try:
+                lost = self.queue.heartbeat(self.worker, keys)
+            except Exception as e:  # e.g. the queue file is briefly locked; the next beat retries
+                print(f"\n  Heartbeat failed: {e}"); continue
+            self.lost.update(lost); self.held.difference_update(lost)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set(); self._thread.join()
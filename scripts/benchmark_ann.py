@@ -0,0 +1,114 @@
+"""
+benchmark_ann.py
+Recall@10 against the exact flat index, single-query p50/p95 latency, build time and index
+size for the approximate vector index options (HNSW, IVF-Flat, IVF-PQ) at increasing corpus
+sizes. Vectors come from the cached Vector RAG embeddings (scripts/build_indexes.py); sizes
+beyond the real corpus are filled by resampling real vectors with small Gaussian noise, or
+from a synthetic clustered set when nothing is cached. Queries are base rows set aside before
+the corpus is drawn, so neither they nor noisy copies of them are ever in the index.
+
+    python scripts/benchmark_ann.py --sizes 20000,100000,500000 --queries 500
+"""
+import json, time, argparse, sys
+from pathlib import Path
+import numpy as np, faiss
+
+sys.path.insert(0, ".")
+from pipelines.vector_rag.ann_index import index_spec, build_index, set_search_params
+
+# (label, build spec, search settings to sweep)
+CONFIGS = [
+    ("hnsw", {"type": "hnsw", "hnsw_m": 32, "ef_construction": 200}, [{"ef_search": ef} for ef in (16, 32, 64, 128)]),
+    ("ivf_flat", {"type": "ivf_flat"}, [{"nprobe": p} for p in (4, 16, 64)]),
+    ("ivf_pq", {"type": "ivf_pq", "pq_m": 48, "pq_nbits": 8, "refine_k_factor": None}, [{"nprobe": p} for p in (16, 64)]),
+    ("ivf_pq+rf", {"type": "ivf_pq", "pq_m": 48, "pq_nbits": 8, "refine_k_factor": 4},
+     [{"nprobe": p, "refine_k_factor": f} for p in (16, 64) for f in (2, 4, 16)]),
+]
+
+def base_vectors(dim, seed):
+    paths = sorted(Path("data/indexes").glob("vector_*.npy"), key=lambda p: p.stat().st_mtime)
+    if paths:
+        print(f"Base vectors: {paths[-1]}")
+        return np.load(paths[-1], mmap_mode="r")
+    print("No cached corpus embeddings; using a synthetic clustered set")
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(256, dim)).astype("float32")
+    x = centers[rng.integers(0, 256, 20000)] + 0.6 * rng.normal(size=(20000, dim)).astype("float32")
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+def held_out(base, queries, rng):
+    """(query rows, the remaining base rows the corpus is drawn from)."""
+    if queries >= len(base):
+        raise ValueError(f"--queries {queries} leaves no corpus out of {len(base)} base vectors")
+    order = rng.permutation(len(base))
+    return np.ascontiguousarray(base[np.sort(order[:queries])], dtype="float32"), np.sort(order[queries:])
+
+def vectors(base, pool, n, rng):
+    if n <= len(pool):
+        return np.ascontiguousarray(base[np.sort(rng.choice(pool, n, replace=False))], dtype="float32")
+    x = np.asarray(base[pool[rng.integers(0, len(pool), n)]], dtype="float32")
+    x[len(pool):] += 0.05 * rng.normal(size=(n - len(pool), x.shape[1])).astype("float32")
+    x[:len(pool)] = base[pool]
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+def search_latencies(index, queries, k):
+    lat, ids = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        _, i = index.search(q[None], k)
+        lat.append(time.perf_counter() - t0); ids.append(i[0])
+    return np.array(lat) * 1000, np.array(ids)
+
+def recall(found, truth):
+    return float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="20000,100000,500000")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dim", type=int, default=384, help="synthetic vectors only")
+    parser.add_argument("--threads", type=int, default=1, help="faiss OpenMP threads (1 = per-query serving)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    faiss.omp_set_num_threads(args.threads)
+    rng = np.random.default_rng(args.seed)
+    base = base_vectors(args.dim, args.seed)
+    queries, pool = held_out(base, args.queries, rng)
+
+    rows = []
+    for n in map(int, args.sizes.split(",")):
+        corpus = vectors(base, pool, n, rng)
+        print(f"\n=== {n} vectors, {queries.shape[1]} dims, {len(queries)} held-out queries ===")
+        t0 = time.time()
+        flat = build_index(corpus, index_spec({"type": "flat"}))
+        flat_build = time.time() - t0
+        lat, truth = search_latencies(flat, queries, args.k)
+        rows.append({"n": n, "index": "flat", "params": {}, "build_s": flat_build, f"recall@{args.k}": 1.0,
+                     "p50_ms": float(np.percentile(lat, 50)), "p95_ms": float(np.percentile(lat, 95)),
+                     "size_mb": len(faiss.serialize_index(flat)) / 1e6})
+        for label, build, sweep in CONFIGS:
+            spec = index_spec({**build, "seed": args.seed})
+            t0 = time.time()
+            try:
+                index = build_index(corpus, spec)
+            except (ValueError, RuntimeError) as e:
+                print(f"  {label}: skipped ({e})"); continue
+            build_s = time.time() - t0
+            size = len(faiss.serialize_index(index)) / 1e6
+            for params in sweep:
+                set_search_params(index, {**spec, **params})
+                lat, found = search_latencies(index, queries, args.k)
+                rows.append({"n": n, "index": label, "params": params, "build_s": build_s,
+                             f"recall@{args.k}": recall(found, truth), "p50_ms": float(np.percentile(lat, 50)),
+                             "p95_ms": float(np.percentile(lat, 95)), "size_mb": size})
+        print(f"{'Index':<10} {'Params':<28} {'Build':>8} {'Recall@' + str(args.k):>10} {'p50':>9} {'p95':>9} {'Size':>9}")
+        for r in rows:
+            if r["n"] != n: continue
+            params = ",".join(f"{k}={v}" for k, v in r["params"].items())
+            print(f"{r['index']:<10} {params:<28} {r['build_s']:>7.1f}s {r[f'recall@{args.k}']:>10.3f} "
+                  f"{r['p50_ms']:>7.2f}ms {r['p95_ms']:>7.2f}ms {r['size_mb']:>7.1f}MB")
+
+    out = Path("results/stats"); out.mkdir(parents=True, exist_ok=True)
+    json.dump(rows, open(out / "ann_benchmark.json", "w"), indent=2)
+    print("\nSaved to results/stats/ann_benchmark.json")
@@ -0,0 +1,85 @@
+"""
+benchmark_encoder.py
+Compares embedding backends (torch SentenceTransformer vs onnxruntime fp32/int8) on
+cold start, peak RSS, encode throughput and agreement with the torch embeddings.
+Each backend runs in a fresh subprocess so import cost and memory are measured cleanly.
+"""
+import json, time, argparse, subprocess, sys, tempfile
+from pathlib import Path
+
+sys.path.insert(0, ".")
+
+def corpus_sample(n):
+    texts = []
+    from pipelines import storage
+    for fp in storage.glob("data/processed", "entities_*"):
+        for e in storage.load_records(fp, ["title", "body", "content", "name"]):
+            text = " ".join(filter(None, [e.get("title",""), e.get("body",""), e.get("content",""), e.get("name","")])).strip()
+            if len(text) > 20: texts.append(text[:2000])
+            if len(texts) >= n: return texts
+    # No processed data yet: fall back to synthetic sentences of mixed length
+    base = "kubelet fails to mount projected volume after node restart with permission denied "
+    return [(base * (1 + i % 12))[:2000] for i in range(n)]
+
+def peak_rss_mb():
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+def worker(backend, n, batch_size, out):
+    t0 = time.time()
+    from pipelines.encoders import load_encoder
+    model = load_encoder(backend=backend)
+    model.encode(["warmup"], normalize_embeddings=True)
+    cold = time.time() - t0
+    texts = corpus_sample(n)
+    t0 = time.time()
+    embs = model.encode(texts, batch_size=batch_size, normalize_embeddings=True)
+    secs = time.time() - t0
+    import numpy as np
+    np.save(out, np.asarray(embs, dtype="float32"))
+    print(json.dumps({"backend": backend, "cold_start_s": cold, "sentences_per_s": len(texts) / secs,
+                      "peak_rss_mb": peak_rss_mb()}))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", default="torch,onnx,onnx-int8")
+    parser.add_argument("--n", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--out", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(args.worker, args.n, args.batch_size, args.out); sys.exit(0)
+
+    import numpy as np
+    tmp = Path(tempfile.mkdtemp())
+    rows, embs = [], {}
+    for backend in args.backends.split(","):
+        # Export/quantize outside the timed run so cold start reflects a prepared model
+        if backend != "torch":
+            from pipelines.encoders import export_onnx, EMBED_CFG
+            export_onnx(EMBED_CFG.get("name", "all-MiniLM-L6-v2"), quantized=backend == "onnx-int8")
+        out = tmp / f"{backend}.npy"
+        proc = subprocess.run([sys.executable, __file__, "--worker", backend, "--n", str(args.n),
+                               "--batch-size", str(args.batch_size), "--out", str(out)],
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"  {backend}: failed\n{proc.stderr[-2000:]}"); continue
+        rows.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+        embs[backend] = np.load(out)
+
+    ref = embs.get("torch")
+    print(f"\n{'Backend':<12} {'Cold start':>11} {'Peak RSS':>10} {'Sent/s':>9} {'Max |diff|':>11} {'Min cos':>8}")
+    print("-" * 66)
+    for r in rows:
+        e = embs[r["backend"]]
+        if ref is not None and e.shape == ref.shape:
+            diff, cos = f"{np.abs(e - ref).max():.2e}", f"{(e * ref).sum(1).min():.4f}"
+        else:
+            diff, cos = "-", "-"
+        print(f"{r['backend']:<12} {r['cold_start_s']:>10.2f}s {r['peak_rss_mb']:>8.0f}MB "
+              f"{r['sentences_per_s']:>9.1f} {diff:>11} {cos:>8}")
+    out = Path("results/stats"); out.mkdir(parents=True, exist_ok=True)
+    json.dump(rows, open(out / "encoder_benchmark.json", "w"), indent=2)
+    print("\nSaved to results/stats/encoder_benchmark.json")
@@ -0,0 +1,50 @@
+"""
+build_indexes.py
+Builds the retrieval indexes ahead of pipeline runs so run_experiment.py only loads them:
+Vector RAG chunk embeddings, encoded by the multi-process, length-bucketed embedding job
+runner (pipelines/embedding_jobs.py) and stored as a .npy file keyed by a content hash of
+the chunks and encoder settings. Throughput and per-core utilization are saved next to it.
+When retrieval.vector_index selects an approximate index (HNSW / IVF), it is trained and
+written next to the embeddings as well.
+
+    python scripts/build_indexes.py [--workers N] [--force]
+"""
+import json, time, argparse, sys
+import numpy as np
+
+sys.path.insert(0, ".")
+from pipelines.embedding_jobs import embed_texts
+from pipelines import profiling
+from pipelines.vector_rag.vector_pipeline import load_corpus, embeddings_path, config
+from pipelines.vector_rag.ann_index import index_spec, spec_key, load_or_build
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=None, help="encoder processes (default: config / all cores)")
+    parser.add_argument("--force", action="store_true", help="re-embed even if a cached file exists")
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    prof = profiling.start("build_indexes", args.profile)
+
+    start = time.time()
+    prof.mark("load_corpus")
+    corpus, _ = load_corpus()
+    path = embeddings_path(corpus)
+    print(f"Vector RAG corpus: {len(corpus)} chunks -> {path}")
+    if path.exists() and not args.force:
+        print("  Embeddings up to date")
+    else:
+        prof.mark("embed")
+        _, stats = embed_texts(corpus, path, workers=args.workers, label="chunks")
+        json.dump(stats, open(path.with_suffix(".json"), "w"), indent=2)
+
+    spec = index_spec(config["retrieval"].get("vector_index"))
+    if spec["type"] != "flat":
+        index_path = path.with_suffix(f".{spec['type']}-{spec_key(spec)}.faiss")
+        if args.force: index_path.unlink(missing_ok=True)
+        t0 = time.time()
+        prof.mark(f"index:{spec['type']}")
+        index = load_or_build(np.load(path, mmap_mode="r"), index_path, spec)
+        print(f"  {spec['type']} index: {index.ntotal} vectors -> {index_path} ({time.time() - t0:.1f}s)")
+    print(f"\nIndexes built in {time.time() - start:.1f}s")
+    prof.stop()
@@ -1,61 +1,96 @@
-import json, yaml
+import yaml, sys, argparse
 from pathlib import Path
 from neo4j import GraphDatabase
-from sentence_transformers import SentenceTransformer
 from tqdm import tqdm
  
+sys.path.insert(0, ".")
+from pipelines.graphrag.neighborhood_cache import invalidate_nodes
+from pipelines.graphrag.retrieval_memo import bump_graph_version
+from pipelines.encoders import load_encoder
+from pipelines.embedding_jobs import embed_texts
+from pipelines import storage, profiling
+ 
 with open("config.yaml") as f:
     config = yaml.safe_load(f)
  
-print("Loading embedding model...")
-embed_model = SentenceTransformer("all-MiniLM-L6-v2")
-driver = GraphDatabase.driver(config["neo4j"]["uri"],
-    auth=(config["neo4j"]["user"], config["neo4j"]["password"]))
- 
 def setup_schema(session):
     for label in ["Issue","Component","Service","Owner","CodeModule","DocumentationPage"]:
         session.run(f"CREATE CONSTRAINT IF NOT EXISTS FOR (n:{label}) REQUIRE n.id IS UNIQUE")
  
-def embed(text):
-    if not text: text = ""
-    return embed_model.encode(text[:2000], normalize_embeddings=True).tolist()
- 
 def load_entities(session, fpath, label):
-    entities = json.load(open(fpath))
+    entities = storage.load_records(fpath)
     print(f"  Loading {len(entities)} {label} nodes...")
-    for e in tqdm(entities, desc=f"    {label}"):
-        text = " ".join(filter(None, [e.get("title",""),e.get("name",""),
-            e.get("body","")[:500],e.get("content","")[:500]])).strip()
-        emb = embed(text)
-        props = {"id":e["id"], "text_payload":text[:2000], "embedding":emb}
+    texts = [" ".join(filter(None, [e.get("title",""),e.get("name",""),
+        e.get("body","")[:500],e.get("content","")[:500]])).strip() for e in entities]
+    # One length-bucketed, multi-process job per label instead of an encode call per node
+    embs, _ = embed_texts([t[:2000] for t in texts], model=embed_model, label=f"{label} nodes")
+    for e, text, emb in tqdm(zip(entities, texts, embs), total=len(entities), desc=f"    {label}"):
+        props = {"id":e["id"], "text_payload":text[:2000], "embedding":emb.tolist()}
         for k in ["title","name","path","state","number"]:
             if k in e: props[k] = e[k]
         if "labels" in e: props["labels_str"] = ", ".join(e["labels"])
         session.run(f"MERGE (n:{label} {{id: $id}}) SET n += $props", id=e["id"], props=props)
+    # Upserted nodes may appear in cached neighborhoods of any in-process pipeline
+    invalidate_nodes([e["id"] for e in entities])
  
 def load_relations(session, fpath):
-    relations = json.load(open(fpath))
+    relations = storage.load_records(fpath, ["source","target","type","confidence","created_at"])
     print(f"  Loading {len(relations)} relations...")
     for rel in tqdm(relations, desc="    Relations"):
         try:
-            session.run(f"MATCH (a {{id: $src}}) MATCH (b {{id: $tgt}}) MERGE (a)-[r:{rel['type'].upper()}]->(b) SET r.confidence = $conf",
-                src=rel["source"], tgt=rel["target"], conf=rel.get("confidence",0.5))
+            # Repeated relations (e.g. one per PR) keep the most recent created_at
+            session.run(f"MATCH (a {{id: $src}}) MATCH (b {{id: $tgt}}) MERGE (a)-[r:{rel['type'].upper()}]->(b) SET r.confidence = $conf, "
+                        "r.created_at = CASE WHEN r.created_at IS NULL OR r.created_at < $created THEN $created ELSE r.created_at END",
+                src=rel["source"], tgt=rel["target"], conf=rel.get("confidence",0.5), created=rel.get("created_at"))
         except: pass
+    invalidate_nodes({rel["source"] for rel in relations})
+ 
+def store_degrees(session):
+    """Out/in degree of every node, plus out-degree per relationship type (out_<type>), for
+    GraphRAG hub capping and scripts/fanout_report.py."""
+    print("  Computing node degrees...")
+    session.run("MATCH (n) SET n.out_degree = size([(n)-->() | 1]), n.in_degree = size([(n)<--() | 1])")
+    types = [r["t"] for r in session.run("CALL db.relationshipTypes() YIELD relationshipType AS t")]
+    for t in types:
+        session.run(f"MATCH (n) WHERE (n)-[:{t}]->() SET n.out_{t.lower()} = size([(n)-[:{t}]->() | 1])")
+        top = session.run(f"MATCH (n) WHERE n.out_{t.lower()} IS NOT NULL RETURN labels(n)[0] AS label, "
+                          f"max(n.out_{t.lower()}) AS mx, percentileDisc(n.out_{t.lower()}, 0.99) AS p99, count(n) AS c")
+        for r in top: print(f"    {t:12s} from {r['label']:18s} {r['c']:>7d} nodes, p99 {r['p99']:>5d}, max {r['mx']:>6d}")
+    # Degrees are read into the GraphRAG node tables
+    invalidate_nodes()
  
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    prof = profiling.start("build_knowledge_graph", args.profile)
+    # Loaded here, not at import: embedding workers re-import this module when they start
+    prof.mark("load_model")
+    print("Loading embedding model...")
+    embed_model = load_encoder()
+    driver = GraphDatabase.driver(config["neo4j"]["uri"],
+        auth=(config["neo4j"]["user"], config["neo4j"]["password"]))
     processed = Path("data/processed")
     with driver.session() as s:
+        prof.mark("schema")
         print("Setting up schema...")
         setup_schema(s)
-        files = {"entities_issues.json":"Issue","entities_components.json":"Component",
-                 "entities_services.json":"Service","entities_owners.json":"Owner",
-                 "entities_code_modules.json":"CodeModule","entities_doc_pages.json":"DocumentationPage"}
+        files = {"entities_issues":"Issue","entities_components":"Component",
+                 "entities_services":"Service","entities_owners":"Owner",
+                 "entities_code_modules":"CodeModule","entities_doc_pages":"DocumentationPage"}
         for fname, label in files.items():
             fp = processed / fname
-            if fp.exists(): load_entities(s, fp, label)
-        rp = processed / "relations.json"
-        if rp.exists(): load_relations(s, rp)
+            prof.mark(f"entities:{label}")
+            if storage.exists(fp): load_entities(s, fp, label)
+        prof.mark("relations")
+        rp = processed / "relations"
+        if storage.exists(rp): load_relations(s, rp)
+        prof.mark("degrees")
+        store_degrees(s)
         nodes = s.run("MATCH (n) RETURN count(n) as c").single()["c"]
         edges = s.run("MATCH ()-[r]->() RETURN count(r) as c").single()["c"]
         print(f"\nKnowledge Graph: {nodes} nodes, {edges} edges")
+        # Retrieval results memoized against the previous graph no longer apply
+        print(f"Graph version: {bump_graph_version(nodes=nodes, edges=edges)}")
     driver.close()
+    prof.stop()
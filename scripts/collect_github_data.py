@@ -6,11 +6,14 @@ collect_github_data.py — Fixed version with:
   - Progress saved after each repo
 """
 
-import os, json, time, yaml, requests, base64
+import os, sys, json, time, yaml, requests, base64
 from pathlib import Path
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+sys.path.insert(0, ".")
+from pipelines import storage
+
 with open("config.yaml") as f:
     config = yaml.safe_load(f)
 
@@ -289,45 +292,40 @@ if __name__ == "__main__":
         d.mkdir(exist_ok=True)
 
         # === CHECKPOINT: Skip repos that already have data ===
-        issues_file = d / "issues.json"
-        prs_file = d / "prs.json"
-        docs_file = d / "docs.json"
-
-        if issues_file.exists() and prs_file.exists() and docs_file.exists():
-            existing_issues = json.load(open(issues_file))
-            existing_prs = json.load(open(prs_file))
-            existing_docs = json.load(open(docs_file))
-            print(f"\n  SKIPPING {o}/{r} — already collected: {len(existing_issues)} issues, {len(existing_prs)} PRs, {len(existing_docs)} docs")
+        issues_file = d / "issues"
+        prs_file = d / "prs"
+        docs_file = d / "docs"
+
+        if storage.exists(issues_file) and storage.exists(prs_file) and storage.exists(docs_file):
+            n_issues, n_prs, n_docs = (storage.count_records(f) for f in [issues_file, prs_file, docs_file])
+            print(f"\n  SKIPPING {o}/{r} — already collected: {n_issues} issues, {n_prs} PRs, {n_docs} docs")
             print(f"  (Delete the folder data/raw/{o}_{r} to re-collect)")
             continue
 
         print(f"\n{'='*50}\n  Processing {o}/{r}\n{'='*50}")
 
         # Collect issues
-        if issues_file.exists():
-            issues = json.load(open(issues_file))
-            print(f"  Issues already saved: {len(issues)}")
+        if storage.exists(issues_file):
+            print(f"  Issues already saved: {storage.count_records(issues_file)}")
         else:
             issues = collect_issues(o, r, rc["max_issues"])
-            json.dump(issues, open(issues_file, "w"), indent=2)
+            storage.save_records(issues, issues_file)
             print(f"  Saved {len(issues)} issues")
 
         # Collect PRs
-        if prs_file.exists():
-            prs = json.load(open(prs_file))
-            print(f"  PRs already saved: {len(prs)}")
+        if storage.exists(prs_file):
+            print(f"  PRs already saved: {storage.count_records(prs_file)}")
         else:
             prs = collect_prs(o, r, rc["max_prs"])
-            json.dump(prs, open(prs_file, "w"), indent=2)
+            storage.save_records(prs, prs_file)
             print(f"  Saved {len(prs)} PRs")
 
         # Collect docs
-        if docs_file.exists():
-            docs = json.load(open(docs_file))
-            print(f"  Docs already saved: {len(docs)}")
+        if storage.exists(docs_file):
+            print(f"  Docs already saved: {storage.count_records(docs_file)}")
         else:
             docs = collect_docs(o, r)
-            json.dump(docs, open(docs_file, "w"), indent=2)
+            storage.save_records(docs, docs_file)
             print(f"  Saved {len(docs)} docs")
 
     # Final summary
@@ -337,9 +335,9 @@ if __name__ == "__main__":
     total_issues, total_prs, total_docs = 0, 0, 0
     for rc in config["github"]["repos"]:
         d = OUTPUT / f"{rc['owner']}_{rc['repo']}"
-        ni = len(json.load(open(d / "issues.json"))) if (d / "issues.json").exists() else 0
-        np_ = len(json.load(open(d / "prs.json"))) if (d / "prs.json").exists() else 0
-        nd = len(json.load(open(d / "docs.json"))) if (d / "docs.json").exists() else 0
+        ni = storage.count_records(d / "issues")
+        np_ = storage.count_records(d / "prs")
+        nd = storage.count_records(d / "docs")
         print(f"  {rc['owner']}/{rc['repo']}: {ni} issues, {np_} PRs, {nd} docs")
         total_issues += ni
         total_prs += np_
@@ -1,8 +1,12 @@
-import json, re, time, numpy as np
+import json, re, time, argparse, sys, numpy as np
 from scipy import stats
 from pathlib import Path
 from openai import OpenAI
 
+sys.path.insert(0, ".")
+from pipelines import storage
+from paired_stats import stratified_report, summarize, holm
+
 # ── helpers ──────────────────────────────────────────────────────────────────
 
 def faithfulness(output, context):
@@ -32,12 +36,17 @@ JUDGE_SYSTEM = (
     '{\"relevance\": X, \"completeness\": X, \"coherence\": X, \"overall\": X}'
 )
 
+JUDGE_MODEL = "gpt-4o-mini-2024-07-18"
+
+def judge_prompt(query, output):
+    return f"Query: {query}\n\nOutput:\n{output[:3000]}"
+
 def llm_judge(client, query, output, retries=3):
-    prompt = f"Query: {query}\n\nOutput:\n{output[:3000]}"
+    prompt = judge_prompt(query, output)
     for attempt in range(retries):
         try:
             resp = client.chat.completions.create(
-                model="gpt-4o-mini-2024-07-18",
+                model=JUDGE_MODEL,
                 messages=[
                     {"role": "system", "content": JUDGE_SYSTEM},
                     {"role": "user",   "content": prompt}
@@ -54,6 +63,12 @@ def llm_judge(client, query, output, retries=3):
 
 # ── load / score each pipeline ───────────────────────────────────────────────
 
+parser = argparse.ArgumentParser()
+parser.add_argument("--batch-api", action="store_true",
+                    help="judge all uncached outputs through the OpenAI Batch API before scoring")
+parser.add_argument("--poll-interval", type=int, default=30)
+args = parser.parse_args()
+
 results_dir  = Path("evaluation/automated")
 judge_cache  = Path("results/stats/judge_cache.json")
 judge_cache.parent.mkdir(parents=True, exist_ok=True)
@@ -61,12 +76,36 @@ judge_cache.parent.mkdir(parents=True, exist_ok=True)
 # Load existing judge scores so we can resume if interrupted
 cache = json.load(open(judge_cache)) if judge_cache.exists() else {}
 
+if args.batch_api:
+    from pipelines.batch_api import chat_request, run_batch
+    todo = {}
+    for fp in storage.glob(results_dir, "results_*"):
+        name = fp.stem.replace("results_", "")
+        for r in storage.load_records(fp, ["instance_id", "query", "output"]):
+            if f"{name}_{r['instance_id']}" not in cache:
+                todo[f"{name}_{r['instance_id']}"] = judge_prompt(r.get("query", ""), r.get("output", ""))
+    print(f"Batch judging {len(todo)} uncached outputs...")
+    if todo:
+        resp = run_batch([chat_request(k, p, JUDGE_SYSTEM, model=JUDGE_MODEL, max_tokens=80, temperature=0.0)
+                          for k, p in todo.items()], judge_cache.parent / "batches" / "judge.jsonl",
+                         "judge", args.poll_interval)
+        for k, r in resp.items():
+            try:
+                cache[k] = json.loads(r["text"])
+            except (KeyError, json.JSONDecodeError):
+                pass  # left uncached; judged synchronously below
+        json.dump(cache, open(judge_cache, "w"), indent=2)
+
 client = OpenAI()
 metrics = {}
+per_instance = {}   # pipeline -> instance_id -> metric values, for the paired comparisons
+bench_path = Path("data/benchmark/benchmark_raw")
+meta = {b["instance_id"]: b for b in storage.load_records(bench_path, ["instance_id", "task_type", "repo"])} \
+    if storage.exists(bench_path) else {}
 
-for fp in sorted(results_dir.glob("results_*.json")):
+for fp in storage.glob(results_dir, "results_*"):
     name = fp.stem.replace("results_", "")
-    data = json.load(open(fp))
+    data = storage.load_records(fp)
     print(f"\nScoring {name} ({len(data)} instances)...")
 
     faith, cov, struct, lat = [], [], [], []
@@ -97,6 +136,11 @@ for fp in sorted(results_dir.glob("results_*.json")):
         judge_comp.append(scores.get("completeness", 0))
         judge_coh.append(scores.get("coherence", 0))
         judge_overall.append(scores.get("overall", 0))
+        per_instance.setdefault(name, {})[r["instance_id"]] = {
+            "judge_overall": judge_overall[-1], "judge_relevance": judge_rel[-1],
+            "judge_completeness": judge_comp[-1], "judge_coherence": judge_coh[-1],
+            "faithfulness": faith[-1], "structural": struct[-1], "evidence_coverage": cov[-1], "latency": lat[-1]}
+        meta.setdefault(r["instance_id"], {"task_type": r.get("task_type")})
 
     # Save cache after each pipeline
     json.dump(cache, open(judge_cache, "w"), indent=2)
@@ -110,26 +154,32 @@ for fp in sorted(results_dir.glob("results_*.json")):
         "judge_completeness_mean": float(np.mean(judge_comp)),
         "judge_coherence_mean":    float(np.mean(judge_coh)),
         "judge_overall_mean":      float(np.mean(judge_overall)),
-        "raw_judge": judge_overall,
     }
 
 # ── statistical comparisons ───────────────────────────────────────────────────
 
-graphrag_j = metrics.get("graphrag", {}).get("raw_judge", [])
+graphrag_j = {iid: v["judge_overall"] for iid, v in per_instance.get("graphrag", {}).items()}
 comps = {}
 for bl in ["bm25", "vector_rag", "graph_only"]:
-    bj = metrics.get(bl, {}).get("raw_judge", [])
-    n = min(len(graphrag_j), len(bj))
+    bj = {iid: v["judge_overall"] for iid, v in per_instance.get(bl, {}).items()}
+    ids = sorted(graphrag_j.keys() & bj.keys())   # paired on instance_id, not on position
+    n = len(ids)
     if n < 2: continue
-    diff = np.array(graphrag_j[:n]) - np.array(bj[:n])
+    g, b = np.array([graphrag_j[i] for i in ids]), np.array([bj[i] for i in ids])
+    diff = g - b
     _, p_norm = stats.shapiro(diff) if n < 5000 else (0, 0.01)
     if p_norm > 0.05:
-        stat, pval = stats.ttest_rel(graphrag_j[:n], bj[:n]); test = "paired t-test"
+        stat, pval = stats.ttest_rel(g, b); test = "paired t-test"
     else:
-        stat, pval = stats.wilcoxon(graphrag_j[:n], bj[:n]); test = "Wilcoxon"
+        stat, pval = stats.wilcoxon(g, b); test = "Wilcoxon"
     d = float(np.mean(diff) / np.std(diff)) if np.std(diff) > 0 else 0.0
-    comps[bl] = {"test": test, "stat": float(stat), "p": float(pval),
-                 "p_corr": float(min(pval * 3, 1)), "d": d}
+    comps[bl] = {"test": test, "stat": float(stat), "p": float(pval), "n": n, "d": d}
+for c, p_adj in zip(comps.values(), holm([c["p"] for c in comps.values()])):
+    c["p_corr"] = float(p_adj)
+
+t0 = time.time()
+stratified = stratified_report(per_instance, meta)
+print(f"\nStratified bootstrap/permutation report computed in {time.time() - t0:.1f}s")
 
 # ── print results ─────────────────────────────────────────────────────────────
 
@@ -148,16 +198,18 @@ for name in ["bm25", "vector_rag", "graph_only", "graphrag"]:
 print("\nStatistical Comparisons — LLM-as-judge (GraphRAG vs baselines):")
 for bl, c in comps.items():
     sig = "***" if c["p_corr"] < 0.001 else "**" if c["p_corr"] < 0.01 else "*" if c["p_corr"] < 0.05 else "ns"
-    print(f"  vs {bl}: {c['test']}, p={c['p_corr']:.4f} {sig}, Cohen's d={c['d']:.2f}")
+    print(f"  vs {bl}: {c['test']}, p={c['p_corr']:.4f} {sig}, Cohen's d={c['d']:.2f}, n={c['n']}")
+summarize(stratified)
 
 # ── save ──────────────────────────────────────────────────────────────────────
 
 out = Path("results/stats")
 out.mkdir(parents=True, exist_ok=True)
 json.dump(
-    {"per_pipeline": {k: {kk: vv for kk, vv in v.items() if kk != "raw_judge"}
-                      for k, v in metrics.items()},
-     "comparisons": comps},
+    {"per_pipeline": metrics, "comparisons": comps},
     open(out / "all_metrics.json", "w"), indent=2, default=str
 )
-print("\nSaved to results/stats/all_metrics.json")
\ No newline at end of file
+json.dump(stratified, open(out / "stratified_comparisons.json", "w"), indent=2)
+storage.save_records([{"pipeline": p, "instance_id": iid, **meta.get(iid, {}), **v}
+                      for p, rows in per_instance.items() for iid, v in rows.items()], out / "per_instance_metrics")
+print("\nSaved to results/stats/all_metrics.json, stratified_comparisons.json and per_instance_metrics")
\ No newline at end of file
@@ -0,0 +1,41 @@
+"""
+convert_to_parquet.py
+One-shot conversion of existing whole-file JSON datasets (raw issues/PRs/docs, processed
+entities and relations, the benchmark and pipeline results) to typed, compressed Parquet.
+Row counts are verified after each write; pass --remove-json to delete the originals.
+
+    python scripts/convert_to_parquet.py [--remove-json] [--to json]
+"""
+import json, argparse, sys
+from pathlib import Path
+
+sys.path.insert(0, ".")
+from pipelines import storage
+
+DATASETS = ["data/raw/*/issues.json", "data/raw/*/prs.json", "data/raw/*/docs.json",
+            "data/processed/entities_*.json", "data/processed/relations.json",
+            "data/benchmark/benchmark_raw.json", "evaluation/automated/results_*.json"]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--to", default="parquet", choices=["parquet", "json"])
+    parser.add_argument("--remove-json", action="store_true", help="delete the JSON originals once verified")
+    args = parser.parse_args()
+
+    src_suffix = ".json" if args.to == "parquet" else ".parquet"
+    total_in, total_out = 0, 0
+    for pattern in DATASETS:
+        for src in sorted(Path(".").glob(pattern.replace(".json", src_suffix))):
+            records = json.load(open(src)) if src_suffix == ".json" else storage.load_records(src)
+            dst = storage.save_records(records, src, fmt=args.to)
+            n = len(json.load(open(dst))) if args.to == "json" else storage.count_records(dst)
+            if n != len(records):
+                print(f"  {src}: row count mismatch ({len(records)} -> {n}); keeping original"); continue
+            size_in, size_out = src.stat().st_size, dst.stat().st_size
+            total_in += size_in; total_out += size_out
+            print(f"  {src} -> {dst.name}: {n} rows, {size_in/1e6:.1f}MB -> {size_out/1e6:.1f}MB")
+            if args.remove_json and args.to == "parquet": src.unlink()
+    if total_in:
+        print(f"\nTotal: {total_in/1e6:.1f}MB -> {total_out/1e6:.1f}MB ({total_out/total_in:.0%})")
+    else:
+        print("No datasets to convert.")
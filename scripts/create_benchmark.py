@@ -1,7 +1,10 @@
-import json, random, yaml
+import random, yaml, sys
 from pathlib import Path
 from neo4j import GraphDatabase
  
+sys.path.insert(0, ".")
+from pipelines import storage
+ 
 random.seed(42)
 with open("config.yaml") as f:
     config = yaml.safe_load(f)
@@ -32,7 +35,7 @@ for repo, issues in by_repo.items():
 benchmark = benchmark[:target]
  
 out = Path("data/benchmark"); out.mkdir(exist_ok=True)
-json.dump(benchmark, open(out/"benchmark_raw.json","w"), indent=2)
+storage.save_records(benchmark, out/"benchmark_raw")
 print(f"Benchmark: {len(benchmark)} instances")
 for t_name in tasks:
     print(f"  {t_name}: {sum(1 for b in benchmark if b['task_type']==t_name)}")
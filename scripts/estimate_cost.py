@@ -0,0 +1,169 @@
+"""
+estimate_cost.py
+Offline cost and wall-clock projection for `run_experiment.py --dry-run`. The dry run builds
+every remaining prompt through each pipeline's real retrieval path (no LLM calls); this module
+counts their tokens with tiktoken and projects spend and time from the cost log
+(results/api_costs.jsonl):
+  - output tokens are drawn from the logged output lengths of the same purpose
+    (e.g. graphrag_generation), since they differ a lot between pipelines
+  - GraphRAG citation-fix regenerations happen at the logged rate (citation_fix calls per
+    graphrag_generation call), with the fix prompt sized like the real one
+  - request latency comes from a least-squares fit of logged latency on input and output tokens
+Cost and time are simulated many times over; the report gives the mean and a 5-95% range.
+Wall-clock time at a given concurrency is the larger of latency / concurrency and the
+dispatcher's requests- and tokens-per-minute quotas.
+
+    python scripts/estimate_cost.py     # what the cost log says per purpose
+"""
+import json, sys
+from collections import defaultdict
+from pathlib import Path
+import numpy as np
+import tiktoken
+
+sys.path.insert(0, ".")
+from pipelines.llm_client import PRICING, COST_LOG, MODEL, MAX_TOKENS, BATCH_DISCOUNT, config
+
+# Chat framing per message and for the reply primer (OpenAI cookbook accounting)
+MESSAGE_OVERHEAD, REPLY_OVERHEAD = 3, 3
+# Regeneration purpose -> the generation purpose it follows
+REGENERATIONS = {"citation_fix": "graphrag_generation"}
+FIX_OVERHEAD = 60  # tokens of instructions and valid-id list around the context in a fix prompt
+DEFAULT_LATENCY = (0.5, 2e-5, 0.02)  # seconds: base, per input token, per output token (no history)
+
+class TokenCounter:
+    """tiktoken counts for `model`; falls back to ~4 characters per token (with a warning) when
+    the encoding cannot be loaded, e.g. offline without a cached BPE file."""
+    def __init__(self, model=MODEL):
+        try:
+            self.enc = tiktoken.encoding_for_model(model)
+        except KeyError:
+            self.enc = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            print(f"  tiktoken encoding unavailable ({type(e).__name__}); counting ~4 chars/token")
+            self.enc = None
+
+    def text(self, s):
+        return len(self.enc.encode(s, disallowed_special=())) if self.enc else len(s) // 4
+
+    def chat(self, prompt, system=None):
+        return sum(self.text(m) + MESSAGE_OVERHEAD for m in [system, prompt] if m) + REPLY_OVERHEAD
+
+def latency_of(entry):
+    if entry.get("latency_s") is not None: return entry["latency_s"]
+    # Streamed calls logged before latency_s was recorded
+    if entry.get("ttft_s") is not None and entry.get("tokens_per_s"):
+        return entry["ttft_s"] + entry["output_tokens"] / entry["tokens_per_s"]
+    return None
+
+def load_history(path=COST_LOG):
+    """Per purpose: output tokens of every logged call, and (input, output, latency) of
+    synchronous calls with a known latency."""
+    hist = defaultdict(lambda: {"output": [], "timed": []})
+    if not Path(path).exists(): return {}
+    for line in open(path):
+        try:
+            e = json.loads(line)
+        except json.JSONDecodeError:
+            continue  # a torn line from a killed writer
+        h = hist[e.get("purpose", "")]
+        h["output"].append(e.get("output_tokens", 0))
+        lat = None if e.get("batch") else latency_of(e)
+        if lat is not None: h["timed"].append((e.get("input_tokens", 0), e.get("output_tokens", 0), lat))
+    return dict(hist)
+
+def latency_model(history):
+    """Least-squares latency ~ base + a * input tokens + b * output tokens over every timed call."""
+    rows = np.array([t for h in history.values() for t in h["timed"]], dtype=float).reshape(-1, 3)
+    if len(rows) < 10: return DEFAULT_LATENCY, 0
+    X = np.column_stack([np.ones(len(rows)), rows[:, 0], rows[:, 1]])
+    coef, *_ = np.linalg.lstsq(X, rows[:, 2], rcond=None)
+    return tuple(np.maximum(coef, 0.0)), len(rows)
+
+def fix_rate(history, purpose):
+    fixes = [p for p, src in REGENERATIONS.items() if src == purpose]
+    calls = len(history.get(purpose, {}).get("output", []))
+    return (sum(len(history.get(p, {}).get("output", [])) for p in fixes) / calls if calls else None), (fixes[0] if fixes else None)
+
+def output_sample(history, purpose):
+    """Logged output lengths of `purpose`, else of every generation purpose, else max_tokens / 2."""
+    out = history.get(purpose, {}).get("output")
+    if out: return np.array(out), "history"
+    pooled = [o for p, h in history.items() if p.endswith(("_gen", "_generation")) for o in h["output"]]
+    if pooled: return np.array(pooled), "pooled"
+    return np.array([MAX_TOKENS // 2]), "assumed"
+
+def estimate(reqs, history, concurrency=1, batch=False, model=MODEL, sims=200, seed=42, counter=None):
+    """Projected cost and generation time for one pipeline's prompts (dicts with prompt, system
+    and purpose, as built by run_experiment.build_requests)."""
+    if not reqs: return {"calls": 0}
+    counter = counter or TokenCounter(model)
+    price = PRICING.get(model, {"input": 5.0, "output": 15.0})
+    purpose = reqs[0]["purpose"]
+    n_in = np.array([counter.chat(r["prompt"], r.get("system")) for r in reqs], dtype=float)
+    outs, source = output_sample(history, purpose)
+    rate, fix_purpose = fix_rate(history, purpose)
+    rate = rate or 0.0
+    fix_outs, _ = output_sample(history, fix_purpose) if fix_purpose else (outs, None)
+    (base, per_in, per_out), n_timed = latency_model(history)
+
+    rng = np.random.default_rng(seed)
+    out = rng.choice(outs, size=(sims, len(reqs))).astype(float)
+    fixed = rng.random((sims, len(reqs))) < rate
+    # A fix prompt carries the evidence context and the first answer
+    fix_in = np.where(fixed, n_in + out + FIX_OVERHEAD, 0.0)
+    fix_out = np.where(fixed, rng.choice(fix_outs, size=(sims, len(reqs))), 0.0)
+    tokens_in, tokens_out = n_in.sum() + fix_in.sum(axis=1), out.sum(axis=1) + fix_out.sum(axis=1)
+    cost = (tokens_in * price["input"] + tokens_out * price["output"]) / 1_000_000 * (BATCH_DISCOUNT if batch else 1.0)
+    latency = (base + per_in * n_in + per_out * out).sum(axis=1) \
+              + (fixed * base + per_in * fix_in + per_out * fix_out).sum(axis=1)
+    calls = len(reqs) + fixed.sum(axis=1)
+    # Dispatcher quotas bound throughput regardless of concurrency
+    quota = config["models"]["openai"].get("dispatcher", {})
+    floor = np.maximum(calls / quota.get("requests_per_minute", 500),
+                       (tokens_in + MAX_TOKENS * calls) / quota.get("tokens_per_minute", 300000)) * 60
+    wall = np.maximum(latency / max(concurrency, 1), floor)
+    band = lambda x: [float(np.mean(x)), float(np.percentile(x, 5)), float(np.percentile(x, 95))]
+    return {"calls": len(reqs), "purpose": purpose, "input_tokens": float(n_in.sum()), "input_p50": float(np.median(n_in)),
+            "input_max": float(n_in.max()), "output_source": source, "output_mean": float(outs.mean()),
+            "fix_rate": rate, "fix_calls": band(fixed.sum(axis=1)), "cost_usd": band(cost), "latency_s": band(latency),
+            "wall_s": band(wall), "quota_bound": bool(np.mean(floor > latency / max(concurrency, 1)) > 0.5),
+            "latency_fit": {"base": base, "per_input": per_in, "per_output": per_out, "calls": n_timed}}
+
+def print_report(estimates, concurrency, batch=False):
+    print(f"\nDry run: projected generation cost and time ({'Batch API' if batch else f'concurrency {concurrency}'})")
+    print(f"{'Pipeline':<12} {'Calls':>6} {'Prompt tok p50':>15} {'max':>7} {'Out tok':>8} {'Fix rate':>9} "
+          f"{'Cost USD (5-95%)':>22} {'Wall clock (5-95%)':>26}")
+    total_cost, total_wall = np.zeros(3), np.zeros(3)
+    for name, e in estimates.items():
+        if not e["calls"]:
+            print(f"{name:<12} {0:>6}  already complete"); continue
+        c, w = e["cost_usd"], e["wall_s"]
+        wall = "Batch API (<=24h)" if batch else f"{w[0]/3600:.2f}h ({w[1]/3600:.2f}-{w[2]/3600:.2f})" + (" quota" if e["quota_bound"] else "")
+        print(f"{name:<12} {e['calls']:>6d} {e['input_p50']:>15.0f} {e['input_max']:>7.0f} {e['output_mean']:>8.0f} "
+              f"{e['fix_rate']:>8.1%} {f'{c[0]:.2f} ({c[1]:.2f}-{c[2]:.2f})':>22} {wall:>26}")
+        total_cost += c; total_wall += w
+        if e["output_source"] != "history":
+            print(f"{'':<12} no logged {e['purpose']} calls; output lengths {'from other pipelines' if e['output_source'] == 'pooled' else f'assumed {MAX_TOKENS // 2} tokens'}")
+    # Summed bounds overstate the spread a little: the ranges are per pipeline
+    print(f"{'Total':<12} {'':>6} {'':>15} {'':>7} {'':>8} {'':>9} {f'{total_cost[0]:.2f} ({total_cost[1]:.2f}-{total_cost[2]:.2f})':>22}"
+          + ("" if batch else f" {f'{total_wall[0]/3600:.2f}h':>26}"))
+    fit = next((e["latency_fit"] for e in estimates.values() if e["calls"]), None)
+    if fit:
+        src = f"fit on {fit['calls']} logged calls" if fit["calls"] else "assumed, no timed calls logged"
+        print(f"Latency per call: {fit['base']:.2f}s + {fit['per_input']*1000:.3f}s/1k input + {fit['per_output']*1000:.1f}s/1k output tokens ({src})")
+
+if __name__ == "__main__":
+    history = load_history()
+    if not history: sys.exit(f"No cost log at {COST_LOG}")
+    (base, per_in, per_out), n_timed = latency_model(history)
+    print(f"{'Purpose':<24} {'Calls':>7} {'Out p50':>8} {'p90':>6} {'Latency p50':>12} {'p90':>7}")
+    for purpose, h in sorted(history.items()):
+        lat = [t[2] for t in h["timed"]]
+        p50, p90 = np.percentile(h["output"], [50, 90])
+        lp = f"{np.percentile(lat, 50):>11.2f}s {np.percentile(lat, 90):>6.2f}s" if lat else f"{'-':>12} {'-':>7}"
+        print(f"{purpose:<24} {len(h['output']):>7d} {p50:>8.0f} {p90:>6.0f} {lp}")
+    for fix, src in REGENERATIONS.items():
+        rate, _ = fix_rate(history, src)
+        if rate is not None: print(f"{fix} rate: {rate:.1%} of {src} calls")
+    print(f"Latency fit ({n_timed} timed calls): {base:.2f}s + {per_in*1000:.3f}s/1k input + {per_out*1000:.1f}s/1k output tokens")
@@ -1,8 +1,14 @@
-import json, re
+import json, re, sys, argparse, yaml
 from pathlib import Path
 from collections import defaultdict
 from tqdm import tqdm
  
+sys.path.insert(0, ".")
+from pipelines import storage, profiling
+ 
+with open("config.yaml") as f:
+    config = yaml.safe_load(f)
+ 
 def extract_components_from_labels(labels):
     comps = []
     for label in labels:
@@ -30,31 +36,43 @@ def extract_deps_from_text(text):
             deps.append({"target_id": int(m), "relation": rel})
     return deps
  
-def process_repo(repo_dir):
+def load_dedup_map(path=None):
+    """Canonical-id map written by validate_data.py to dedup.map_file (empty if it has not been run)."""
+    p = Path(path or config.get("dedup", {}).get("map_file", "data/processed/dedup_map.json"))
+    return json.load(open(p))["canonical"] if p.exists() else {}
+ 
+def process_repo(repo_dir, canonical=None):
     entities = {"issues":[],"components":[],"services":[],"owners":[],"code_modules":[],"doc_pages":[]}
     relations = []
-    ip = repo_dir / "issues.json"
-    if ip.exists():
-        for issue in tqdm(json.load(open(ip)), desc=f"  Issues ({repo_dir.name})"):
+    canonical = canonical or {}
+    dup_issues, dup_prs = canonical.get("issues", {}), canonical.get("prs", {})
+    ip = repo_dir / "issues"
+    if storage.exists(ip):
+        for issue in tqdm(storage.load_records(ip), desc=f"  Issues ({repo_dir.name})"):
+            if str(issue["id"]) in dup_issues: continue
             eid = f"{repo_dir.name}:issue:{issue['id']}"
             entities["issues"].append({"id":eid,"type":"Issue","number":issue["id"],
                 "title":issue["title"],"body":issue.get("body","")[:2000],
                 "labels":issue.get("labels",[]),"state":issue.get("state",""),"repo":issue.get("repo","")})
+            created = issue.get("created_at")  # edge recency, for fan-out limits ordered by recency
             for comp in extract_components_from_labels(issue.get("labels",[])):
                 cid = f"{repo_dir.name}:component:{comp}"
                 entities["components"].append({"id":cid,"type":"Component","name":comp})
-                relations.append({"source":eid,"target":cid,"type":"belongs_to","confidence":0.95})
+                relations.append({"source":eid,"target":cid,"type":"belongs_to","confidence":0.95,"created_at":created})
             for assignee in issue.get("assignees",[]):
                 oid = f"{repo_dir.name}:owner:{assignee}"
                 entities["owners"].append({"id":oid,"type":"Owner","name":assignee})
-                relations.append({"source":eid,"target":oid,"type":"owned_by","confidence":0.90})
+                relations.append({"source":eid,"target":oid,"type":"owned_by","confidence":0.90,"created_at":created})
             text = f"{issue.get('title','')} {issue.get('body','')}"
             for dep in extract_deps_from_text(text):
-                tid = f"{repo_dir.name}:issue:{dep['target_id']}"
-                relations.append({"source":eid,"target":tid,"type":"depends_on","confidence":0.80})
-    pp = repo_dir / "prs.json"
-    if pp.exists():
-        for pr in tqdm(json.load(open(pp)), desc=f"  PRs ({repo_dir.name})"):
+                target = dup_issues.get(str(dep["target_id"]), dep["target_id"])
+                if target == issue["id"]: continue
+                tid = f"{repo_dir.name}:issue:{target}"
+                relations.append({"source":eid,"target":tid,"type":"depends_on","confidence":0.80,"created_at":created})
+    pp = repo_dir / "prs"
+    if storage.exists(pp):
+        for pr in tqdm(storage.load_records(pp, ["id", "author", "files_changed", "created_at"]), desc=f"  PRs ({repo_dir.name})"):
+            if str(pr["id"]) in dup_prs: continue
             files = pr.get("files_changed",[])
             for comp in extract_components_from_paths(files):
                 entities["code_modules"].append({"id":f"{repo_dir.name}:code:{comp}","type":"CodeModule","name":comp})
@@ -62,10 +80,11 @@ def process_repo(repo_dir):
             if author:
                 oid = f"{repo_dir.name}:owner:{author}"
                 for comp in extract_components_from_paths(files)[:5]:
-                    relations.append({"source":oid,"target":f"{repo_dir.name}:code:{comp}","type":"maintains","confidence":0.70})
-    dp = repo_dir / "docs.json"
-    if dp.exists():
-        for doc in json.load(open(dp)):
+                    relations.append({"source":oid,"target":f"{repo_dir.name}:code:{comp}","type":"maintains","confidence":0.70,
+                                      "created_at":pr.get("created_at")})
+    dp = repo_dir / "docs"
+    if storage.exists(dp):
+        for doc in storage.load_records(dp, ["path", "content"]):
             entities["doc_pages"].append({"id":f"{repo_dir.name}:doc:{doc['path']}",
                 "type":"DocumentationPage","path":doc["path"],"content":doc.get("content","")[:3000]})
     for k in entities:
@@ -74,19 +93,29 @@ def process_repo(repo_dir):
     return entities, relations
  
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    prof = profiling.start("extract_entities", args.profile)
     all_entities = defaultdict(list)
     all_relations = []
+    dedup = load_dedup_map()
+    if dedup:
+        print(f"Skipping {sum(len(m) for r in dedup.values() for m in r.values())} near-duplicate records ({config.get('dedup', {}).get('map_file', 'dedup_map.json')})")
     for repo_dir in sorted(Path("data/raw").iterdir()):
         if not repo_dir.is_dir(): continue
+        prof.mark(f"repo:{repo_dir.name}")
         print(f"\nProcessing {repo_dir.name}...")
-        entities, relations = process_repo(repo_dir)
+        entities, relations = process_repo(repo_dir, dedup.get(repo_dir.name))
         for k, v in entities.items(): all_entities[k].extend(v)
         all_relations.extend(relations)
+    prof.mark("save")
     out = Path("data/processed"); out.mkdir(exist_ok=True)
     for k, v in all_entities.items():
-        json.dump(v, open(out/f"entities_{k}.json","w"), indent=2)
+        storage.save_records(v, out/f"entities_{k}")
         print(f"  {k}: {len(v)} entities")
-    json.dump(all_relations, open(out/"relations.json","w"), indent=2)
+    storage.save_records(all_relations, out/"relations")
     print(f"  Relations: {len(all_relations)}")
     print(f"\nTotal nodes: {sum(len(v) for v in all_entities.values())}")
     print(f"Total edges: {len(all_relations)}")
+    prof.stop()
@@ -0,0 +1,208 @@
+"""
+fake_openai_server.py
+Local stand-in for the OpenAI chat completions API, used to exercise llm_client's
+dispatcher without spending money. It enforces its own per-minute request/token quotas,
+reports them in x-ratelimit-* headers, answers 429 + retry-after when they are exceeded,
+and can inject transient 500s or fatal 400s. Streaming requests get server-sent event
+chunks, one word at a time. The files and batches endpoints are also
+served (in memory, completed after --batch-delay seconds) for the Batch API mode.
+
+    python scripts/fake_openai_server.py --port 8765 --rpm 60 --tpm 40000 --fail-rate 0.1
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=test python scripts/run_experiment.py --limit 20
+"""
+import json, time, random, argparse, threading, uuid
+from email.parser import BytesParser
+from email.policy import default as email_policy
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+CANNED = ("1. TAXONOMY CLASSIFICATION: bug in the affected component [E1]\n"
+          "2. ROUTING/OWNERSHIP: route to the component owners [E2]\n"
+          "3. DEPENDENCIES: related work items [E1]\n"
+          "4. CLARIFICATION QUESTIONS: which version is affected?\n"
+          "5. ACCEPTANCE CRITERIA: regression test covers the failure")
+
+class FakeState:
+    def __init__(self, rpm, tpm, fail_rate, fatal_rate, latency, batch_delay=2.0, token_delay=0.01):
+        self.rpm, self.tpm, self.token_delay = rpm, tpm, token_delay
+        self.fail_rate, self.fatal_rate, self.latency = fail_rate, fatal_rate, latency
+        self.batch_delay, self.files, self.batches = batch_delay, {}, {}
+        self.window, self.requests, self.tokens = int(time.time() // 60), 0, 0
+        self.stats = {"ok": 0, "429": 0, "500": 0, "400": 0}
+        self.lock = threading.Lock()
+
+    def admit(self, tokens):
+        """Returns (allowed, headers) under a fixed one-minute window."""
+        with self.lock:
+            now = time.time()
+            if int(now // 60) != self.window:
+                self.window, self.requests, self.tokens = int(now // 60), 0, 0
+            reset = 60 - now % 60
+            allowed = self.requests + 1 <= self.rpm and self.tokens + tokens <= self.tpm
+            if allowed:
+                self.requests += 1; self.tokens += tokens
+            headers = {"x-ratelimit-limit-requests": str(self.rpm), "x-ratelimit-limit-tokens": str(self.tpm),
+                       "x-ratelimit-remaining-requests": str(max(self.rpm - self.requests, 0)),
+                       "x-ratelimit-remaining-tokens": str(max(self.tpm - self.tokens, 0)),
+                       "x-ratelimit-reset-requests": f"{reset:.1f}s", "x-ratelimit-reset-tokens": f"{reset:.1f}s"}
+            if not allowed: headers["retry-after"] = f"{reset:.1f}"
+            return allowed, headers
+
+def completion(body, prompt_tokens):
+    completion_tokens = len(CANNED) // 4
+    return {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": CANNED}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens}}
+
+def completion_chunks(body, prompt_tokens):
+    """The canned completion as streaming chunks (one per word), with a final usage chunk if requested."""
+    cid, created, model = f"chatcmpl-{uuid.uuid4().hex[:12]}", int(time.time()), body.get("model", "fake")
+    chunk = lambda delta, finish=None: {"id": cid, "object": "chat.completion.chunk", "created": created, "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+    words = CANNED.split(" ")
+    yield chunk({"role": "assistant", "content": ""})
+    for i, w in enumerate(words):
+        yield chunk({"content": w if i == len(words) - 1 else w + " "})
+    yield chunk({}, "stop")
+    if (body.get("stream_options") or {}).get("include_usage"):
+        completion_tokens = len(CANNED) // 4
+        yield {"id": cid, "object": "chat.completion.chunk", "created": created, "model": model, "choices": [],
+               "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                         "total_tokens": prompt_tokens + completion_tokens}}
+
+def add_file(st, data, filename, purpose):
+    fid = f"file-{uuid.uuid4().hex[:12]}"
+    st.files[fid] = {"id": fid, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+                     "filename": filename, "purpose": purpose, "status": "processed", "data": data}
+    return fid
+
+def process_batch(st, batch):
+    time.sleep(st.batch_delay)
+    batch["status"] = "in_progress"
+    lines = [json.loads(l) for l in st.files[batch["input_file_id"]]["data"].decode().splitlines() if l.strip()]
+    out = []
+    for req in lines:
+        body = req["body"]
+        prompt_tokens = sum(len(m.get("content") or "") for m in body.get("messages", [])) // 4
+        out.append({"id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": req["custom_id"], "error": None,
+                    "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": completion(body, prompt_tokens)}})
+    batch["output_file_id"] = add_file(st, "".join(json.dumps(o) + "\n" for o in out).encode(), "output.jsonl", "batch_output")
+    batch["request_counts"] = {"total": len(lines), "completed": len(lines), "failed": 0}
+    batch["status"], batch["completed_at"] = "completed", int(time.time())
+
+class Handler(BaseHTTPRequestHandler):
+    state = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items(): self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status, message, code, headers=None):
+        self.state.stats[str(status)] = self.state.stats.get(str(status), 0) + 1
+        self._send(status, {"error": {"message": message, "type": code, "code": code}}, headers)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+        path, st = self.path.rstrip("/"), self.state
+        if path.endswith("/files"):
+            msg = BytesParser(policy=email_policy).parsebytes(
+                b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + raw)
+            fields = {part.get_param("name", header="content-disposition"): part for part in msg.iter_parts()}
+            data = fields["file"].get_payload(decode=True)
+            fid = add_file(st, data, fields["file"].get_filename() or "input.jsonl",
+                           fields["purpose"].get_content().strip())
+            return self._send(200, {k: v for k, v in st.files[fid].items() if k != "data"})
+        body = json.loads(raw or b"{}")
+        if path.endswith("/batches"):
+            if body.get("input_file_id") not in st.files:
+                return self._error(400, "Unknown input_file_id", "invalid_request_error")
+            bid = f"batch_{uuid.uuid4().hex[:12]}"
+            batch = st.batches[bid] = {"id": bid, "object": "batch", "endpoint": body.get("endpoint"),
+                "input_file_id": body["input_file_id"], "completion_window": body.get("completion_window", "24h"),
+                "status": "validating", "created_at": int(time.time()), "metadata": body.get("metadata"),
+                "output_file_id": None, "error_file_id": None,
+                "request_counts": {"total": 0, "completed": 0, "failed": 0}}
+            threading.Thread(target=process_batch, args=(st, batch), daemon=True).start()
+            return self._send(200, batch)
+        if not path.endswith("/chat/completions"):
+            return self._error(404, f"Unknown path {self.path}", "not_found")
+        prompt_tokens = sum(len(m.get("content") or "") for m in body.get("messages", [])) // 4
+        allowed, headers = st.admit(prompt_tokens + body.get("max_tokens", 0))
+        if not allowed:
+            return self._error(429, "Rate limit reached", "rate_limit_exceeded", headers)
+        roll = random.random()
+        if roll < st.fatal_rate:
+            return self._error(400, "Injected invalid request", "invalid_request_error", headers)
+        if roll < st.fatal_rate + st.fail_rate:
+            return self._error(500, "Injected server error", "server_error", headers)
+        time.sleep(st.latency)
+        st.stats["ok"] += 1
+        if body.get("stream"):
+            return self._stream(completion_chunks(body, prompt_tokens), headers)
+        self._send(200, completion(body, prompt_tokens), headers)
+
+    def _stream(self, chunks, headers):
+        """Server-sent events, one chunk every --token-delay seconds; stops quietly if the client hangs up."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        for k, v in headers.items(): self.send_header(k, v)
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for c in chunks:
+                self.wfile.write(f"data: {json.dumps(c)}\n\n".encode()); self.wfile.flush()
+                time.sleep(self.state.token_delay)
+            self.wfile.write(b"data: [DONE]\n\n"); self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            self.state.stats["cancelled"] = self.state.stats.get("cancelled", 0) + 1
+
+    def do_GET(self):
+        path, st = self.path.rstrip("/"), self.state
+        if path.endswith("/stats"):
+            return self._send(200, st.stats)
+        parts = path.split("/")
+        if len(parts) >= 2 and parts[-2] == "batches" and parts[-1] in st.batches:
+            return self._send(200, st.batches[parts[-1]])
+        if len(parts) >= 3 and parts[-1] == "content" and parts[-2] in st.files:
+            data = st.files[parts[-2]]["data"]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            return self.wfile.write(data)
+        self._error(404, f"Unknown path {self.path}", "not_found")
+
+def serve(port=8765, rpm=60, tpm=40000, fail_rate=0.0, fatal_rate=0.0, latency=0.2, batch_delay=2.0,
+          token_delay=0.01, background=False):
+    Handler.state = FakeState(rpm, tpm, fail_rate, fatal_rate, latency, batch_delay, token_delay)
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+    print(f"Fake OpenAI API on http://127.0.0.1:{port}/v1 (rpm={rpm}, tpm={tpm}, "
+          f"fail_rate={fail_rate}, fatal_rate={fatal_rate})")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rpm", type=int, default=60)
+    parser.add_argument("--tpm", type=int, default=40000)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of calls answered with 500")
+    parser.add_argument("--fatal-rate", type=float, default=0.0, help="fraction of calls answered with 400")
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--batch-delay", type=float, default=2.0, help="seconds before a submitted batch completes")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="seconds between streamed chunks")
+    args = parser.parse_args()
+    serve(args.port, args.rpm, args.tpm, args.fail_rate, args.fatal_rate, args.latency, args.batch_delay, args.token_delay)
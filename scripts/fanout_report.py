@@ -0,0 +1,130 @@
+"""
+fanout_report.py
+How much of each GraphRAG expansion survives pruning, with and without fan-out control
+(retrieval.fanout: per-rule neighbor limits and hub capping). For every benchmark query it
+counts the neighbor records the per-query traversal fetches from Neo4j, the distinct nodes
+reached, and the nodes and edges kept after pruning, per expansion rule. It also reports
+how many of the uncapped kept nodes the capped configuration still keeps, and lists the
+highest out-degree nodes (degrees are written by build_knowledge_graph.py). A third row runs
+best-first budgeted search (retrieval.expansion_mode: best_first) on the capped graph. Counts
+come from the sparse expansion engine, which matches the per-query traversal.
+
+    python scripts/fanout_report.py [--limit 200] [--default-limit 25] [--hub-degree 200] [--node-budget 40]
+"""
+import json, argparse, sys
+from pathlib import Path
+import numpy as np
+
+sys.path.insert(0, ".")
+from pipelines.graphrag.graphrag_pipeline import GraphRAGPipeline, apply_fanout, config
+from pipelines.graphrag.sparse_expansion import SparseExpansionEngine
+from pipelines import storage
+
+def rule_names(policy):
+    return [f"{label}.{rule['edge']}" for label, rules in policy.items() for rule in rules]
+
+def fanout(engine, qe, k, max_hops, threshold):
+    """Per query: neighbor lookups, records fetched per rule, nodes reached, and the pruned (nodes, edges)."""
+    sims = engine.similarities(qe)
+    seeds = engine.seeds(sims, k)
+    depth = engine.reachability(seeds, max_hops).astype(np.int64)
+    # The traversal queries every rule a node's label and depth allow; hubs past the seeds are not expanded
+    expanded = (depth >= 0) & ((depth == 0) | ~engine.hub)
+    labels = np.array(engine.labels)
+    masks = [expanded & (depth + 1 <= max_depth) & (labels == label)
+             for (max_depth, _, _, _), label in zip(engine.rules, engine.rule_labels)]
+    records = np.stack([m.astype(np.int64) @ np.diff(A.indptr) for m, (_, _, A, _) in zip(masks, engine.rules)], axis=1)
+    lookups = np.logical_or.reduce(masks).sum(axis=1)
+    return lookups, records, (depth >= 0).sum(axis=1), engine.expand_batch(sims, seeds, max_hops, threshold)
+
+def best_first(engine, qe, k, max_hops, threshold, budget):
+    sims = engine.similarities(qe)
+    relevance = np.where(engine.has_emb, sims, 0.3)
+    runs = [engine.best_first(relevance[q], seeds, max_hops, threshold, budget) for q, seeds in enumerate(engine.seeds(sims, k))]
+    info = [r[2] for r in runs]
+    return (np.array([i["lookups"] for i in info]), np.array([[i["records"]] for i in info]),
+            np.array([i["reached"] for i in info]), [(n, e) for n, e, _ in runs])
+
+def summarize(engine, names, lookups, records, reached, kept):
+    kept_edges = np.zeros((len(kept), len(names)))
+    for q, (_, edges) in enumerate(kept):
+        for e in edges:
+            name = f"{engine.labels[engine.index[e['source']]]}.{e['type']}"
+            if name in names: kept_edges[q, names.index(name)] += 1
+    total = records.sum(axis=1)
+    n_kept = np.array([len(n) for n, _ in kept])
+    return {"lookups": float(lookups.mean()), "max_lookups": int(lookups.max()), "fetched_records": float(total.mean()), "fetched_records_p95": float(np.percentile(total, 95)),
+            "reached_nodes": float(reached.mean()), "kept_nodes": float(n_kept.mean()),
+            "kept_edges": float(kept_edges.sum(axis=1).mean()),
+            "kept_relevance": float(np.mean([n["relevance"] for nodes, _ in kept for n in nodes] or [0.0])),
+            "kept_per_fetched": float(n_kept.sum() / max(total.sum(), 1)),
+            "rules": {name: {"fetched_records": float(records[:, i].mean()), "kept_edges": float(kept_edges[:, i].mean())}
+                      for i, name in enumerate(names)} if records.shape[1] == len(names) else {}}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--limit", type=int, default=None, help="benchmark instances")
+    parser.add_argument("--default-limit", type=int, default=None, help="override retrieval.fanout.default_limit")
+    parser.add_argument("--order-by", default=None, choices=["confidence", "recency"])
+    parser.add_argument("--hub-degree", type=int, default=None, help="override retrieval.fanout.hub_degree")
+    parser.add_argument("--node-budget", type=int, default=None, help="best-first node budget (default: retrieval.node_budget)")
+    parser.add_argument("--top-hubs", type=int, default=15)
+    args = parser.parse_args()
+    rc = config["retrieval"]
+    fo = dict(rc.get("fanout") or {})
+    if args.default_limit is not None: fo["default_limit"] = args.default_limit
+    if args.order_by: fo["order_by"] = args.order_by
+    if args.hub_degree is not None: fo["hub_degree"] = args.hub_degree
+
+    benchmark = storage.load_records("data/benchmark/benchmark_raw", ["title","text"])
+    if args.limit: benchmark = benchmark[:args.limit]
+    queries = [f"{b['title']} {b['text'][:500]}" for b in benchmark]
+
+    pipe = GraphRAGPipeline()
+    base = apply_fanout(pipe.expansion_policy, {})
+    engines = {"uncapped": SparseExpansionEngine(pipe.driver, base, pipe.nodes),
+               "capped": SparseExpansionEngine(pipe.driver, apply_fanout(base, fo), pipe.nodes, fo.get("hub_degree"))}
+    names = rule_names(base)
+    qe = pipe.embed_model.encode(queries, batch_size=64, normalize_embeddings=True)
+
+    report, kept_ids = {"queries": len(queries), "fanout": fo}, {}
+    budget = args.node_budget or rc.get("node_budget", 40)
+    runs = {name: fanout(engine, qe, rc["seed_k"], rc["max_hops"], rc["prune_threshold"]) for name, engine in engines.items()}
+    runs["best_first"] = best_first(engines["capped"], qe, rc["seed_k"], rc["max_hops"], rc["prune_threshold"], budget)
+    for name, run in runs.items():
+        report[name] = summarize(engines.get(name, engines["capped"]), names, *run)
+        kept_ids[name] = [{n["id"] for n in nodes} for nodes, _ in run[-1]]
+    # Share of the uncapped BFS evidence each configuration still keeps
+    report["kept_node_recall"] = {name: float(np.mean([len(c & u) / len(u) if u else 1.0
+                                                       for c, u in zip(kept_ids[name], kept_ids["uncapped"])]))
+                                  for name in ["capped", "best_first"]}
+
+    print(f"\nFan-out per query (mean over {len(queries)} queries; fanout settings: {fo or 'none'}; node budget {budget})")
+    print(f"{'':<11} {'Lookups':>8} {'max':>5} {'Fetched records':>16} {'p95':>8} {'Reached nodes':>14} {'Kept nodes':>11} "
+          f"{'Kept edges':>11} {'Kept/fetched':>13} {'Relevance':>10}")
+    for name in runs:
+        m = report[name]
+        print(f"{name:<11} {m['lookups']:>8.1f} {m['max_lookups']:>5d} {m['fetched_records']:>16.1f} {m['fetched_records_p95']:>8.0f} "
+              f"{m['reached_nodes']:>14.1f} {m['kept_nodes']:>11.1f} {m['kept_edges']:>11.1f} {m['kept_per_fetched']:>12.1%} "
+              f"{m['kept_relevance']:>10.3f}")
+    print(f"\n{'Rule':<24} {'Fetched (uncapped)':>19} {'Fetched (capped)':>17} {'Kept edges (uncapped)':>22} {'Kept edges (capped)':>20}")
+    for rule in names:
+        u, c = report["uncapped"]["rules"][rule], report["capped"]["rules"][rule]
+        print(f"{rule:<24} {u['fetched_records']:>19.1f} {c['fetched_records']:>17.1f} {u['kept_edges']:>22.1f} {c['kept_edges']:>20.1f}")
+    for name, r in report["kept_node_recall"].items():
+        print(f"{name} keeps {r:.1%} of the nodes the uncapped BFS run keeps")
+
+    nodes = pipe.nodes
+    top = np.argsort(-nodes.degree, kind="stable")[:args.top_hubs]
+    report["top_hubs"] = [{"id": nodes.ids[i], "label": nodes.labels[i], "out_degree": int(nodes.degree[i])}
+                          for i in top if nodes.degree[i] > 0]
+    if report["top_hubs"]:
+        print("\nHighest out-degree nodes:")
+        for h in report["top_hubs"]: print(f"  {h['out_degree']:>6d}  {h['label']:<18} {h['id']}")
+    else:
+        print("\nNo node degrees stored; re-run build_knowledge_graph.py to compute them")
+
+    out = Path("results/stats"); out.mkdir(parents=True, exist_ok=True)
+    json.dump(report, open(out / "fanout_report.json", "w"), indent=2)
+    print("\nSaved to results/stats/fanout_report.json")
+    pipe.close()
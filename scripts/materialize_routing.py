@@ -0,0 +1,135 @@
+"""
+materialize_routing.py
+Precomputes the routing aggregates GraphRAG would otherwise rebuild from multi-hop traversals
+on every routing query, as one row per Component (data/routing/routing_components):
+  - owners ranked by the issues of the component assigned to them (sum over issues of
+    BELONGS_TO x OWNED_BY confidence), with the code modules each owner MAINTAINS
+  - components most often filed together with it on the same issue
+  - its dependency closure: component A depends on B when an issue of A DEPENDS_ON an issue
+    of B, followed transitively up to routing.closure_depth hops
+Runs after build_knowledge_graph.py. Refreshes are incremental per repo: a repo is recomputed
+only when the count, confidence sum or newest created_at of its relevant edges changed since
+the last run (data/routing/state.json). A change to any routing setting in TABLE_KEYS recomputes every repo. Pipelines attach a row per retrieved component with one
+keyed lookup when routing.attach is on (pipelines/graphrag/routing_tables.py).
+
+    python scripts/materialize_routing.py [--full]
+"""
+import json, time, argparse, sys, yaml
+from collections import Counter, defaultdict
+from neo4j import GraphDatabase
+
+sys.path.insert(0, ".")
+from pipelines import storage
+from pipelines.graphrag.routing_tables import ROUTING_DIR, TABLE
+
+with open("config.yaml") as f:
+    config = yaml.safe_load(f)
+
+STATE = ROUTING_DIR / "state.json"
+EDGES = ["BELONGS_TO", "OWNED_BY", "MAINTAINS", "DEPENDS_ON"]
+# Settings that shape the rows (attach / max_components only affect prompts)
+TABLE_KEYS = ["top_owners", "top_modules", "top_co", "closure_depth", "max_closure"]
+
+def repos(session):
+    return sorted(r["repo"] for r in session.run("MATCH (c:Component) RETURN DISTINCT split(c.id, ':')[0] AS repo"))
+
+def fingerprint(session, repo):
+    """Per edge type: count, confidence sum and newest created_at of the repo's routing edges."""
+    rows = session.run("MATCH (a)-[r]->() WHERE a.id STARTS WITH $prefix AND type(r) IN $types "
+                       "RETURN type(r) AS t, count(r) AS c, sum(coalesce(r.confidence, 0.0)) AS s, max(r.created_at) AS m",
+                       prefix=f"{repo}:", types=EDGES)
+    comps = session.run("MATCH (c:Component) WHERE c.id STARTS WITH $prefix RETURN count(c) AS c", prefix=f"{repo}:").single()["c"]
+    return {"components": comps, **{r["t"]: [r["c"], round(r["s"], 6), r["m"]] for r in sorted(rows, key=lambda r: r["t"])}}
+
+def edges(session, repo, etype):
+    return [(r["src"], r["tgt"], 0.5 if r["conf"] is None else r["conf"]) for r in session.run(
+        f"MATCH (a)-[r:{etype}]->(b) WHERE a.id STARTS WITH $prefix RETURN a.id AS src, b.id AS tgt, r.confidence AS conf",
+        prefix=f"{repo}:")]
+
+def closure(direct, start, max_depth):
+    """Components reachable from `start` over the component dependency graph, BFS depth <= max_depth."""
+    depth, frontier = {start: 0}, [start]
+    for d in range(1, max_depth + 1):
+        nxt = []
+        for c in frontier:
+            for t in sorted(direct.get(c, {})):
+                if t not in depth: depth[t] = d; nxt.append(t)
+        frontier = nxt
+    return [(t, d) for t, d in depth.items() if d]
+
+def materialize(session, repo, rc):
+    names = {r["id"]: r["name"] for r in session.run(
+        "MATCH (c:Component) WHERE c.id STARTS WITH $prefix RETURN c.id AS id, c.name AS name", prefix=f"{repo}:")}
+    comps_of, owners_of = defaultdict(list), defaultdict(list)
+    for i, c, conf in edges(session, repo, "BELONGS_TO"): comps_of[i].append((c, conf))
+    for i, o, conf in edges(session, repo, "OWNED_BY"): owners_of[i].append((o, conf))
+    modules = defaultdict(list)
+    for o, m, conf in edges(session, repo, "MAINTAINS"): modules[o].append((-conf, m))
+
+    issues, score, assigned, co = Counter(), defaultdict(Counter), defaultdict(Counter), defaultdict(Counter)
+    for i, comps in comps_of.items():
+        for c, cconf in comps:
+            issues[c] += 1
+            for o, oconf in owners_of.get(i, []):
+                score[c][o] += cconf * oconf; assigned[c][o] += 1
+            for other, _ in comps:
+                if other != c: co[c][other] += 1
+    # Component dependencies induced by issue dependencies
+    direct = defaultdict(Counter)
+    for i, j, _ in edges(session, repo, "DEPENDS_ON"):
+        for a, _ in comps_of.get(i, []):
+            for b, _ in comps_of.get(j, []):
+                if a != b: direct[a][b] += 1
+
+    rows = []
+    for c in sorted(set(names) | set(issues)):
+        owners = sorted(score[c].items(), key=lambda x: (-x[1], x[0]))[:rc.get("top_owners", 10)]
+        deps = sorted(closure(direct, c, rc.get("closure_depth", 3)), key=lambda x: (x[1], -direct[c].get(x[0], 0), x[0]))
+        rows.append({"id": c, "repo": repo, "name": names.get(c) or c.rsplit(":", 1)[-1], "issues": issues[c],
+                     "owners": [{"id": o, "score": round(s, 4), "issues": assigned[c][o],
+                                 "modules": [m for _, m in sorted(modules.get(o, []))[:rc.get("top_modules", 5)]]}
+                                for o, s in owners],
+                     "co_components": [{"id": o, "count": n} for o, n in
+                                       sorted(co[c].items(), key=lambda x: (-x[1], x[0]))[:rc.get("top_co", 10)]],
+                     "depends_on": [{"id": t, "depth": d, "count": direct[c].get(t, 0)} for t, d in deps[:rc.get("max_closure", 50)]]})
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--full", action="store_true", help="recompute every repo, ignoring the saved fingerprints")
+    args = parser.parse_args()
+    rc = config.get("routing", {})
+    driver = GraphDatabase.driver(config["neo4j"]["uri"], auth=(config["neo4j"]["user"], config["neo4j"]["password"]))
+    state = json.load(open(STATE)) if STATE.exists() and not args.full else {"repos": {}}
+    # Saved fingerprints only hold for tables built with the same settings
+    settings = {k: rc.get(k) for k in TABLE_KEYS}
+    if state.get("config") != settings:
+        if state["repos"]: print("  Routing config changed; recomputing every repo")
+        state = {"repos": {}}
+    existing = storage.load_records(TABLE) if storage.exists(TABLE) and not args.full else []
+
+    start = time.time()
+    with driver.session() as s:
+        current = {repo: fingerprint(s, repo) for repo in repos(s)}
+        dirty = [repo for repo, fp in current.items() if state["repos"].get(repo) != fp]
+        rows = [r for r in existing if r["repo"] in current and r["repo"] not in dirty]
+        for repo in dirty:
+            t0 = time.time()
+            fresh = materialize(s, repo, rc)
+            rows.extend(fresh)
+            print(f"  {repo}: {len(fresh)} components ({time.time() - t0:.1f}s)")
+    driver.close()
+    clean = sorted(set(current) - set(dirty))
+    if clean: print(f"  Unchanged: {', '.join(clean)}")
+    dropped = sorted({r["repo"] for r in existing} - set(current))
+    if dropped: print(f"  Dropped repos no longer in the graph: {', '.join(dropped)}")
+
+    if dirty or dropped or not storage.exists(TABLE):
+        rows.sort(key=lambda r: r["id"])
+        fp = storage.save_records(rows, TABLE)
+        print(f"\nSaved {len(rows)} component rows to {fp}")
+    ROUTING_DIR.mkdir(parents=True, exist_ok=True)
+    json.dump({"repos": current, "config": settings, "updated": time.time()}, open(STATE, "w"), indent=2)
+    with_owners = sum(1 for r in rows if r["owners"])
+    print(f"Routing tables: {len(rows)} components, {with_owners} with ranked owners, "
+          f"{len(dirty)}/{len(current)} repos recomputed in {time.time() - start:.1f}s")
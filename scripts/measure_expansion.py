@@ -0,0 +1,136 @@
+"""
+measure_expansion.py
+Per-query cost of GraphRAG retrieval before and after expansion stopped returning node
+embeddings: bytes Neo4j sends back (PackStream size of the returned values), records,
+round trips, and Python allocations (tracemalloc peak and blocks still held afterwards).
+"before" reproduces the previous path, which read every embedding on each seed scan and
+returned b.embedding for every neighbor; "after" is GraphRAGPipeline.retrieve with a cold
+neighborhood cache. The one-off NodeIndex load is reported separately.
+"""
+import time, json, argparse, sys, tracemalloc
+from pathlib import Path
+import numpy as np
+
+sys.path.insert(0, ".")
+from pipelines.graphrag.graphrag_pipeline import GraphRAGPipeline, config
+from pipelines import storage
+
+def packstream_size(v):
+    def header(n, small=True):
+        return 1 if small and n < 16 else 2 if n < 256 else 3 if n < 65536 else 5
+    if v is None or isinstance(v, bool): return 1
+    if isinstance(v, int): return 1 if -16 <= v < 128 else 2 if -128 <= v < 128 else 3 if -2**15 <= v < 2**15 else 5 if -2**31 <= v < 2**31 else 9
+    if isinstance(v, float): return 9
+    if isinstance(v, str):
+        n = len(v.encode()); return header(n) + n
+    if isinstance(v, (list, tuple)): return header(len(v)) + sum(packstream_size(x) for x in v)
+    if isinstance(v, dict): return header(len(v)) + sum(packstream_size(k) + packstream_size(x) for k, x in v.items())
+    return 9
+
+class CountingSession:
+    def __init__(self, session, counts):
+        self.session, self.counts = session, counts
+
+    def __enter__(self):
+        self.session.__enter__(); return self
+
+    def __exit__(self, *exc):
+        return self.session.__exit__(*exc)
+
+    def run(self, query, **params):
+        records = [dict(r) for r in self.session.run(query, **params)]
+        self.counts["round_trips"] += 1
+        self.counts["records"] += len(records)
+        self.counts["bytes"] += sum(2 + packstream_size(list(r.values())) for r in records)
+        return records
+
+class CountingDriver:
+    def __init__(self, driver):
+        self.driver = driver
+        self.counts = {"bytes": 0, "records": 0, "round_trips": 0}
+
+    def session(self, **kw):
+        return CountingSession(self.driver.session(**kw), self.counts)
+
+    def reset(self):
+        snap = dict(self.counts)
+        for k in self.counts: self.counts[k] = 0
+        return snap
+
+def legacy_retrieve(pipe, query, k, max_hops, threshold):
+    """The previous _get_seeds -> _expand -> _prune, embeddings included (no cache)."""
+    qe = pipe.embed_model.encode(query, normalize_embeddings=True)
+    with pipe.driver.session() as s:
+        rows = [dict(r) for r in s.run(
+            "MATCH (n) WHERE n.embedding IS NOT NULL RETURN n.id AS id, labels(n)[0] AS label, n.text_payload AS text, n.embedding AS embedding")]
+        scored = [{"id": n["id"], "label": n["label"], "text": n["text"], "embedding": n["embedding"],
+                   "similarity": float(np.dot(qe, n["embedding"]))} for n in rows if n["embedding"]]
+        scored.sort(key=lambda x: x["similarity"], reverse=True)
+        visited, nodes, edges, frontier = set(), [], [], [(x, 0) for x in scored[:k]]
+        while frontier:
+            cur, depth = frontier.pop(0)
+            if cur["id"] in visited or depth > max_hops: continue
+            visited.add(cur["id"]); nodes.append(cur)
+            for rule in pipe.expansion_policy.get(cur.get("label", ""), []):
+                if depth + 1 > rule["max_depth"]: continue
+                for nb in s.run(f"MATCH (a {{id: $id}})-[r:{rule['edge']}]->(b:{rule['target']}) RETURN b.id AS id, labels(b)[0] AS label, b.text_payload AS text, b.embedding AS embedding, type(r) AS rt, r.confidence AS conf", id=cur["id"]):
+                    nb = dict(nb)
+                    edges.append({"source": cur["id"], "target": nb["id"], "type": nb["rt"], "confidence": nb.get("conf", 0.5)})
+                    if nb["id"] not in visited: frontier.append((nb, depth + 1))
+    kept = [n for n in nodes if (float(np.dot(qe, n["embedding"])) if n.get("embedding") else 0.3) >= threshold]
+    for n in kept: n["relevance"] = float(np.dot(qe, n["embedding"])) if n.get("embedding") else 0.3
+    ids = {n["id"] for n in kept}
+    return kept, [e for e in edges if e["source"] in ids and e["target"] in ids]
+
+def measure(fn, queries, driver):
+    totals = {"bytes": 0, "records": 0, "round_trips": 0, "peak_bytes": 0, "held_blocks": 0, "seconds": 0.0}
+    out = []
+    for q in queries:
+        driver.reset()
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        start = time.time()
+        result = fn(q)
+        totals["seconds"] += time.time() - start
+        _, peak = tracemalloc.get_traced_memory()
+        held = sum(s.count_diff for s in tracemalloc.take_snapshot().compare_to(before, "filename") if s.count_diff > 0)
+        tracemalloc.stop()
+        for k, v in driver.reset().items(): totals[k] += v
+        totals["peak_bytes"] += peak; totals["held_blocks"] += held
+        out.append(result)
+    return {k: v / len(queries) for k, v in totals.items()}, out
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+    rc = config["retrieval"]
+    benchmark = storage.load_records("data/benchmark/benchmark_raw", ["title", "text"])[:args.limit]
+    queries = [f"{b['title']} {b['text'][:500]}" for b in benchmark]
+
+    pipe = GraphRAGPipeline()
+    counting = CountingDriver(pipe.driver)
+    pipe.driver = counting
+    start = time.time()
+    pipe.nodes  # one-off node table load
+    load = counting.reset()
+    print(f"NodeIndex load (once per process): {load['bytes']/1e6:.1f}MB, {load['records']} records, {time.time()-start:.1f}s")
+
+    before, old = measure(lambda q: legacy_retrieve(pipe, q, rc["seed_k"], rc["max_hops"], rc["prune_threshold"]), queries, counting)
+    def current(q):
+        pipe.neighborhood_cache.clear()
+        return pipe.retrieve(q)
+    after, new = measure(current, queries, counting)
+    same = sum([n["id"] for n in a[0]] == [n["id"] for n in b[0]] for a, b in zip(old, new))
+
+    print(f"\nPer query (mean over {len(queries)} queries, cold cache):")
+    print(f"{'':<10} {'Bytes':>12} {'Records':>9} {'Round trips':>12} {'Peak alloc':>12} {'Held blocks':>12} {'Time':>8}")
+    for name, m in [("before", before), ("after", after)]:
+        print(f"{name:<10} {m['bytes']/1e3:>10.1f}kB {m['records']:>9.0f} {m['round_trips']:>12.1f} "
+              f"{m['peak_bytes']/1e6:>10.2f}MB {m['held_blocks']:>12.0f} {m['seconds']:>7.3f}s")
+    print(f"\nSame retrieved nodes: {same}/{len(queries)} queries")
+    out = Path("results/stats"); out.mkdir(parents=True, exist_ok=True)
+    json.dump({"queries": len(queries), "node_index_load": load, "before": before, "after": after,
+               "same_nodes": same}, open(out / "expansion_measurements.json", "w"), indent=2)
+    print("Saved to results/stats/expansion_measurements.json")
+    pipe.close()
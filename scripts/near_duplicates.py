@@ -0,0 +1,123 @@
+"""
+near_duplicates.py
+MinHash + LSH near-duplicate detection for issues and PRs (templated bug reports,
+bot-generated issues, mirrored PR bodies). Signatures are computed as one array op per
+chunk of records, LSH banding groups candidates, and candidates are confirmed by their
+estimated Jaccard similarity. Repos are processed in parallel worker processes.
+"""
+import re, zlib
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+from pipelines import storage
+
+MERSENNE = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+def shingles(text, k=5):
+    """crc32 hashes of the word k-shingles of `text` (None if it is too short to compare)."""
+    tokens = re.findall(r"\w+", text.lower())
+    if len(tokens) < 2 * k: return None
+    return np.unique(np.fromiter((zlib.crc32(" ".join(tokens[i:i+k]).encode()) for i in range(len(tokens) - k + 1)),
+                                 dtype=np.uint64))
+
+def minhash_signatures(shingle_sets, num_perm=128, seed=42, max_cells=1 << 22):
+    """(n_docs, num_perm) uint32 MinHash signatures via universal hashing (a*x + b) mod p,
+    p = 2^61 - 1. Shingle hashes x and the coefficients a, b are below 2^32, so a*x + b fits
+    in uint64 and the arithmetic is exact. Documents are hashed in chunks of about
+    max_cells / num_perm shingles, and a chunk's permutations in blocks of at most `max_cells`
+    hashes, so the working array stays near max_cells * 8 bytes (32 MB) however long the
+    documents are."""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, int(MAX_HASH), num_perm, dtype=np.uint64)
+    b = rng.integers(0, int(MAX_HASH), num_perm, dtype=np.uint64)
+    sigs = np.empty((len(shingle_sets), num_perm), dtype=np.uint32)
+    max_rows, start = max(1, max_cells // num_perm), 0
+    while start < len(shingle_sets):
+        end, rows = start + 1, len(shingle_sets[start])
+        while end < len(shingle_sets) and rows + len(shingle_sets[end]) <= max_rows:
+            rows += len(shingle_sets[end]); end += 1
+        part = shingle_sets[start:end]
+        flat = np.concatenate(part)[:, None]
+        offsets = np.concatenate([[0], np.cumsum([len(s) for s in part])[:-1]])
+        step = max(1, max_cells // len(flat))
+        for p in range(0, num_perm, step):
+            hv = flat * a[None, p:p+step]
+            hv += b[None, p:p+step]; hv %= MERSENNE; hv &= MAX_HASH
+            sigs[start:end, p:p+step] = np.minimum.reduceat(hv, offsets, axis=0)
+        start = end
+    return sigs
+
+def lsh_clusters(sigs, bands=16, threshold=0.8, max_pairwise=64):
+    """Union-find clusters of rows whose signatures share an LSH band bucket and whose
+    estimated Jaccard similarity is >= threshold. Buckets of up to `max_pairwise` rows compare
+    every pair; in larger ones each row is compared with the first row of every cluster the
+    bucket has formed so far, and joins every one it matches."""
+    n, num_perm = sigs.shape
+    rows = num_perm // bands
+    parent = np.arange(n)
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]; x = parent[x]
+        return x
+    for band in range(bands):
+        _, bucket = np.unique(sigs[:, band*rows:(band+1)*rows], axis=0, return_inverse=True)
+        bucket = bucket.ravel()
+        order = np.argsort(bucket, kind="stable")
+        bounds = np.flatnonzero(np.diff(bucket[order])) + 1
+        for group in np.split(order, bounds):
+            if len(group) < 2: continue
+            if len(group) <= max_pairwise:
+                g = sigs[group]
+                pairs = np.argwhere(np.triu((g[:, None, :] == g[None, :, :]).mean(axis=2) >= threshold, 1))
+                links = [(group[i], group[j]) for i, j in pairs]
+            else:
+                leaders, links = [], []
+                for j in group:
+                    matched = [h for h in leaders if (sigs[h] == sigs[j]).mean() >= threshold]
+                    if not matched: leaders.append(j)
+                    links.extend((h, j) for h in matched)
+            for i, j in links:
+                ra, rb = find(i), find(j)
+                if ra != rb: parent[rb] = ra
+    clusters = {}
+    for i in range(n):
+        clusters.setdefault(find(i), []).append(i)
+    return [c for c in clusters.values() if len(c) > 1]
+
+def detect_records(records, params):
+    """Clusters over one list of issue/PR records; the earliest-created record is canonical."""
+    keyed = [(r, shingles(f"{r.get('title','')} {r.get('body','') or ''}", params["shingle_size"])) for r in records]
+    keyed = [(r, s) for r, s in keyed if s is not None]
+    if len(keyed) < 2: return []
+    sigs = minhash_signatures([s for _, s in keyed], params["num_perm"], params["seed"])
+    out = []
+    for members in lsh_clusters(sigs, params["bands"], params["threshold"]):
+        recs = sorted((keyed[i][0] for i in members), key=lambda r: (r.get("created_at") or "", str(r["id"])))
+        sim = float((sigs[members] == sigs[members[0]]).mean(axis=1).min())
+        out.append({"canonical": recs[0]["id"], "members": [r["id"] for r in recs], "min_similarity": round(sim, 3)})
+    return out
+
+def detect_repo(repo_dir, params):
+    repo_dir = Path(repo_dir)
+    result = {"repo": repo_dir.name}
+    for kind in ["issues", "prs"]:
+        fp = repo_dir / kind
+        records = storage.load_records(fp, ["id", "title", "body", "created_at"]) if storage.exists(fp) else []
+        result[kind] = detect_records(records, params)
+    return result
+
+def find_near_duplicates(repo_dirs, params, workers=None):
+    """Runs detect_repo for every repo in parallel. Uses fork-started workers where the
+    platform has them (the calling scripts are not import-safe under spawn), else runs inline."""
+    repo_dirs = list(repo_dirs)
+    if "fork" in mp.get_all_start_methods() and len(repo_dirs) > 1:
+        with ProcessPoolExecutor(workers, mp_context=mp.get_context("fork")) as ex:
+            return list(ex.map(detect_repo, repo_dirs, [params] * len(repo_dirs)))
+    return [detect_repo(d, params) for d in repo_dirs]
+
+def canonical_map(results):
+    """{repo: {kind: {duplicate id (str): canonical id}}} for extract_entities.py."""
+    return {r["repo"]: {kind: {str(m): c["canonical"] for c in r[kind] for m in c["members"] if m != c["canonical"]}
+                        for kind in ["issues", "prs"]} for r in results}
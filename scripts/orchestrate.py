@@ -0,0 +1,258 @@
+"""
+orchestrate.py
+Runs the experiment end to end as a DAG of the existing scripts. Each stage declares its
+inputs (files/globs, config sections, upstream stages) and outputs; a stage is skipped when
+the content hash of its inputs matches the last successful run and its outputs are unchanged.
+Independent stages (e.g. the four pipeline runs) run in parallel. Wall time and peak RSS of
+every stage are recorded in results/orchestrator/state.json and runs.jsonl. Scripts that resume
+from their own checkpoints (run_experiment, collect_github_data, the judge cache) would keep
+results from the old inputs, so before such a stage runs with a new fingerprint its declared
+`checkpoints` are moved to results/orchestrator/stale/; a failed or interrupted attempt at the
+same fingerprint resumes from them.
+
+    python scripts/orchestrate.py                    # everything that is out of date
+    python scripts/orchestrate.py metrics --jobs 4   # a target and what it depends on
+    python scripts/orchestrate.py --dry-run          # show what would run
+    python scripts/orchestrate.py --mark collect     # adopt existing outputs without running
+"""
+import os, sys, json, glob, time, shutil, hashlib, argparse, subprocess, yaml
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+
+with open("config.yaml") as f:
+    config = yaml.safe_load(f)
+
+STATE_DIR = Path("results/orchestrator")
+STATE_FILE = STATE_DIR / "state.json"
+PY = sys.executable
+PIPELINE_NAMES = ["bm25", "vector_rag", "graph_only", "graphrag"]
+GRAPH_CODE = ["pipelines/graphrag/*.py", "pipelines/encoders.py", "pipelines/resources.py", "pipelines/semantic_cache.py"]
+PIPELINE_CODE = {"bm25": ["pipelines/bm25/*.py"],
+                 "vector_rag": ["pipelines/vector_rag/*.py", "pipelines/encoders.py", "pipelines/embedding_jobs.py",
+                                "pipelines/resources.py"],
+                 "graph_only": ["pipelines/graph_only/*.py"] + GRAPH_CODE,
+                 "graphrag": GRAPH_CODE}
+LLM_CODE = ["pipelines/llm_client.py", "pipelines/dispatcher.py", "pipelines/batch_api.py"]
+
+# name -> cmd, inputs (globs), config (dotted keys), deps (stages), outputs (globs),
+# checkpoints (globs the script resumes from; moved aside when the stage has to start over)
+STAGES = {
+    "collect":   {"cmd": [PY, "scripts/collect_github_data.py"], "inputs": ["scripts/collect_github_data.py"],
+                  "config": ["github"], "deps": [], "outputs": ["data/raw/*/*"], "checkpoints": ["data/raw/*"]},
+    "validate":  {"cmd": [PY, "scripts/validate_data.py"],
+                  "inputs": ["scripts/validate_data.py", "scripts/near_duplicates.py"],
+                  "config": ["github.date_range", "dedup"], "deps": ["collect"],
+                  "outputs": ["results/validation_report.txt", config.get("dedup", {}).get("map_file", "data/processed/dedup_map.json")]},
+    "extract":   {"cmd": [PY, "scripts/extract_entities.py"], "inputs": ["scripts/extract_entities.py"],
+                  "config": ["dedup.map_file"], "deps": ["collect", "validate"],
+                  "outputs": ["data/processed/entities_*", "data/processed/relations.*"]},
+    # Writes to Neo4j, so it has no file outputs; downstream stages depend on its fingerprint
+    "build_kg":  {"cmd": [PY, "scripts/build_knowledge_graph.py"],
+                  "inputs": ["scripts/build_knowledge_graph.py", "pipelines/encoders.py", "pipelines/embedding_jobs.py"],
+                  "config": ["neo4j", "models.embedding"], "deps": ["extract"], "outputs": []},
+    "routing":   {"cmd": [PY, "scripts/materialize_routing.py"],
+                  "inputs": ["scripts/materialize_routing.py", "pipelines/graphrag/routing_tables.py"],
+                  "config": ["routing"], "deps": ["build_kg"], "outputs": ["data/routing/routing_components.*"]},
+    "build_index": {"cmd": [PY, "scripts/build_indexes.py"],
+                    "inputs": ["scripts/build_indexes.py", "pipelines/embedding_jobs.py", "pipelines/encoders.py",
+                               "pipelines/vector_rag/*.py"],
+                    "config": ["models.embedding", "retrieval.vector_index"], "deps": ["extract"],
+                    "outputs": ["data/indexes/*"]},
+    "benchmark": {"cmd": [PY, "scripts/create_benchmark.py"], "inputs": ["scripts/create_benchmark.py"],
+                  "config": ["benchmark"], "deps": ["build_kg"], "outputs": ["data/benchmark/benchmark_raw.*"]},
+    **{f"run_{p}": {"cmd": [PY, "scripts/run_experiment.py", "--pipeline", p],
+                    "inputs": ["scripts/run_experiment.py", "pipelines/storage.py"] + LLM_CODE + PIPELINE_CODE[p],
+                    "config": ["models", "retrieval", "experiment"],
+                    "deps": ["benchmark", "extract"] + (["build_kg", "routing"] if p in ["graph_only", "graphrag"] else [])
+                            + (["build_index"] if p == "vector_rag" else []),
+                    "outputs": [f"evaluation/automated/results_{p}.*"],
+                    "checkpoints": [f"evaluation/automated/results_{p}.*"]} for p in PIPELINE_NAMES},
+    "metrics":   {"cmd": [PY, "scripts/compute_metrics.py"],
+                  "inputs": ["scripts/compute_metrics.py", "scripts/paired_stats.py"],
+                  "config": [], "deps": [f"run_{p}" for p in PIPELINE_NAMES] + ["benchmark"],
+                  "outputs": ["results/stats/all_metrics.json", "results/stats/stratified_comparisons.json"],
+                  "checkpoints": ["results/stats/judge_cache.json"]},
+    "figures":   {"cmd": [PY, "scripts/create_figures.py"], "inputs": ["scripts/create_figures.py"],
+                  "config": [], "deps": ["metrics"], "outputs": ["results/figures/*"]},
+    "human_eval": {"cmd": [PY, "scripts/prepare_human_eval.py"], "inputs": ["scripts/prepare_human_eval.py"],
+                   "config": [], "deps": [f"run_{p}" for p in PIPELINE_NAMES] + ["benchmark"],
+                   "outputs": ["evaluation/human/*"]},
+}
+
+def config_value(dotted):
+    node = config
+    for part in dotted.split("."):
+        node = node.get(part) if isinstance(node, dict) else None
+    return node
+
+class Hasher:
+    """Content hashes of files, reused across runs while (size, mtime) is unchanged."""
+    def __init__(self, cache):
+        self.cache = cache
+
+    def file(self, path):
+        st = os.stat(path)
+        key = f"{st.st_size}:{st.st_mtime_ns}"
+        hit = self.cache.get(path)
+        if hit and hit[0] == key: return hit[1]
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""): h.update(block)
+        self.cache[path] = [key, h.hexdigest()]
+        return h.hexdigest()
+
+    def globs(self, patterns):
+        """Hash of every file matched by `patterns` (directories are walked); None if nothing matches."""
+        files = set()
+        for pattern in patterns:
+            for p in glob.glob(pattern, recursive=True):
+                if os.path.isdir(p):
+                    files.update(str(f) for f in Path(p).rglob("*") if f.is_file())
+                elif not p.endswith(".tmp"):
+                    files.add(p)
+        if not files: return None
+        h = hashlib.sha256()
+        for f in sorted(files):
+            h.update(f.encode()); h.update(self.file(f).encode())
+        return h.hexdigest()
+
+def fingerprint(name, stage, hasher, state):
+    h = hashlib.sha256(json.dumps(stage["cmd"][1:]).encode())
+    h.update((hasher.globs(stage["inputs"]) or "").encode())
+    for key in stage["config"]:
+        h.update(json.dumps([key, config_value(key)], sort_keys=True, default=str).encode())
+    for dep in stage["deps"]:
+        # Upstream outputs if it has any, else its own fingerprint (e.g. the Neo4j load)
+        d = state["stages"].get(dep, {})
+        h.update(f"{dep}:{d.get('outputs_hash') or d.get('fingerprint')}".encode())
+    return h.hexdigest()
+
+def move_aside(name, globs):
+    """Move a stage's checkpoints under results/orchestrator/stale/ so its script starts over."""
+    paths = sorted({p for g in globs for p in glob.glob(g)})
+    if not paths: return None
+    dest = STATE_DIR / "stale" / f"{name}-{time.strftime('%Y%m%d-%H%M%S')}"
+    for p in paths:
+        (dest / p).parent.mkdir(parents=True, exist_ok=True)
+        shutil.move(p, dest / p)
+    return dest
+
+def resumes(name, fp, state):
+    # Only an unfinished attempt at the same fingerprint may continue from its checkpoints
+    prev = state["stages"].get(name, {})
+    return prev.get("attempt") == fp and prev.get("status") != "ok"
+
+def load_state():
+    return json.load(open(STATE_FILE)) if STATE_FILE.exists() else {"stages": {}, "file_hashes": {}}
+
+def save_state(state):
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = STATE_FILE.with_suffix(".tmp")
+    json.dump(state, open(tmp, "w"), indent=2)
+    tmp.replace(STATE_FILE)
+
+def closure(targets):
+    """Targets plus everything they depend on, in declaration (topological) order."""
+    need, stack = set(), list(targets)
+    while stack:
+        n = stack.pop()
+        if n in need: continue
+        need.add(n); stack.extend(STAGES[n]["deps"])
+    return [n for n in STAGES if n in need]
+
+def up_to_date(name, fp, hasher, state):
+    prev = state["stages"].get(name, {})
+    if prev.get("status") != "ok" or prev.get("fingerprint") != fp: return False
+    outputs = STAGES[name]["outputs"]
+    return not outputs or hasher.globs(outputs) == prev.get("outputs_hash")
+
+def run_stage(name, log_dir):
+    """Run one stage as a child process; returns (returncode, wall seconds, peak RSS MB)."""
+    log = open(log_dir / f"{name}.log", "w")
+    start = time.time()
+    proc = subprocess.Popen(STAGES[name]["cmd"], stdout=log, stderr=subprocess.STDOUT)
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    log.close()
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss_mb = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return proc.returncode, time.time() - start, rss_mb
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("targets", nargs="*", help=f"stages to bring up to date (default: all). One of {list(STAGES)}")
+    parser.add_argument("--jobs", type=int, default=4, help="stages run in parallel")
+    parser.add_argument("--force", default="", help="comma-separated stages to re-run even if up to date")
+    parser.add_argument("--mark", default="", help="comma-separated stages to record as done from existing outputs")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    unknown = [t for t in args.targets + [s for s in (args.force + "," + args.mark).split(",") if s] if t not in STAGES]
+    if unknown: parser.error(f"unknown stage(s): {unknown}")
+    order = closure(args.targets or list(STAGES))
+    force = set(filter(None, args.force.split(",")))
+    state = load_state()
+    hasher = Hasher(state["file_hashes"])
+
+    for name in filter(None, args.mark.split(",")):
+        state["stages"][name] = {"status": "ok", "fingerprint": fingerprint(name, STAGES[name], hasher, state),
+                                 "outputs_hash": hasher.globs(STAGES[name]["outputs"]), "marked": True}
+        print(f"  marked {name} as up to date")
+    save_state(state)
+
+    log_dir = STATE_DIR / "logs"; log_dir.mkdir(parents=True, exist_ok=True)
+    done, failed, skipped, would_run, report = set(), set(), set(), set(), []
+    pending, running = list(order), {}
+    with ThreadPoolExecutor(max_workers=max(args.jobs, 1)) as pool:
+        while pending or running:
+            for name in list(pending):
+                deps = [d for d in STAGES[name]["deps"] if d in order]
+                if any(d in failed for d in deps):
+                    pending.remove(name); failed.add(name); print(f"  {name}: blocked by failed dependency")
+                    continue
+                if not all(d in done for d in deps) or len(running) >= args.jobs: continue
+                pending.remove(name)
+                fp = fingerprint(name, STAGES[name], hasher, state)
+                stale_dep = any(d in would_run for d in deps)
+                if name not in force and not stale_dep and up_to_date(name, fp, hasher, state):
+                    done.add(name); skipped.add(name); print(f"  {name}: up to date")
+                    continue
+                fresh = bool(STAGES[name].get("checkpoints")) and not resumes(name, fp, state)
+                if args.dry_run:
+                    done.add(name); would_run.add(name)
+                    print(f"  {name}: would run {' '.join(STAGES[name]['cmd'][1:])}" + (" (from scratch)" if fresh else ""))
+                    continue
+                if fresh:
+                    moved = move_aside(name, STAGES[name]["checkpoints"])
+                    if moved: print(f"  {name}: previous checkpoints moved to {moved}")
+                state["stages"][name] = {**state["stages"].get(name, {}), "status": "running", "attempt": fp}
+                save_state(state)
+                print(f"  {name}: running (log: {log_dir / (name + '.log')})")
+                running[pool.submit(run_stage, name, log_dir)] = (name, fp)
+            if not running: continue
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for fut in finished:
+                name, fp = running.pop(fut)
+                code, wall, rss = fut.result()
+                entry = {"stage": name, "status": "ok" if code == 0 else "failed", "returncode": code,
+                         "wall_s": round(wall, 1), "peak_rss_mb": round(rss, 1), "finished_at": time.time()}
+                report.append(entry)
+                if code == 0:
+                    done.add(name)
+                    state["stages"][name] = {**entry, "fingerprint": fp,
+                                             "outputs_hash": hasher.globs(STAGES[name]["outputs"])}
+                else:
+                    failed.add(name)
+                    state["stages"][name] = {**state["stages"].get(name, {}), "status": "failed"}
+                save_state(state)
+                print(f"  {name}: {entry['status']} in {wall:.1f}s, peak RSS {rss:.0f}MB")
+
+    if report:
+        with open(STATE_DIR / "runs.jsonl", "a") as f:
+            for entry in report: f.write(json.dumps(entry) + "\n")
+        print(f"\n{'Stage':<16} {'Status':<8} {'Wall':>9} {'Peak RSS':>10}")
+        print("-" * 46)
+        for e in report:
+            print(f"{e['stage']:<16} {e['status']:<8} {e['wall_s']:>8.1f}s {e['peak_rss_mb']:>8.0f}MB")
+    print(f"\n{len(report)} ran, {len(skipped)} up to date, {len(failed)} failed")
+    sys.exit(1 if failed else 0)
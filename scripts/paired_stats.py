@@ -0,0 +1,118 @@
+"""
+paired_stats.py
+Paired comparisons of per-instance metrics between pipelines, aligned on instance_id:
+bootstrap CIs of the mean difference and sign-flip permutation tests. Every stratum (all,
+task type, repo, task type x repo) is handled with one resample matrix shared by all
+metric x pipeline-pair columns, so each stratum costs two matrix products instead of a
+Python loop per test. Holm correction is applied within each stratum: permutation
+p-values cannot go below 1 / (resamples + 1), so a single family spanning every stratum
+could never reach significance.
+
+    python scripts/paired_stats.py [resamples]   # re-run on results/stats/per_instance_metrics
+"""
+import sys, time, json, warnings
+from itertools import combinations
+from pathlib import Path
+import numpy as np
+
+PIPELINES = ["bm25", "vector_rag", "graph_only", "graphrag"]
+METRICS = ["judge_overall", "judge_relevance", "judge_completeness", "judge_coherence",
+           "faithfulness", "structural", "evidence_coverage", "latency"]
+
+def holm(pvals):
+    """Holm-Bonferroni adjusted p-values (same order as the input)."""
+    p = np.asarray(pvals, dtype=float)
+    order = np.argsort(p)
+    adj = np.maximum.accumulate((len(p) - np.arange(len(p))) * p[order])
+    out = np.empty_like(p)
+    out[order] = np.minimum(adj, 1.0)
+    return out
+
+def bootstrap_counts(n, n_resamples, rng):
+    """(n_resamples, n) resample multiplicities: row b counts how often each item is drawn."""
+    idx = rng.integers(0, n, (n_resamples, n)) + np.arange(n_resamples)[:, None] * n
+    return np.bincount(idx.ravel(), minlength=n_resamples * n).reshape(n_resamples, n).astype(np.float32)
+
+def paired_tests(diffs, mask, n_resamples=10000, rng=None, alpha=0.05):
+    """Bootstrap CI and two-sided sign-flip permutation p-value for each column of `diffs`.
+    `mask` marks which rows are real pairs for that column (others are ignored)."""
+    rng = rng or np.random.default_rng(42)
+    d = np.where(mask, diffs, 0.0).astype(np.float32)
+    m = mask.astype(np.float32)
+    n_valid = m.sum(0)
+    obs = d.sum(0) / np.maximum(n_valid, 1)
+    w = bootstrap_counts(len(d), n_resamples, rng)
+    with np.errstate(invalid="ignore", divide="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)   # columns with no pairs stay nan
+        boot = (w @ d) / (w @ m)
+        lo, hi = np.nanpercentile(boot, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    signs = rng.integers(0, 2, (n_resamples, len(d)), dtype=np.int8).astype(np.float32) * 2 - 1
+    perm = (signs @ d) / np.maximum(n_valid, 1)
+    p = (1 + (np.abs(perm) >= np.abs(obs) - 1e-12).sum(0)) / (n_resamples + 1)
+    sd = np.sqrt(np.maximum((np.where(mask, diffs, 0.0) ** 2).sum(0) / np.maximum(n_valid, 1) - obs.astype(float) ** 2, 0))
+    dz = np.where(sd > 0, obs / np.where(sd > 0, sd, 1), 0.0)
+    return {"n": n_valid.astype(int), "mean_diff": obs, "ci_low": lo, "ci_high": hi, "p": p, "d": dz}
+
+def strata(rows, min_n):
+    """{name: row indices}: all instances, each task type, each repo and each task type x repo cell."""
+    groups = {"all": np.arange(len(rows))}
+    for key in ["task_type", "repo"]:
+        for v in sorted({r.get(key) for r in rows if r.get(key)}):
+            groups[f"{key}={v}"] = np.array([i for i, r in enumerate(rows) if r.get(key) == v])
+    for t in sorted({r.get("task_type") for r in rows if r.get("task_type")}):
+        for v in sorted({r.get("repo") for r in rows if r.get("repo")}):
+            idx = np.array([i for i, r in enumerate(rows) if r.get("task_type") == t and r.get("repo") == v])
+            groups[f"task_type={t},repo={v}"] = idx
+    return {k: v for k, v in groups.items() if len(v) >= min_n}
+
+def stratified_report(per_instance, meta, metrics=METRICS, pipelines=PIPELINES,
+                      n_resamples=10000, min_n=10, seed=42):
+    """per_instance: {pipeline: {instance_id: {metric: value}}}; meta: {instance_id: {"task_type", "repo"}}.
+    Returns one row per stratum x metric x pipeline pair (a minus b), Holm-adjusted per stratum."""
+    pipelines = [p for p in pipelines if p in per_instance]
+    ids = sorted(set().union(*(per_instance[p].keys() for p in pipelines))) if pipelines else []
+    rows = [meta.get(i, {}) for i in ids]
+    pairs = list(combinations(pipelines, 2))
+    cols = [(metric, a, b) for metric in metrics for a, b in pairs]
+    # One (instances x tests) difference matrix; missing pairs are masked out rather than truncated
+    val = {(p, metric): np.array([per_instance[p].get(i, {}).get(metric, np.nan) for i in ids], dtype=float)
+           for p in pipelines for metric in metrics}
+    diffs = np.column_stack([val[(a, metric)] - val[(b, metric)] for metric, a, b in cols]) if cols else np.empty((0, 0))
+    rng = np.random.default_rng(seed)
+    out = []
+    for name, idx in strata(rows, min_n).items():
+        d = diffs[idx]
+        res = paired_tests(d, ~np.isnan(d), n_resamples, rng)
+        for j, (metric, a, b) in enumerate(cols):
+            if res["n"][j] < min_n: continue
+            out.append({"stratum": name, "metric": metric, "a": a, "b": b, "n": int(res["n"][j]),
+                        "mean_diff": float(res["mean_diff"][j]), "ci_low": float(res["ci_low"][j]),
+                        "ci_high": float(res["ci_high"][j]), "p": float(res["p"][j]), "d": float(res["d"][j])})
+        family = [r for r in out if r["stratum"] == name]
+        for r, p_adj in zip(family, holm([r["p"] for r in family])):
+            r["p_holm"] = float(p_adj)
+    return out
+
+def summarize(report, focus="graphrag", metric="judge_overall"):
+    sig = sum(1 for r in report if r["p_holm"] < 0.05)
+    print(f"\nStratified comparisons: {len(report)} tests, {sig} significant after Holm (p<0.05)")
+    print(f"  {metric}, stratum=all:")
+    for r in report:
+        if r["stratum"] == "all" and r["metric"] == metric and focus in (r["a"], r["b"]):
+            print(f"    {r['a']} - {r['b']}: {r['mean_diff']:+.3f} [{r['ci_low']:+.3f}, {r['ci_high']:+.3f}] "
+                  f"p_holm={r['p_holm']:.4f} n={r['n']}")
+
+if __name__ == "__main__":
+    sys.path.insert(0, ".")
+    from pipelines import storage
+    rows = storage.load_records("results/stats/per_instance_metrics")
+    per_instance, meta = {}, {}
+    for r in rows:
+        per_instance.setdefault(r["pipeline"], {})[r["instance_id"]] = r
+        meta[r["instance_id"]] = {"task_type": r.get("task_type"), "repo": r.get("repo")}
+    t0 = time.time()
+    report = stratified_report(per_instance, meta, n_resamples=int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
+    print(f"Computed in {time.time() - t0:.1f}s")
+    summarize(report)
+    json.dump(report, open(Path("results/stats/stratified_comparisons.json"), "w"), indent=2)
+    print("\nSaved to results/stats/stratified_comparisons.json")
@@ -3,10 +3,13 @@ prepare_human_eval.py
 Samples a stratified subset of benchmark instances and prepares a blinded
 CSV for human annotators, plus a key file for unblinding after evaluation.
 """
-import json, csv, random
+import json, csv, random, sys
 from pathlib import Path
 from collections import defaultdict
 
+sys.path.insert(0, ".")
+from pipelines import storage
+
 # ── config ────────────────────────────────────────────────────────────────────
 
 SAMPLE_PER_TASK_TYPE = 25      # 25 x 3 task types = 75 total instances
@@ -21,12 +24,12 @@ random.seed(RANDOM_SEED)
 
 # ── load data ─────────────────────────────────────────────────────────────────
 
-benchmark = json.load(open("data/benchmark/benchmark_raw.json"))
+benchmark = storage.load_records("data/benchmark/benchmark_raw")
 bench_map  = {b["instance_id"]: b for b in benchmark}
 
 results = {}
 for pipe in PIPELINES:
-    data = json.load(open(f"evaluation/automated/results_{pipe}.json"))
+    data = storage.load_records(f"evaluation/automated/results_{pipe}")
     results[pipe] = {r["instance_id"]: r for r in data}
 
 # ── stratified sample ─────────────────────────────────────────────────────────
@@ -1,4 +1,9 @@
-import json, time, yaml, argparse, sys
+import time, yaml, argparse, sys
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS report
+    resource = None
+import numpy as np
 from pathlib import Path
 from tqdm import tqdm
  
@@ -7,72 +12,296 @@ from pipelines.bm25.bm25_pipeline import BM25Pipeline
 from pipelines.vector_rag.vector_pipeline import VectorRAGPipeline
 from pipelines.graphrag.graphrag_pipeline import GraphRAGPipeline
 from pipelines.graph_only.graph_only_pipeline import GraphOnlyPipeline
-from pipelines.llm_client import generate, get_total_cost, print_cost_summary
+from pipelines.llm_client import generate_stream, get_total_cost, print_cost_summary, BudgetExceeded, dispatcher, usage
+from pipelines.dispatcher import CircuitOpen
+from pipelines.batch_api import chat_request, run_batch
+from pipelines.work_queue import open_queue, worker_name, Heartbeat
+from pipelines.resources import REGISTRY
+from pipelines import storage, profiling
+from estimate_cost import TokenCounter, load_history, estimate, print_report
  
 with open("config.yaml") as f:
     config = yaml.safe_load(f)
  
+def peak_rss_mb():
+    if resource is None: return float("nan")
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+ 
 def load_checkpoint(name, out_dir):
-    cp = out_dir / f"results_{name}.json"
-    if cp.exists():
-        existing = json.load(open(cp))
+    cp = out_dir / f"results_{name}"
+    if storage.exists(cp):
+        existing = storage.load_records(cp)
         done = {r["instance_id"] for r in existing}
         print(f"  Resuming: {len(done)} already done")
         return existing, done
     return [], set()
  
 def save_checkpoint(results, name, out_dir):
-    json.dump(results, open(out_dir/f"results_{name}.json","w"), indent=2)
+    storage.save_records(results, out_dir/f"results_{name}")
+ 
+BASELINE_SYSTEM = "You are an expert enterprise planning assistant."
+ 
+def baseline_prompt(query, retrieved):
+    context = "\n\n".join([r["text"][:500] for r in retrieved])[:24000]
+    return f"Context:\n{context}\n\nQuery:\n{query}\n\nProvide: taxonomy, routing, dependencies, questions, criteria.", context
+ 
+def run_instances(name, pipe, batch):
+    """Retrieve for a batch of benchmark instances at once, then generate each answer.
+    Returns (result records, stop reason); a budget stop or open circuit ends the batch early."""
+    graph = name in ["graphrag","graph_only"]
+    queries = [f"{inst['title']} {inst['text'][:500]}" for inst in batch]
+    # Retrieval runs once per batch; its wall time is shared evenly across the batch
+    start = time.time()
+    try:
+        retrieved = pipe.retrieve_batch(queries, [inst["repo"] for inst in batch]) if graph else pipe.retrieve_batch(queries, top_k=10)
+    except Exception as e:
+        print(f"\n  Batch retrieval error: {e}"); retrieved = [e] * len(batch)
+    share = (time.time() - start) / len(batch)
+    records = []
+    for inst, query, ret in zip(batch, queries, retrieved):
+        start = time.time()
+        try:
+            if isinstance(ret, Exception): raise ret
+            if graph:
+                r = pipe.answer(query, *ret, repo=inst["repo"])
+                output, context, ttft = r["output"], r.get("context",""), r.get("ttft_s")
+            else:
+                prompt, context = baseline_prompt(query, ret)
+                gr = generate_stream(prompt, BASELINE_SYSTEM, purpose=f"{name}_gen").collect()
+                output, ttft = gr["text"], gr["ttft_s"]
+        except (BudgetExceeded, CircuitOpen) as e:
+            return records, e
+        except Exception as e:
+            print(f"\n  Error: {e}"); output, context, ttft = f"ERROR: {e}", "", None
+        records.append({"instance_id":inst["instance_id"],"pipeline":name,
+            "query":query[:200],"output":output,"context":context[:2000],
+            "latency_seconds":round(time.time()-start+share,2),"task_type":inst["task_type"],
+            "ttft_s":ttft})
+    return records, None
+ 
+def build_requests(name, pipe, remaining, batch_size):
+    """Retrieve for the remaining instances and build every prompt without generating:
+    (instance, query, request, retrieval seconds per instance) tuples."""
+    graph = name in ["graphrag","graph_only"]
+    pending = []
+    for b in tqdm(range(0, len(remaining), batch_size), desc=f"{name} prompts"):
+        batch = remaining[b:b+batch_size]
+        queries = [f"{inst['title']} {inst['text'][:500]}" for inst in batch]
+        start = time.time()
+        retrieved = pipe.retrieve_batch(queries, [inst["repo"] for inst in batch]) if graph else pipe.retrieve_batch(queries, top_k=10)
+        share = (time.time() - start) / len(batch)
+        for inst, query, ret in zip(batch, queries, retrieved):
+            if graph:
+                req = pipe.build_prompt(query, *ret)
+            else:
+                prompt, context = baseline_prompt(query, ret)
+                req = {"prompt":prompt,"system":BASELINE_SYSTEM,"purpose":f"{name}_gen","context":context}
+            pending.append((inst, query, req, share))
+    return pending
+ 
+def run_batch_api(name, pipe, remaining, results, out_dir, args):
+    """Build every prompt for the remaining instances, generate them through the Batch API
+    (plus a second batch for GraphRAG citation fixes) and append the results."""
+    graph = name in ["graphrag","graph_only"]
+    pending = build_requests(name, pipe, remaining, args.batch_size)
+    if not pending: return
+    top_p = config["models"]["openai"].get("top_p", 0.95)
+    jobs = out_dir / "batches"
+    resp = run_batch([chat_request(inst["instance_id"], req["prompt"], req["system"], top_p=top_p) for inst, _, req, _ in pending],
+                     jobs / f"{name}.jsonl", pending[0][2]["purpose"], args.poll_interval)
+    fixes = {}
+    if graph:
+        for inst, _, req, _ in pending:
+            r = resp.get(inst["instance_id"], {})
+            fix = pipe.citation_fix(req, r["text"]) if "text" in r else None
+            if fix: fixes[inst["instance_id"]] = fix
+    fix_resp = run_batch([chat_request(iid, fix, top_p=top_p) for iid, fix in fixes.items()],
+                         jobs / f"{name}_citation_fix.jsonl", "citation_fix", args.poll_interval) if fixes else {}
+    missing = 0
+    for inst, query, req, share in pending:
+        iid = inst["instance_id"]
+        r = fix_resp.get(iid) if iid in fixes else resp.get(iid)
+        if not r or "text" not in r:
+            missing += 1; continue  # left out of the checkpoint so a re-run retries it
+        output = r["text"]
+        results.append({"instance_id":iid,"pipeline":name,"query":query[:200],"output":output,
+            "context":req["context"][:2000],"latency_seconds":round(share,2),"task_type":inst["task_type"],
+            "generation":"batch_api"})
+    save_checkpoint(results, name, out_dir)
+    if missing: print(f"  {missing} requests failed or expired; re-run to retry them")
+ 
+def run_worker(queue, pipes, worker, heartbeat_s, batch_size):
+    """Lease batches of (pipeline, instance) tasks until the queue has none left for `pipes`,
+    storing each result in the queue. Returns the stop reason, if any."""
+    done = lost = 0
+    stop_reason = None
+    with Heartbeat(queue, worker, heartbeat_s) as hb:
+        while True:
+            leased = queue.lease(worker, batch_size, list(pipes))
+            if not leased: break
+            name = leased[0][0]
+            keys = [(name, iid) for _, iid, _ in leased]
+            hb.held.update(keys)
+            print(f"  {worker}: {len(leased)} {name} tasks")
+            try:
+                records, stop_reason = run_instances(name, pipes[name], [inst for _, _, inst in leased])
+            except Exception as e:
+                queue.release(worker, keys, error=str(e)); hb.held.difference_update(keys)
+                print(f"\n  Batch failed: {e}"); continue
+            for r in records:
+                key = (name, r["instance_id"])
+                if key not in hb.lost and queue.complete(worker, name, r["instance_id"], r): done += 1
+                else: lost += 1  # the lease expired and another worker took the task over
+                hb.held.discard(key)
+            unfinished = [k for k in keys if k in hb.held]
+            if unfinished: queue.release(worker, unfinished); hb.held.difference_update(unfinished)
+            if stop_reason: break
+    print(f"  {worker}: {done} tasks completed" + (f", {lost} results dropped after losing the lease" if lost else ""))
+    return stop_reason
+ 
+def merge_queue(queue, names, out_dir):
+    """Fold completed queue results into the per-pipeline checkpoints (the single writer step)."""
+    counts = queue.counts()
+    for name in names:
+        results, done = load_checkpoint(name, out_dir)
+        new = [r for r in queue.results(name) if r["instance_id"] not in done]
+        if new: save_checkpoint(results + new, name, out_dir)
+        status = ", ".join(f"{n} {s}" for s, n in sorted(counts.get(name, {}).items())) or "empty"
+        print(f"  {name}: merged {len(new)} new results ({len(results) + len(new)} total); queue: {status}")
  
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--pipeline", default="all")
     parser.add_argument("--limit", type=int, default=None)
-    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="build every remaining prompt (no LLM calls) and project cost and wall-clock time")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="dry run: generate() calls in flight at once (e.g. the number of queue workers)")
+    parser.add_argument("--batch-size", type=int, default=config.get("experiment", {}).get("batch_size", 32),
+                        help="queries retrieved together via retrieve_batch")
+    parser.add_argument("--batch-api", action="store_true",
+                        help="generate through the OpenAI Batch API (half price, asynchronous)")
+    parser.add_argument("--poll-interval", type=int, default=30, help="seconds between Batch API status polls")
+    parser.add_argument("--queue", default=None,
+                        help="work-queue file shared by worker processes/hosts; enqueue unfinished instances and work on them")
+    parser.add_argument("--queue-backend", default=None, choices=["sqlite", "file"], help="default: config work_queue.backend")
+    parser.add_argument("--worker-id", default=None, help="default: <hostname>-<pid>")
+    parser.add_argument("--merge", action="store_true", help="merge completed queue results into the result checkpoints")
+    profiling.add_argument(parser)
     args = parser.parse_args()
+    prof = profiling.start("run_experiment", args.profile)
  
-    benchmark = json.load(open("data/benchmark/benchmark_raw.json"))
+    benchmark = storage.load_records("data/benchmark/benchmark_raw", ["instance_id","title","text","task_type","repo"])
     if args.limit: benchmark = benchmark[:args.limit]
  
     out_dir = Path("evaluation/automated"); out_dir.mkdir(parents=True, exist_ok=True)
+    names = [n for n in ["bm25","vector_rag","graph_only","graphrag"] if args.pipeline in ["all", n]]
+    queue = None
+    if args.queue:
+        qcfg = config.get("work_queue", {})
+        queue = open_queue(args.queue, args.queue_backend or qcfg.get("backend", "sqlite"),
+                           qcfg.get("lease_seconds", 600), qcfg.get("max_attempts", 3))
+        if args.merge:
+            merge_queue(queue, names, out_dir)
+            sys.exit(0)
+        # cost_tracking budgets cap the spend of all workers on this queue together
+        usage.share_budget(f"queue:{Path(args.queue).resolve()}")
+        for name in names if not args.dry_run else []:
+            _, done = load_checkpoint(name, out_dir)
+            added = queue.enqueue(name, {b["instance_id"]: b for b in benchmark if b["instance_id"] not in done})
+            if added: print(f"  Queued {added} {name} tasks")
+    elif args.merge:
+        parser.error("--merge needs --queue")
+    if args.queue and args.batch_api:
+        parser.error("--queue runs synchronous generation; use --batch-api on its own")
+    prof.mark("startup")
+    start = time.time()
     pipes = {}
     if args.pipeline in ["all","bm25"]: pipes["bm25"] = BM25Pipeline()
     if args.pipeline in ["all","vector_rag"]: pipes["vector_rag"] = VectorRAGPipeline()
     if args.pipeline in ["all","graph_only"]: pipes["graph_only"] = GraphOnlyPipeline()
     if args.pipeline in ["all","graphrag"]: pipes["graphrag"] = GraphRAGPipeline()
+    # Encoders, drivers and indexes are created once per process and shared (pipelines/resources.py)
+    shared = ", ".join(f"{key[0]} x{refs} ({load_s:.1f}s)" for key, (refs, load_s) in REGISTRY.stats().items())
+    print(f"\nStartup: {time.time() - start:.1f}s, peak RSS {peak_rss_mb():.0f} MB; shared: {shared or 'none'}")
  
     if args.dry_run:
-        n = len(benchmark) * len(pipes)
-        print(f"Dry run: {n} API calls, est cost ~{n * 0.008:.2f} USD")
+        history, counter, estimates, retrieval_s = load_history(), TokenCounter(), {}, 0.0
+        for name, pipe in pipes.items():
+            prof.mark(f"dry_run:{name}")
+            _, done = load_checkpoint(name, out_dir)
+            pending = build_requests(name, pipe, [b for b in benchmark if b["instance_id"] not in done], args.batch_size)
+            estimates[name] = estimate([req for _, _, req, _ in pending], history, args.concurrency, args.batch_api, counter=counter)
+            retrieval_s += sum(share for _, _, _, share in pending)
+        print_report(estimates, args.concurrency, args.batch_api)
+        print(f"Retrieval and prompt building: {retrieval_s / 60:.1f} min in this process"
+              + (f" (~{retrieval_s / 60 / args.concurrency:.1f} min across {args.concurrency} workers)" if args.concurrency > 1 else ""))
         sys.exit(0)
  
-    for name, pipe in pipes.items():
+    stop_reason = None
+    if queue is not None:
+        qcfg = config.get("work_queue", {})
+        prof.mark("queue_worker")
+        stop_reason = run_worker(queue, pipes, args.worker_id or worker_name(),
+                                 qcfg.get("heartbeat_seconds", 60), args.batch_size)
+        print(f"  Merge finished work into the result files with --queue {args.queue} --merge")
+    for name, pipe in ({} if queue is not None else pipes).items():
+        if stop_reason: break
         print(f"\n{'='*50}\n  Running: {name} ({len(benchmark)} instances)\n{'='*50}")
+        prof.mark(f"run:{name}")
         results, done = load_checkpoint(name, out_dir)
         remaining = [b for b in benchmark if b["instance_id"] not in done]
         if not remaining: print("  Already complete!"); continue
  
-        for inst in tqdm(remaining, desc=name):
-            query = f"{inst['title']} {inst['text'][:500]}"
-            start = time.time()
+        if args.batch_api:
             try:
-                if name in ["graphrag","graph_only"]:
-                    r = pipe.run(query)
-                    output, context = r["output"], r.get("context","")
-                else:
-                    retrieved = pipe.retrieve(query, top_k=10)
-                    context = "\n\n".join([r["text"][:500] for r in retrieved])[:24000]
-                    gr = generate(f"Context:\n{context}\n\nQuery:\n{query}\n\nProvide: taxonomy, routing, dependencies, questions, criteria.",
-                        "You are an expert enterprise planning assistant.", purpose=f"{name}_gen")
-                    output = gr["text"]
-            except Exception as e:
-                print(f"\n  Error: {e}"); output, context = f"ERROR: {e}", ""
-            results.append({"instance_id":inst["instance_id"],"pipeline":name,
-                "query":query[:200],"output":output,"context":context[:2000],
-                "latency_seconds":round(time.time()-start,2),"task_type":inst["task_type"]})
-            if len(results) % 10 == 0: save_checkpoint(results, name, out_dir)
-        save_checkpoint(results, name, out_dir)
+                run_batch_api(name, pipe, remaining, results, out_dir, args)
+            except BudgetExceeded as e:
+                stop_reason = e
+            print(f"  Done: {len(results)} instances")
+            continue
+ 
+        ttfts = []
+        pbar = tqdm(total=len(remaining), desc=name)
+        for b in range(0, len(remaining), args.batch_size):
+            records, stop_reason = run_instances(name, pipe, remaining[b:b+args.batch_size])
+            results += records
+            ttfts += [r["ttft_s"] for r in records if r["ttft_s"] is not None]
+            pbar.update(len(records))
+            save_checkpoint(results, name, out_dir)
+            if stop_reason: break
+        pbar.close()
         print(f"  Done: {len(results)} instances")
+        if ttfts:
+            p50, p90, p99 = np.percentile(ttfts, [50, 90, 99])
+            print(f"  Time to first token: p50 {p50:.2f}s, p90 {p90:.2f}s, p99 {p99:.2f}s ({len(ttfts)} streamed calls)")
+        st = pipe.neighborhood_cache.stats() if hasattr(pipe, "neighborhood_cache") else None
+        if st and st["hits"] + st["misses"]:
+            print(f"  Neighborhood cache: {st['hits']} hits / {st['misses']} misses "
+                  f"({st['hit_rate']:.1%}), {st['entries']} entries, {st['evictions']} evictions")
+        sc = pipe.semantic_cache.stats() if getattr(pipe, "semantic_cache", None) else None
+        if sc and sc["lookups"]:
+            print(f"  Semantic cache: {sc['hits']}/{sc['lookups']} retrieval hits ({sc['hit_rate']:.1%}), "
+                  f"{sc['output_hits']}/{sc['output_lookups']} output hits, {sc['saved_s']:.1f}s saved, "
+                  f"{sc['expirations']} expired, {sc['evictions']} evicted")
+        ms = pipe.memo.stats() if getattr(pipe, "memo", None) else None
+        if ms and ms["hits"] + ms["misses"]:
+            print(f"  Retrieval memo: {ms['hits']} reused / {ms['misses']} retrieved ({ms['hit_rate']:.1%}), "
+                  f"{ms['saved_s']:.1f}s of retrieval saved (all graph pipelines so far)")
+        ss = pipe.search_stats if getattr(pipe, "expansion_mode", "bfs") == "best_first" else None
+        if ss and ss["queries"]:
+            print(f"  Best-first search: {ss['lookups'] / ss['queries']:.1f} neighbor lookups/query (max {ss['max_lookups']}); "
+                  f"stopped by budget {ss['budget_stops']}, threshold {ss['threshold_stops']}, exhausted {ss['exhausted_stops']}")
  
+    prof.mark("shutdown")
+    for pipe in pipes.values():
+        if hasattr(pipe, "close"): pipe.close()
+    if stop_reason: print(f"\n  Stopped early: {stop_reason}. Re-run to resume.")
+    print(f"Peak RSS: {peak_rss_mb():.0f} MB")
+    ds = dispatcher.stats()
+    print(f"\nDispatcher: {ds['calls']} calls, {ds['retries']} retries, {ds['fatal']} fatal, "
+          f"{ds['breaker_trips']} breaker trips, {ds['throttled_s']:.0f}s paced")
     print_cost_summary()
     print(f"\nTotal cost: ${get_total_cost():.2f}")
+    prof.stop()
@@ -1,7 +1,11 @@
-import json, yaml
+import json, yaml, sys
 from pathlib import Path
 from datetime import datetime
 
+sys.path.insert(0, ".")
+from pipelines import storage
+from near_duplicates import find_near_duplicates, canonical_map
+
 with open("config.yaml") as f:
     config = yaml.safe_load(f)
 
@@ -50,13 +54,13 @@ for repo_dir in sorted(RAW_DIR.iterdir()):
     print(f"\n-- {repo_dir.name} --")
 
     # -- issues -----------------------------------------------
-    issues_file = repo_dir / "issues.json"
-    check(issues_file.exists(), "ERROR", f"issues.json missing in {repo_dir.name}")
+    issues_file = repo_dir / "issues"
+    check(storage.exists(issues_file), "ERROR", f"issues data missing in {repo_dir.name}")
 
-    if issues_file.exists():
-        issues = json.load(open(issues_file))
-        check(len(issues) > 0, "ERROR", f"{repo_dir.name}/issues.json is empty")
-        print(f"  issues.json:  {len(issues):>5} records")
+    if storage.exists(issues_file):
+        issues = storage.load_records(issues_file)
+        check(len(issues) > 0, "ERROR", f"{repo_dir.name}/issues is empty")
+        print(f"  issues:  {len(issues):>5} records")
 
         missing_fields, null_titles, null_bodies, out_of_range, dup_ids = 0, 0, 0, 0, 0
         seen_ids = set()
@@ -92,13 +96,13 @@ for repo_dir in sorted(RAW_DIR.iterdir()):
         if dup_ids:        print(f"    [ERROR]   {dup_ids} duplicate IDs")
 
     # -- pull requests -----------------------------------------
-    prs_file = repo_dir / "prs.json"
-    check(prs_file.exists(), "ERROR", f"prs.json missing in {repo_dir.name}")
+    prs_file = repo_dir / "prs"
+    check(storage.exists(prs_file), "ERROR", f"prs data missing in {repo_dir.name}")
 
-    if prs_file.exists():
-        prs = json.load(open(prs_file))
-        check(len(prs) > 0, "ERROR", f"{repo_dir.name}/prs.json is empty")
-        print(f"  prs.json:     {len(prs):>5} records")
+    if storage.exists(prs_file):
+        prs = storage.load_records(prs_file)
+        check(len(prs) > 0, "ERROR", f"{repo_dir.name}/prs is empty")
+        print(f"  prs:     {len(prs):>5} records")
 
         missing_fields, null_titles, out_of_range, dup_ids = 0, 0, 0, 0
         seen_ids = set()
@@ -125,13 +129,13 @@ for repo_dir in sorted(RAW_DIR.iterdir()):
         if dup_ids:        print(f"    [ERROR]   {dup_ids} duplicate IDs")
 
     # -- docs -------------------------------------------------
-    docs_file = repo_dir / "docs.json"
-    check(docs_file.exists(), "ERROR", f"docs.json missing in {repo_dir.name}")
+    docs_file = repo_dir / "docs"
+    check(storage.exists(docs_file), "ERROR", f"docs data missing in {repo_dir.name}")
 
-    if docs_file.exists():
-        docs = json.load(open(docs_file))
-        check(len(docs) > 0, "WARNING", f"{repo_dir.name}/docs.json is empty")
-        print(f"  docs.json:    {len(docs):>5} records")
+    if storage.exists(docs_file):
+        docs = storage.load_records(docs_file)
+        check(len(docs) > 0, "WARNING", f"{repo_dir.name}/docs is empty")
+        print(f"  docs:    {len(docs):>5} records")
 
         missing_fields, empty_content = 0, 0
         for r in docs:
@@ -145,6 +149,26 @@ for repo_dir in sorted(RAW_DIR.iterdir()):
 
         if empty_content: print(f"    [WARNING] {empty_content} empty content")
 
+# -- near duplicates (MinHash/LSH) ----------------------------------------------
+
+DEDUP = config.get("dedup", {})
+params = {"num_perm": DEDUP.get("num_perm", 128), "bands": DEDUP.get("bands", 16),
+          "threshold": DEDUP.get("threshold", 0.8), "shingle_size": DEDUP.get("shingle_size", 5),
+          "seed": config["project"]["seed"]}
+print(f"\n-- near duplicates (Jaccard >= {params['threshold']}) --")
+dup_results = find_near_duplicates([d for d in sorted(RAW_DIR.iterdir()) if d.is_dir()], params, DEDUP.get("workers"))
+for r in dup_results:
+    for kind in ["issues", "prs"]:
+        n_dups = sum(len(c["members"]) - 1 for c in r[kind])
+        check(n_dups == 0, "WARNING", f"{r['repo']}/{kind}: {n_dups} near-duplicates in {len(r[kind])} clusters")
+        if n_dups: print(f"  {r['repo']}/{kind}: {n_dups} near-duplicates in {len(r[kind])} clusters")
+
+dedup_out = Path(DEDUP.get("map_file", "data/processed/dedup_map.json"))
+dedup_out.parent.mkdir(parents=True, exist_ok=True)
+json.dump({"params": params, "clusters": dup_results, "canonical": canonical_map(dup_results)},
+          open(dedup_out, "w"), indent=2)
+print(f"  Duplicate clusters and canonical ids saved to {dedup_out}")
+
 # -- summary -------------------------------------------------------------------
 
 total = passed + failed + warnings